@@ -1,64 +1,1083 @@
-from flask import Flask, render_template_string, request, jsonify, session, redirect, url_for, send_file
+from flask import Flask, render_template_string, request, jsonify, session, redirect, url_for, send_file, Response, g
+from flask.sessions import SessionInterface, SessionMixin
+from itsdangerous import Signer, BadSignature
+import click
 import yt_dlp
 import requests
+import io
 import os
+import re
+import json
+import base64
+import calendar
+import hashlib
+import gzip
+import zlib
+import time
+import random
+import queue
 import sqlite3
 import secrets
-from werkzeug.security import generate_password_hash, check_password_hash
+import shutil
+import subprocess
+import threading
+import mimetypes
+import multiprocessing
+import socket
+import struct
+import ipaddress
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from urllib.parse import urlsplit, urlunsplit, urljoin, parse_qsl, urlencode, quote
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from prometheus_client import (Counter, Histogram, Gauge, CollectorRegistry, generate_latest, multiprocess,
+                               CONTENT_TYPE_LATEST, REGISTRY)
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, generate_password_hash, check_password_hash
+from werkzeug.utils import safe_join, secure_filename
+from werkzeug.datastructures import Headers, CallbackDict
+from werkzeug.http import parse_accept_header
 from functools import wraps
+from contextlib import contextmanager
+try:
+    import brotli
+except ImportError:  # opcional: sin brotli solo se sirven variantes gzip
+    brotli = None
+try:
+    import zstandard
+except ImportError:  # opcional: sin zstandard no se negocia zstd
+    zstandard = None
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # opcional: sin Pillow las miniaturas las genera ffmpeg (sin AVIF)
+    Image = None
 
 app = Flask(__name__)
-app.secret_key = secrets.token_hex(32)
 
 # Configuración
 DOWNLOAD_FOLDER = 'downloads'
-DATABASE = 'mediadownloader.db'
+DATABASE = os.environ.get('DATABASE', 'mediadownloader.db')
 os.makedirs(DOWNLOAD_FOLDER, exist_ok=True)
 
+# Clave de firma de cookies común a todos los workers: SECRET_KEY o un archivo persistente, por
+# defecto fuera del repositorio para que no acabe en un commit.
+# SECRET_KEY_FALLBACKS (separadas por comas) siguen validando cookies tras una rotación
+SECRET_KEY_FILE = os.environ.get('SECRET_KEY_FILE') or os.path.join(
+    os.environ.get('XDG_STATE_HOME') or os.path.expanduser('~/.local/state'), 'mediadownloader', 'secret_key')
+LEGACY_SECRET_KEY_FILE = '.secret_key'
+app.config['SECRET_KEY_FALLBACKS'] = [k for k in os.environ.get('SECRET_KEY_FALLBACKS', '').split(',') if k]
+
+# Sesiones: 'cookie' (firmada, por defecto), 'sqlite' (compartida entre workers) o 'memory' (un solo worker)
+SESSION_BACKEND = os.environ.get('SESSION_BACKEND', 'cookie')
+SESSION_LIFETIME = int(os.environ.get('SESSION_LIFETIME', 30 * 24 * 3600))
+SESSION_MAX_ENTRIES = 10000
+
+# Envío de /downloads: '' (gunicorn), 'x-sendfile' (Apache/lighttpd) o 'x-accel' (nginx).
+# Con 'x-accel' nginx necesita: location /protected-downloads/ { internal; alias /ruta/a/downloads/; }
+SENDFILE_MODE = os.environ.get('SENDFILE_MODE', '')
+SENDFILE_INTERNAL_PREFIX = os.environ.get('SENDFILE_INTERNAL_PREFIX', '/protected-downloads/')
+DOWNLOAD_MAX_AGE = 3600
+app.config['USE_X_SENDFILE'] = SENDFILE_MODE == 'x-sendfile'
+
+# Subidas: tamaño máximo por archivo, cuota por usuario y partes del protocolo reanudable
+MAX_UPLOAD_SIZE = int(os.environ.get('MAX_UPLOAD_SIZE', 2 * 1024 ** 3))
+USER_STORAGE_QUOTA = int(os.environ.get('USER_STORAGE_QUOTA', 10 * 1024 ** 3))
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+UPLOAD_EXPIRY = 24 * 3600
+UPLOAD_TMP_FOLDER = os.path.join(DOWNLOAD_FOLDER, '.uploads')
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_SIZE
+
+# Pool de conexiones SQLite por worker
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 8))
+DB_POOL_TIMEOUT = 10
+
+# Caché de metadatos ('memory' por proceso, 'sqlite' compartida entre workers)
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'sqlite')
+CACHE_DATABASE = os.environ.get('CACHE_DATABASE', 'cache.db')
+CACHE_TTL = int(os.environ.get('CACHE_TTL', 3600))
+CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', 5000))
+CACHE_EXPIRY_MARGIN = 300  # segundos antes de que caduque un enlace firmado
+
+# Paginación de items de playlists
+PAGE_SIZE_DEFAULT = 50
+PAGE_SIZE_MAX = 200
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', 1000))
+
+# Coalescencia de extracciones idénticas (entre workers mediante CACHE_DATABASE)
+SINGLEFLIGHT_SHARED = os.environ.get('SINGLEFLIGHT_SHARED', '1') == '1'
+SINGLEFLIGHT_LEASE_TTL = 60
+SINGLEFLIGHT_RESULT_TTL = 10
+
+# Cola de trabajos de extracción asíncrona
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 4))
+JOB_QUEUE_MAX = int(os.environ.get('JOB_QUEUE_MAX', 32))
+JOBS_PER_USER = int(os.environ.get('JOBS_PER_USER', 3))
+JOB_STALE_AFTER = 600
+JOB_RETENTION = 24 * 3600
+JOB_STREAM_TIMEOUT = 300
+
+# Descargas en el servidor (modo opcional de /process): yt-dlp y ffmpeg en procesos aparte
+DOWNLOAD_PROCESSES = int(os.environ.get('DOWNLOAD_PROCESSES', os.cpu_count() or 2))
+DOWNLOAD_QUEUE_MAX = int(os.environ.get('DOWNLOAD_QUEUE_MAX', 16))
+DOWNLOAD_MEDIA_PREFIX = 'media/'
+DOWNLOAD_PROGRESS_INTERVAL = 0.5
+# Límite de disco de downloads/media: las más antiguas se borran (salvo las que están en una playlist)
+DOWNLOAD_MEDIA_MAX_BYTES = int(os.environ.get('DOWNLOAD_MEDIA_MAX_BYTES', 10 * 1024 ** 3))
+DOWNLOAD_MEDIA_TTL = int(os.environ.get('DOWNLOAD_MEDIA_TTL', 7 * 24 * 3600))
+
+# Cliente HTTP saliente (tikwm y CDNs)
+HTTP_CONNECT_TIMEOUT = 3.05
+HTTP_READ_TIMEOUT = int(os.environ.get('HTTP_READ_TIMEOUT', 20))
+HTTP_RETRIES = 2
+HTTP_BACKOFF = 0.3
+HTTP_DEFAULT_POOL_SIZE = 10
+TIKWM_API_URL = os.environ.get('TIKWM_API_URL', 'https://www.tikwm.com/api/')
+HTTP_POOL_SIZES = {urlsplit(TIKWM_API_URL).hostname: 20}
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_RESET_TIMEOUT = 30
+# Los hosts los escribe el usuario: solo se guarda estado de los últimos BREAKER_MAX_HOSTS
+BREAKER_MAX_HOSTS = 1024
+PUBLIC_FETCH_MAX_REDIRECTS = 5
+
+# Contraseñas: hash fuera del hilo de la petición y límite de intentos
+# Por defecto las iteraciones de werkzeug, que suben con cada versión
+PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', f'pbkdf2:sha256:{DEFAULT_PBKDF2_ITERATIONS}')
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+PASSWORD_HASH_QUEUE_MAX = int(os.environ.get('PASSWORD_HASH_QUEUE_MAX', 16))
+PASSWORD_HASH_TIMEOUT = 10
+LOGIN_IP_BURST = int(os.environ.get('LOGIN_IP_BURST', 10))
+LOGIN_IP_PER_MINUTE = int(os.environ.get('LOGIN_IP_PER_MINUTE', 10))
+LOGIN_AROBASE_BURST = 5
+LOGIN_AROBASE_PER_MINUTE = 2
+RATE_LIMIT_MAX_KEYS = 10000
+
+# Compresión de respuestas dinámicas (JSON y HTML generados por las rutas)
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))
+COMPRESSION_LEVELS = {'zstd': 3, 'br': 5, 'gzip': 6}
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/javascript', 'text/html', 'text/plain',
+                          'text/css', 'text/javascript', 'image/svg+xml')
+# Rutas que ya sirven contenido comprimido o binario (medios, recursos precomprimidos)
+COMPRESSION_SKIP_PREFIXES = ('/downloads/', '/assets/', '/media/', '/thumb/')
+
+# Proxy de medios (/media): caché LRU en disco de los archivos servidos por los CDNs
+MEDIA_CACHE_FOLDER = os.environ.get('MEDIA_CACHE_FOLDER', 'media_cache')
+MEDIA_CACHE_MAX_BYTES = int(os.environ.get('MEDIA_CACHE_MAX_BYTES', 5 * 1024 ** 3))
+MEDIA_CACHE_MAX_OBJECT = int(os.environ.get('MEDIA_CACHE_MAX_OBJECT', 512 * 1024 ** 2))
+MEDIA_CHUNK_SIZE = 64 * 1024
+
+# Renovación en segundo plano de los enlaces firmados de los items (extracciones simultáneas por plataforma)
+LINK_REFRESH_MARGIN = int(os.environ.get('LINK_REFRESH_MARGIN', 1800))
+LINK_REFRESH_BUDGETS = {'youtube': 3, 'tiktok': 2, 'instagram': 1, 'facebook': 1}
+LINK_REFRESH_DEFAULT_BUDGET = 1
+LINK_REFRESH_QUEUE_MAX = 1000
+# Hilos de renovación, muy por debajo de DB_POOL_SIZE para no quitar conexiones a las peticiones
+LINK_REFRESH_WORKERS = int(os.environ.get('LINK_REFRESH_WORKERS', max(1, DB_POOL_SIZE // 2)))
+
+# Miniaturas (/thumb): anchos fijos, en el formato más ligero que acepte el navegador
+THUMB_WIDTHS = (160, 320, 640)
+THUMB_DEFAULT_WIDTH = 320
+THUMB_QUALITY = {'avif': 50, 'webp': 75, 'jpeg': 80}
+THUMB_CACHE_MAX_BYTES = int(os.environ.get('THUMB_CACHE_MAX_BYTES', 512 * 1024 ** 2))
+THUMB_SOURCE_MAX_BYTES = 10 * 1024 ** 2
+THUMB_WORKERS = int(os.environ.get('THUMB_WORKERS', 2))
+THUMB_TIMEOUT = 20
+FFMPEG = shutil.which('ffmpeg')
+
+# ==================== MÉTRICAS ====================
+# Con PROMETHEUS_MULTIPROC_DIR (lo fija gunicorn.conf.py) cada worker escribe sus valores en
+# archivos mmap de ese directorio y /metrics los suma, atienda quien atienda la petición
+METRICS_MULTIPROCESS = 'PROMETHEUS_MULTIPROC_DIR' in os.environ
+# Arrobas que pueden consultar /stats (separadas por comas); sin ninguna, /stats responde 404
+STATS_AROBASES = {a for a in os.environ.get('STATS_AROBASES', '').split(',') if a}
+
+REQUEST_COUNT = Counter('http_requests_total', 'Peticiones HTTP atendidas', ['method', 'endpoint', 'status'])
+REQUEST_LATENCY = Histogram('http_request_duration_seconds', 'Tiempo hasta devolver la respuesta (sin el cuerpo en streaming)',
+                            ['method', 'endpoint'])
+EXTRACTION_LATENCY = Histogram('media_extraction_seconds', 'Duración de las extracciones por plataforma',
+                               ['platform', 'outcome'],
+                               buckets=(0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120))
+UPSTREAM_LATENCY = Histogram('upstream_request_seconds', 'Latencia de cada intento contra servicios externos (tikwm, CDNs)',
+                             ['host', 'outcome'],
+                             buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20))
+SQLITE_LATENCY = Histogram('sqlite_query_seconds', 'Tiempo de execute() en SQLite hasta la primera fila',
+                           ['database', 'operation'],
+                           buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1))
+DOWNLOAD_BYTES = Counter('download_bytes_total', 'Bytes servidos desde /downloads', ['status'])
+JOBS_QUEUED = Gauge('jobs_queued', 'Trabajos de extracción esperando en la cola', multiprocess_mode='livesum')
+JOBS_RUNNING = Gauge('jobs_running', 'Trabajos de extracción en ejecución', multiprocess_mode='livesum')
+JOBS_FINISHED = Counter('jobs_finished_total', 'Trabajos de extracción terminados', ['status'])
+MEDIA_PROXY_REQUESTS = Counter('media_proxy_requests_total', 'Peticiones a /media según la caché en disco', ['result'])
+MEDIA_RESOLVES = Counter('media_resolves_total', 'Enlaces de items renovados desde su página de origen', ['outcome'])
+
+METRIC_PLATFORMS = ('youtube', 'instagram', 'facebook', 'tiktok')
+SQL_OPERATIONS = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'BEGIN', 'PRAGMA')
+
+
+_sqlite_timers = {}
+
+
+def sqlite_timer(database, sql):
+    """Histograma ya etiquetado con la base y el verbo de la sentencia (cardinalidad acotada).
+
+    labels() toma un lock en cada llamada; en la ruta caliente se reutiliza el hijo.
+    """
+    verb = sql.lstrip()[:6].upper()
+    key = (database, verb if verb in SQL_OPERATIONS else 'OTHER')
+    timer = _sqlite_timers.get(key)
+    if timer is None:
+        timer = _sqlite_timers[key] = SQLITE_LATENCY.labels(*key)
+    return timer
+
+
+class TimedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            sqlite_timer(self.connection.database_label, sql).observe(time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            sqlite_timer(self.connection.database_label, sql).observe(time.perf_counter() - start)
+
+
+class TimedConnection(sqlite3.Connection):
+    """Conexión que mide cada sentencia (sqlite3.connect(..., factory=TimedConnection))"""
+
+    database_label = 'main'
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        endpoint = request.endpoint or 'unmatched'
+        REQUEST_LATENCY.labels(request.method, endpoint).observe(time.perf_counter() - started)
+        REQUEST_COUNT.labels(request.method, endpoint, response.status_code).inc()
+    return response
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Métricas en formato Prometheus, agregadas entre workers"""
+    if METRICS_MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
 # ==================== BASE DE DATOS ====================
+class ConnectionPool:
+    """Pool de conexiones SQLite por worker.
+
+    Las conexiones se reutilizan entre peticiones, de modo que su caché de
+    sentencias preparadas (cached_statements) sigue caliente.
+    """
+
+    PRAGMAS = (
+        'PRAGMA journal_mode=WAL',
+        'PRAGMA synchronous=NORMAL',
+        'PRAGMA cache_size=-16000',  # 16 MB
+        'PRAGMA mmap_size=268435456',  # 256 MB
+        'PRAGMA temp_store=MEMORY',
+        'PRAGMA foreign_keys=ON',
+    )
+
+    def __init__(self, path, size, timeout):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        # Tras un fork las conexiones del proceso padre no se pueden usar
+        self.pid = os.getpid()
+        self.idle = queue.LifoQueue()
+        self.created = 0
+        self.in_use = 0
+        self.waits = 0
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False, cached_statements=256,
+                               factory=TimedConnection)
+        conn.row_factory = sqlite3.Row
+        for pragma in self.PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def acquire(self):
+        with self.lock:
+            if self.pid != os.getpid():
+                self._reset()
+            try:
+                conn = self.idle.get_nowait()
+            except queue.Empty:
+                conn = None
+                if self.created < self.size:
+                    self.created += 1
+                    try:
+                        conn = self.connect()
+                    except Exception:
+                        self.created -= 1
+                        raise
+                else:
+                    self.waits += 1
+            if conn is not None:
+                self.in_use += 1
+                return conn
+            idle = self.idle
+
+        try:
+            conn = idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError('No hay conexiones libres a la base de datos')
+        with self.lock:
+            self.in_use += 1
+        return conn
+
+    def release(self, conn):
+        with self.lock:
+            if self.pid != os.getpid():
+                return
+            self.in_use -= 1
+        try:
+            # Nunca se devuelve al pool una transacción a medias (p. ej. un return anticipado)
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            with self.lock:
+                self.created -= 1
+            return
+        self.idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def stats(self):
+        with self.lock:
+            return {'size': self.size, 'open': self.created, 'in_use': self.in_use,
+                    'idle': self.idle.qsize(), 'waits': self.waits}
+
+
+db_pool = ConnectionPool(DATABASE, DB_POOL_SIZE, DB_POOL_TIMEOUT)
+
+
+def get_db():
+    """Conexión de la petición actual; se devuelve al pool al terminar"""
+    if 'db' not in g:
+        g.db = db_pool.acquire()
+    return g.db
+
+
+@app.teardown_appcontext
+def release_db(exception):
+    conn = g.pop('db', None)
+    if conn is not None:
+        db_pool.release(conn)
+
+
+# ==================== MIGRACIONES ====================
+# Cada migración es (versión, [sentencias]). La versión aplicada se guarda en
+# PRAGMA user_version; nunca se edita una migración ya publicada, se añade otra.
+MIGRATIONS = [
+    # 1: esquema inicial
+    (1, [
+        '''CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            arobase TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''',
+        '''CREATE TABLE IF NOT EXISTS playlists (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            description TEXT,
+            visibility TEXT DEFAULT 'private',
+            access_code TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS playlist_items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            playlist_id INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            url TEXT NOT NULL,
+            media_type TEXT NOT NULL,
+            thumbnail TEXT,
+            duration TEXT,
+            added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (playlist_id) REFERENCES playlists(id)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            job_key TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            progress INTEGER DEFAULT 0,
+            message TEXT,
+            result TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )''',
+        # Solo puede haber un trabajo activo por clave (url normalizada, plataforma, formato)
+        '''CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_active_key
+           ON jobs(job_key) WHERE status IN ('queued', 'running')''',
+        'CREATE INDEX IF NOT EXISTS idx_jobs_user_status ON jobs(user_id, status)',
+    ]),
+    # 2: ON DELETE CASCADE (SQLite obliga a reconstruir las tablas) e índices de consulta
+    (2, [
+        '''CREATE TABLE playlists_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            description TEXT,
+            visibility TEXT DEFAULT 'private',
+            access_code TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )''',
+        # El borrado anterior no era en cascada: se descartan las filas huérfanas que dejó
+        '''INSERT INTO playlists_new
+           SELECT id, user_id, name, description, visibility, access_code, created_at FROM playlists
+           WHERE user_id IN (SELECT id FROM users)''',
+        'DROP TABLE playlists',
+        'ALTER TABLE playlists_new RENAME TO playlists',
+        '''CREATE TABLE playlist_items_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            playlist_id INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            url TEXT NOT NULL,
+            media_type TEXT NOT NULL,
+            thumbnail TEXT,
+            duration TEXT,
+            added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (playlist_id) REFERENCES playlists(id) ON DELETE CASCADE
+        )''',
+        '''INSERT INTO playlist_items_new
+           SELECT id, playlist_id, title, url, media_type, thumbnail, duration, added_at FROM playlist_items
+           WHERE playlist_id IN (SELECT id FROM playlists)''',
+        'DROP TABLE playlist_items',
+        'ALTER TABLE playlist_items_new RENAME TO playlist_items',
+        # Los códigos solo tienen sentido en playlists 'code' y no pueden repetirse
+        "UPDATE playlists SET access_code = NULL WHERE visibility != 'code' OR access_code = ''",
+        '''UPDATE playlists SET access_code = access_code || '-' || id
+           WHERE access_code IS NOT NULL AND EXISTS (
+               SELECT 1 FROM playlists p2 WHERE p2.access_code = playlists.access_code AND p2.id < playlists.id)''',
+        'CREATE INDEX idx_playlists_user_created ON playlists(user_id, created_at)',
+        'CREATE UNIQUE INDEX idx_playlists_access_code ON playlists(access_code) WHERE access_code IS NOT NULL',
+        'CREATE INDEX idx_playlist_items_playlist_added ON playlist_items(playlist_id, added_at)',
+    ]),
+    # 3: contadores desnormalizados en playlists mantenidos por triggers
+    (3, [
+        'ALTER TABLE playlist_items ADD COLUMN duration_seconds INTEGER',
+        'ALTER TABLE playlist_items ADD COLUMN size_bytes INTEGER',
+        'ALTER TABLE playlists ADD COLUMN item_count INTEGER NOT NULL DEFAULT 0',
+        'ALTER TABLE playlists ADD COLUMN total_duration INTEGER NOT NULL DEFAULT 0',
+        'ALTER TABLE playlists ADD COLUMN total_bytes INTEGER NOT NULL DEFAULT 0',
+        # duration guardaba texto: 'M:SS' (yt-dlp), '15s' (TikTok) o 'N/A'
+        '''UPDATE playlist_items SET duration_seconds = CASE
+               WHEN duration LIKE '%s' THEN CAST(rtrim(duration, 's') AS INTEGER)
+               WHEN instr(duration, ':') > 0 THEN
+                   CAST(substr(duration, 1, instr(duration, ':') - 1) AS INTEGER) * 60 +
+                   CAST(substr(duration, instr(duration, ':') + 1) AS INTEGER)
+           END''',
+        '''CREATE TRIGGER trg_playlist_items_insert AFTER INSERT ON playlist_items BEGIN
+               UPDATE playlists SET item_count = item_count + 1,
+                                    total_duration = total_duration + IFNULL(NEW.duration_seconds, 0),
+                                    total_bytes = total_bytes + IFNULL(NEW.size_bytes, 0)
+               WHERE id = NEW.playlist_id;
+           END''',
+        '''CREATE TRIGGER trg_playlist_items_delete AFTER DELETE ON playlist_items BEGIN
+               UPDATE playlists SET item_count = item_count - 1,
+                                    total_duration = total_duration - IFNULL(OLD.duration_seconds, 0),
+                                    total_bytes = total_bytes - IFNULL(OLD.size_bytes, 0)
+               WHERE id = OLD.playlist_id;
+           END''',
+        '''CREATE TRIGGER trg_playlist_items_update
+           AFTER UPDATE OF playlist_id, duration_seconds, size_bytes ON playlist_items BEGIN
+               UPDATE playlists SET item_count = item_count - 1,
+                                    total_duration = total_duration - IFNULL(OLD.duration_seconds, 0),
+                                    total_bytes = total_bytes - IFNULL(OLD.size_bytes, 0)
+               WHERE id = OLD.playlist_id;
+               UPDATE playlists SET item_count = item_count + 1,
+                                    total_duration = total_duration + IFNULL(NEW.duration_seconds, 0),
+                                    total_bytes = total_bytes + IFNULL(NEW.size_bytes, 0)
+               WHERE id = NEW.playlist_id;
+           END''',
+        # Relleno inicial; a partir de aquí los triggers mantienen los contadores
+        '''UPDATE playlists SET
+               item_count = (SELECT COUNT(*) FROM playlist_items WHERE playlist_id = playlists.id),
+               total_duration = (SELECT IFNULL(SUM(duration_seconds), 0) FROM playlist_items
+                                 WHERE playlist_id = playlists.id),
+               total_bytes = (SELECT IFNULL(SUM(size_bytes), 0) FROM playlist_items
+                              WHERE playlist_id = playlists.id)''',
+    ]),
+    # 4: subidas por partes reanudables
+    (4, [
+        '''CREATE TABLE uploads (
+            id TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            playlist_id INTEGER NOT NULL,
+            filename TEXT NOT NULL,
+            path TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            received INTEGER NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+            FOREIGN KEY (playlist_id) REFERENCES playlists(id) ON DELETE CASCADE
+        )''',
+        'CREATE INDEX idx_uploads_user ON uploads(user_id)',
+        'CREATE INDEX idx_uploads_updated ON uploads(updated_at)',
+    ]),
+    # 5: almacén de blobs direccionado por contenido con contador de referencias
+    (5, [
+        '''CREATE TABLE blobs (
+            hash TEXT PRIMARY KEY,
+            path TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            refcount INTEGER NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL
+        )''',
+        'CREATE INDEX idx_blobs_unreferenced ON blobs(refcount) WHERE refcount <= 0',
+        'ALTER TABLE playlist_items ADD COLUMN blob_hash TEXT REFERENCES blobs(hash)',
+        'CREATE INDEX idx_playlist_items_blob ON playlist_items(blob_hash)',
+        '''CREATE TRIGGER trg_blob_ref_insert AFTER INSERT ON playlist_items
+           WHEN NEW.blob_hash IS NOT NULL BEGIN
+               UPDATE blobs SET refcount = refcount + 1 WHERE hash = NEW.blob_hash;
+           END''',
+        '''CREATE TRIGGER trg_blob_ref_delete AFTER DELETE ON playlist_items
+           WHEN OLD.blob_hash IS NOT NULL BEGIN
+               UPDATE blobs SET refcount = refcount - 1 WHERE hash = OLD.blob_hash;
+           END''',
+        '''CREATE TRIGGER trg_blob_ref_update AFTER UPDATE OF blob_hash ON playlist_items BEGIN
+               UPDATE blobs SET refcount = refcount - 1 WHERE hash = OLD.blob_hash;
+               UPDATE blobs SET refcount = refcount + 1 WHERE hash = NEW.blob_hash;
+           END''',
+    ]),
+    # 6: sesiones en el servidor (SESSION_BACKEND=sqlite), compartidas entre workers
+    (6, [
+        '''CREATE TABLE sessions (
+            id TEXT PRIMARY KEY,
+            user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+            data TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )''',
+        'CREATE INDEX idx_sessions_expires ON sessions(expires_at)',
+        'CREATE INDEX idx_sessions_user ON sessions(user_id)',
+    ]),
+    # 7: página de origen de cada item, para renovar los enlaces firmados cuando caducan
+    (7, [
+        'ALTER TABLE playlist_items ADD COLUMN source_url TEXT',
+        'ALTER TABLE playlist_items ADD COLUMN platform TEXT',
+    ]),
+    # 8: caducidad del enlace resuelto, para renovarlo antes de que deje de funcionar
+    (8, [
+        'ALTER TABLE playlist_items ADD COLUMN url_expires_at REAL',
+    ]),
+    # 9: archivos descargados en el servidor, uno por vídeo y formato
+    (9, [
+        '''CREATE TABLE downloads (
+            video_key TEXT NOT NULL,
+            format TEXT NOT NULL,
+            source_key TEXT NOT NULL,
+            path TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            result TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            PRIMARY KEY (video_key, format)
+        )''',
+        'CREATE INDEX idx_downloads_source ON downloads(source_key, format)',
+    ]),
+    # 10: usuarios que se unieron a un trabajo ajeno con la misma clave (pueden ver su estado)
+    (10, [
+        '''CREATE TABLE job_users (
+            job_id TEXT NOT NULL REFERENCES jobs(id) ON DELETE CASCADE,
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            PRIMARY KEY (job_id, user_id)
+        )''',
+    ]),
+]
+
+
+def migrate(conn, target=None):
+    """Aplica las migraciones pendientes hasta target (o la última)"""
+    target = target or MIGRATIONS[-1][0]
+    conn.isolation_level = None
+    # foreign_keys no se puede cambiar dentro de una transacción y debe estar
+    # desactivado mientras se reconstruyen tablas
+    conn.execute('PRAGMA foreign_keys=OFF')
+    # BEGIN IMMEDIATE serializa a los workers que arrancan a la vez
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        for number, statements in MIGRATIONS:
+            if version < number <= target:
+                for statement in statements:
+                    conn.execute(statement)
+                conn.execute(f'PRAGMA user_version = {number}')
+        problems = conn.execute('PRAGMA foreign_key_check').fetchall()
+        if problems:
+            raise sqlite3.IntegrityError(f'Migración con claves foráneas rotas: {problems[:5]}')
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    finally:
+        conn.execute('PRAGMA foreign_keys=ON')
+        conn.isolation_level = ''
+
+
 def init_db():
-    conn = sqlite3.connect(DATABASE)
-    c = conn.cursor()
-    
-    # Tabla de usuarios
-    c.execute('''CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        username TEXT UNIQUE NOT NULL,
-        arobase TEXT UNIQUE NOT NULL,
-        password TEXT NOT NULL,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )''')
-    
-    # Tabla de playlists
-    c.execute('''CREATE TABLE IF NOT EXISTS playlists (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER NOT NULL,
-        name TEXT NOT NULL,
-        description TEXT,
-        visibility TEXT DEFAULT 'private',
-        access_code TEXT,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (user_id) REFERENCES users(id)
-    )''')
-    
-    # Tabla de medios en playlists
-    c.execute('''CREATE TABLE IF NOT EXISTS playlist_items (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        playlist_id INTEGER NOT NULL,
-        title TEXT NOT NULL,
-        url TEXT NOT NULL,
-        media_type TEXT NOT NULL,
-        thumbnail TEXT,
-        duration TEXT,
-        added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (playlist_id) REFERENCES playlists(id)
-    )''')
-    
-    conn.commit()
-    conn.close()
+    conn = db_pool.connect()
+    try:
+        migrate(conn)
+    finally:
+        conn.close()
 
 init_db()
 
+# ==================== SESIONES ====================
+def load_secret_key():
+    """SECRET_KEY del entorno o la guardada en SECRET_KEY_FILE (se crea la primera vez)"""
+    key = os.environ.get('SECRET_KEY')
+    if key:
+        return key
+    path = SECRET_KEY_FILE
+    # Las instalaciones anteriores la guardaban en el directorio de trabajo: se sigue usando
+    # para no cerrar todas las sesiones al actualizar
+    if 'SECRET_KEY_FILE' not in os.environ and os.path.isfile(LEGACY_SECRET_KEY_FILE):
+        path = LEGACY_SECRET_KEY_FILE
+    os.makedirs(os.path.dirname(path) or '.', mode=0o700, exist_ok=True)
+    try:
+        # O_EXCL: si varios workers arrancan a la vez solo uno escribe la clave
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        for _ in range(50):
+            with open(path) as f:
+                key = f.read().strip()
+            if key:
+                return key
+            time.sleep(0.1)
+        raise RuntimeError(f'{path} está vacío')
+    key = secrets.token_hex(32)
+    with os.fdopen(fd, 'w') as f:
+        f.write(key)
+    return key
+
+
+app.secret_key = load_secret_key()
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    """Sesión cuyo contenido vive en el servidor; la cookie solo lleva el id firmado"""
+
+    def __init__(self, initial=None, sid=None, expires_at=None):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.expires_at = expires_at
+        self.initial_user_id = self.get('user_id')
+        self.modified = False
+
+
+class SQLiteSessionStore:
+    """Sesiones en la tabla sessions, compartidas por todos los workers"""
+
+    PRUNE_INTERVAL = 300
+
+    def __init__(self):
+        self.pruned_at = 0
+
+    def get(self, sid):
+        row = get_db().execute('SELECT data, expires_at FROM sessions WHERE id = ? AND expires_at > ?',
+                               (sid, time.time())).fetchone()
+        return (json.loads(row[0]), row[1]) if row else None
+
+    def connection(self):
+        # Las escrituras van en su propia conexión para no confirmar lo que la vista dejó a medias.
+        # La de la petición ya no se usa (save_session corre tras la vista): se devuelve antes al
+        # pool para que, con tantos hilos como conexiones, nadie se quede esperando una segunda.
+        release_db(None)
+        return db_pool.connection()
+
+    def save(self, sid, data, user_id, expires_at):
+        with self.connection() as conn:
+            conn.execute('INSERT OR REPLACE INTO sessions (id, user_id, data, expires_at) VALUES (?, ?, ?, ?)',
+                         (sid, user_id, json.dumps(data), expires_at))
+            now = time.time()
+            if now - self.pruned_at > self.PRUNE_INTERVAL:
+                self.pruned_at = now
+                conn.execute('DELETE FROM sessions WHERE expires_at <= ?', (now,))
+            conn.commit()
+
+    def delete(self, sid):
+        with self.connection() as conn:
+            conn.execute('DELETE FROM sessions WHERE id = ?', (sid,))
+            conn.commit()
+
+    def delete_user(self, user_id):
+        with self.connection() as conn:
+            count = conn.execute('DELETE FROM sessions WHERE user_id = ?', (user_id,)).rowcount
+            conn.commit()
+        return count
+
+
+class MemorySessionStore:
+    """Sesiones en memoria con expulsión LRU; solo sirve con un único worker"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, sid):
+        with self.lock:
+            entry = self.entries.get(sid)
+            if entry is None or entry[2] <= time.time():
+                self.entries.pop(sid, None)
+                return None
+            self.entries.move_to_end(sid)
+            return dict(entry[0]), entry[2]
+
+    def save(self, sid, data, user_id, expires_at):
+        with self.lock:
+            self.entries[sid] = (dict(data), user_id, expires_at)
+            self.entries.move_to_end(sid)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, sid):
+        with self.lock:
+            self.entries.pop(sid, None)
+
+    def delete_user(self, user_id):
+        with self.lock:
+            sids = [sid for sid, entry in self.entries.items() if entry[1] == user_id]
+            for sid in sids:
+                del self.entries[sid]
+        return len(sids)
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """Guarda la sesión en un almacén del servidor y firma el id con la clave actual o sus fallbacks"""
+
+    def __init__(self, store, lifetime):
+        self.store = store
+        self.lifetime = lifetime
+
+    def signer(self, app):
+        # Como en Flask, la última clave firma y todas verifican
+        keys = [*app.config['SECRET_KEY_FALLBACKS'], app.secret_key]
+        return Signer(keys, salt='session-id', key_derivation='hmac', digest_method=hashlib.sha256)
+
+    def open_session(self, app, request):
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if cookie:
+            try:
+                sid = self.signer(app).unsign(cookie).decode()
+            except BadSignature:
+                sid = None
+            stored = self.store.get(sid) if sid else None
+            if stored is not None:
+                return ServerSession(stored[0], sid, stored[1])
+        return ServerSession()
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        response.vary.add('Cookie')
+
+        if not session:
+            if session.sid:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        now = time.time()
+        # Sin cambios solo se reescribe cuando ha pasado la mitad de la vida de la sesión
+        if not session.modified and session.expires_at and session.expires_at - now > self.lifetime / 2:
+            return
+
+        user_id = session.get('user_id')
+        if session.sid and user_id != session.initial_user_id:
+            # Id nuevo al iniciar o cambiar de sesión (fijación de sesión)
+            self.store.delete(session.sid)
+            session.sid = None
+        sid = session.sid or secrets.token_urlsafe(32)
+        self.store.save(sid, dict(session), user_id, now + self.lifetime)
+        response.set_cookie(name, self.signer(app).sign(sid).decode(),
+                            expires=self.get_expiration_time(app, session), httponly=self.get_cookie_httponly(app),
+                            domain=domain, path=path, secure=self.get_cookie_secure(app),
+                            samesite=self.get_cookie_samesite(app))
+
+
+if SESSION_BACKEND == 'sqlite':
+    app.session_interface = ServerSideSessionInterface(SQLiteSessionStore(), SESSION_LIFETIME)
+elif SESSION_BACKEND == 'memory':
+    app.session_interface = ServerSideSessionInterface(MemorySessionStore(SESSION_MAX_ENTRIES), SESSION_LIFETIME)
+
+
+@app.cli.command('revoke-sessions')
+@click.argument('arobase')
+def revoke_sessions_command(arobase):
+    """Cierra todas las sesiones de un usuario (solo con sesiones en el servidor)"""
+    if not isinstance(app.session_interface, ServerSideSessionInterface):
+        click.echo('Con SESSION_BACKEND=cookie las sesiones no se pueden revocar; rota SECRET_KEY', err=True)
+        return
+    user = get_db().execute('SELECT id FROM users WHERE arobase = ?', (arobase,)).fetchone()
+    if user is None:
+        click.echo(f'{arobase} no existe', err=True)
+        return
+    click.echo(f'{app.session_interface.store.delete_user(user[0])} sesiones cerradas')
+
+# ==================== CONTADORES DE PLAYLISTS ====================
+COUNTER_QUERY = '''SELECT p.id, p.item_count, p.total_duration, p.total_bytes,
+                          COUNT(pi.id) AS real_count,
+                          IFNULL(SUM(pi.duration_seconds), 0) AS real_duration,
+                          IFNULL(SUM(pi.size_bytes), 0) AS real_bytes
+                   FROM playlists p
+                   LEFT JOIN playlist_items pi ON pi.playlist_id = p.id
+                   GROUP BY p.id
+                   HAVING p.item_count != real_count OR p.total_duration != real_duration
+                       OR p.total_bytes != real_bytes'''
+
+
+def duration_to_seconds(value):
+    """Segundos a partir de 'M:SS', 'H:MM:SS', '15s' o un número"""
+    if isinstance(value, (int, float)):
+        return int(value)
+    if not value or not isinstance(value, str):
+        return None
+    try:
+        if value.endswith('s'):
+            return int(value[:-1])
+        seconds = 0
+        for part in value.split(':'):
+            seconds = seconds * 60 + int(part)
+        return seconds
+    except ValueError:
+        return None
+
+
+def check_playlist_counters(conn, fix=False):
+    """Playlists cuyos contadores no cuadran con sus items (y los corrige si fix)"""
+    broken = [dict(row) for row in conn.execute(COUNTER_QUERY).fetchall()]
+    if fix and broken:
+        conn.executemany('''UPDATE playlists SET item_count = ?, total_duration = ?, total_bytes = ?
+                            WHERE id = ?''',
+                         [(p['real_count'], p['real_duration'], p['real_bytes'], p['id']) for p in broken])
+        conn.commit()
+    return broken
+
+
+def backfill_item_sizes(conn):
+    """Rellena size_bytes de los archivos subidos que aún no lo tienen"""
+    rows = conn.execute('''SELECT id, url FROM playlist_items
+                           WHERE size_bytes IS NULL AND url LIKE '/downloads/%' ''').fetchall()
+    updates = []
+    for item_id, url in rows:
+        path = os.path.join(DOWNLOAD_FOLDER, url[len('/downloads/'):])
+        if os.path.isfile(path):
+            updates.append((os.path.getsize(path), item_id))
+    # Los triggers de UPDATE trasladan los tamaños a total_bytes
+    conn.executemany('UPDATE playlist_items SET size_bytes = ? WHERE id = ?', updates)
+    conn.commit()
+    return len(updates)
+
+
+@app.cli.command('backfill-counters')
+def backfill_counters_command():
+    """Rellena tamaños de archivos y recalcula los contadores de playlists"""
+    with db_pool.connection() as conn:
+        sizes = backfill_item_sizes(conn)
+        fixed = check_playlist_counters(conn, fix=True)
+    click.echo(f'{sizes} tamaños rellenados, {len(fixed)} playlists corregidas')
+
+
+@app.cli.command('check-counters')
+def check_counters_command():
+    """Comprueba que item_count/total_duration/total_bytes cuadran con playlist_items"""
+    with db_pool.connection() as conn:
+        broken = check_playlist_counters(conn)
+    for p in broken:
+        click.echo(f"playlist {p['id']}: items {p['item_count']}/{p['real_count']}, "
+              f"duración {p['total_duration']}/{p['real_duration']}, bytes {p['total_bytes']}/{p['real_bytes']}")
+    click.echo('Contadores correctos' if not broken else f'{len(broken)} playlists con contadores incorrectos')
+
+# ==================== PAGINACIÓN ====================
+def encode_cursor(item):
+    """Cursor opaco con la posición (added_at, id) del último item devuelto"""
+    raw = f"{item['added_at']}|{item['id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+    added_at, item_id = raw.rsplit('|', 1)
+    return added_at, int(item_id)
+
+
+def page_limit(value):
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        return PAGE_SIZE_DEFAULT
+    return max(1, min(limit, PAGE_SIZE_MAX))
+
+
+def fetch_items_page(conn, playlist_id, cursor=None, limit=None):
+    """Página de items (más recientes primero) y cursor de la siguiente, o None si no hay más.
+
+    Keyset sobre (added_at, id): cada página es un rango del índice
+    idx_playlist_items_playlist_added, sin OFFSET.
+    """
+    limit = page_limit(limit)
+    if cursor:
+        added_at, item_id = decode_cursor(cursor)
+        rows = conn.execute('''SELECT * FROM playlist_items
+                               WHERE playlist_id = ? AND (added_at, id) < (?, ?)
+                               ORDER BY added_at DESC, id DESC LIMIT ?''',
+                            (playlist_id, added_at, item_id, limit + 1)).fetchall()
+    else:
+        rows = conn.execute('''SELECT * FROM playlist_items WHERE playlist_id = ?
+                               ORDER BY added_at DESC, id DESC LIMIT ?''',
+                            (playlist_id, limit + 1)).fetchall()
+    items = [dict(row) for row in rows[:limit]]
+    next_cursor = encode_cursor(items[-1]) if len(rows) > limit else None
+    return items, next_cursor
+
+# ==================== ALMACÉN DE BLOBS ====================
+# Los archivos subidos se guardan una sola vez por contenido en
+# downloads/blobs/ab/cd/<sha256><ext>; playlist_items.blob_hash los referencia
+# y los triggers mantienen blobs.refcount.
+BLOB_PREFIX = 'blobs/'
+
+
+def blob_relpath(digest, ext):
+    return f'{BLOB_PREFIX}{digest[:2]}/{digest[2:4]}/{digest}{ext}'
+
+
+def blob_extension(filename):
+    ext = os.path.splitext(secure_filename(filename or ''))[1].lower()
+    return ext if len(ext) <= 10 else ''
+
+
+def temp_upload_path():
+    os.makedirs(UPLOAD_TMP_FOLDER, exist_ok=True)
+    return os.path.join(UPLOAD_TMP_FOLDER, secrets.token_hex(16))
+
+
+def hash_stream_to_file(stream, path):
+    """Copia el stream a path calculando el SHA-256 en la misma pasada"""
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'wb') as f:
+        while True:
+            block = stream.read(1024 * 1024)
+            if not block:
+                break
+            digest.update(block)
+            f.write(block)
+            size += len(block)
+    return digest.hexdigest(), size
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def store_blob(conn, tmp_path, digest, size, ext):
+    """Mueve tmp_path al almacén (o lo descarta si ese contenido ya existe) y devuelve la ruta relativa.
+
+    Debe llamarse dentro de la transacción que inserta el playlist_item: el
+    INSERT OR IGNORE toma el bloqueo de escritura y gc_blobs no puede borrar
+    el blob entre medias.
+    """
+    relpath = blob_relpath(digest, ext)
+    conn.execute('INSERT OR IGNORE INTO blobs (hash, path, size, refcount, created_at) VALUES (?, ?, ?, 0, ?)',
+                 (digest, relpath, size, time.time()))
+    relpath = conn.execute('SELECT path FROM blobs WHERE hash = ?', (digest,)).fetchone()[0]
+    dest = os.path.join(DOWNLOAD_FOLDER, relpath)
+    if os.path.exists(dest):
+        os.remove(tmp_path)
+    else:
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        os.replace(tmp_path, dest)
+    return relpath
+
+
+def remove_empty_shards(folder):
+    """Borra los directorios de reparto (ab/cd/) que se han quedado vacíos, sin tocar blobs/"""
+    root = os.path.abspath(os.path.join(DOWNLOAD_FOLDER, BLOB_PREFIX))
+    folder = os.path.abspath(folder)
+    while folder.startswith(root + os.sep):
+        try:
+            os.rmdir(folder)
+        except OSError:
+            # No está vacío (u otro proceso ya lo borró)
+            return
+        folder = os.path.dirname(folder)
+
+
+def gc_blobs(conn):
+    """Borra los blobs que ya no referencia ningún item"""
+    if not conn.in_transaction:
+        conn.execute('BEGIN IMMEDIATE')
+    try:
+        rows = conn.execute('SELECT hash, path FROM blobs WHERE refcount <= 0').fetchall()
+        for digest, relpath in rows:
+            # El archivo se borra antes de confirmar: una subida concurrente del mismo
+            # contenido espera al bloqueo y vuelve a crear fila y archivo
+            path = os.path.join(DOWNLOAD_FOLDER, relpath)
+            if os.path.exists(path):
+                os.remove(path)
+                remove_empty_shards(os.path.dirname(path))
+            conn.execute('DELETE FROM blobs WHERE hash = ?', (digest,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return len(rows)
+
 # ==================== DECORADORES ====================
 def login_required(f):
     @wraps(f)
@@ -68,1608 +1087,2134 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
-# ==================== HTML TEMPLATE ====================
-HTML_TEMPLATE = '''
-<!DOCTYPE html>
-<html lang="es">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>MediaDownloaderPRO v2.0</title>
-    <script src="https://www.google.com/recaptcha/api.js" async defer></script>
-    <style>
-        * {
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-        }
-        
-        body {
-            font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-            background: linear-gradient(135deg, #0f0c29, #302b63, #24243e);
-            color: #fff;
-            min-height: 100vh;
-            padding: 20px;
-        }
-        
-        .container {
-            max-width: 1200px;
-            margin: 0 auto;
-        }
-        
-        .header {
-            text-align: center;
-            padding: 40px 0;
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            border-radius: 20px;
-            margin-bottom: 40px;
-            box-shadow: 0 20px 60px rgba(102, 126, 234, 0.4);
-        }
-        
-        .header h1 {
-            font-size: 3em;
-            font-weight: 900;
-            background: linear-gradient(45deg, #fff, #00f2ff);
-            -webkit-background-clip: text;
-            -webkit-text-fill-color: transparent;
-            text-shadow: 0 0 30px rgba(0, 242, 255, 0.5);
-        }
-        
-        .user-info {
-            position: absolute;
-            top: 20px;
-            right: 20px;
-            background: rgba(255, 255, 255, 0.1);
-            backdrop-filter: blur(10px);
-            padding: 15px 25px;
-            border-radius: 15px;
-            display: none;
-        }
-        
-        .user-info.active {
-            display: block;
-        }
-        
-        .logout-btn {
-            background: linear-gradient(135deg, #f093fb 0%, #f5576c 100%);
-            border: none;
-            padding: 10px 20px;
-            border-radius: 8px;
-            color: #fff;
-            cursor: pointer;
-            margin-left: 15px;
-            font-weight: 600;
-        }
-        
-        /* AUTH STYLES */
-        .auth-container {
-            max-width: 450px;
-            margin: 50px auto;
-            background: rgba(255, 255, 255, 0.05);
-            backdrop-filter: blur(10px);
-            padding: 40px;
-            border-radius: 20px;
-            border: 1px solid rgba(255, 255, 255, 0.1);
-        }
-        
-        .auth-tabs {
-            display: flex;
-            gap: 10px;
-            margin-bottom: 30px;
-        }
-        
-        .auth-tab {
-            flex: 1;
-            padding: 15px;
-            background: rgba(102, 126, 234, 0.2);
-            border: none;
-            border-radius: 10px;
-            color: #fff;
-            cursor: pointer;
-            font-weight: 600;
-            transition: all 0.3s;
-        }
-        
-        .auth-tab.active {
-            background: linear-gradient(135deg, #667eea, #764ba2);
-        }
-        
-        .auth-form {
-            display: none;
-        }
-        
-        .auth-form.active {
-            display: block;
-        }
-        
-        .form-group {
-            margin-bottom: 20px;
-        }
-        
-        .form-group label {
-            display: block;
-            margin-bottom: 8px;
-            color: #00f2ff;
-            font-weight: 600;
-        }
-        
-        .form-input {
-            width: 100%;
-            padding: 15px 20px;
-            border: 2px solid rgba(102, 126, 234, 0.5);
-            background: rgba(0, 0, 0, 0.3);
-            color: #fff;
-            border-radius: 12px;
-            font-size: 16px;
-        }
-        
-        .form-input:focus {
-            outline: none;
-            border-color: #667eea;
-            box-shadow: 0 0 20px rgba(102, 126, 234, 0.5);
-        }
-        
-        .submit-btn {
-            width: 100%;
-            padding: 18px;
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            border: none;
-            border-radius: 12px;
-            color: #fff;
-            font-size: 18px;
-            font-weight: 700;
-            cursor: pointer;
-            transition: all 0.3s;
-        }
-        
-        .submit-btn:hover {
-            transform: translateY(-3px);
-            box-shadow: 0 15px 40px rgba(102, 126, 234, 0.4);
-        }
-        
-        /* MAIN APP STYLES */
-        .main-content {
-            display: none;
-        }
-        
-        .main-content.active {
-            display: block;
-        }
-        
-        .nav-menu {
-            display: flex;
-            gap: 15px;
-            margin-bottom: 30px;
-            background: rgba(255, 255, 255, 0.05);
-            backdrop-filter: blur(10px);
-            padding: 20px;
-            border-radius: 15px;
-        }
-        
-        .nav-btn {
-            padding: 15px 30px;
-            background: rgba(102, 126, 234, 0.2);
-            border: 2px solid #667eea;
-            border-radius: 12px;
-            color: #fff;
-            cursor: pointer;
-            font-weight: 600;
-            transition: all 0.3s;
-        }
-        
-        .nav-btn:hover, .nav-btn.active {
-            background: linear-gradient(135deg, #667eea, #764ba2);
-        }
-        
-        .section {
-            display: none;
-        }
-        
-        .section.active {
-            display: block;
-        }
-        
-        .platform-selector {
-            display: grid;
-            grid-template-columns: repeat(auto-fit, minmax(150px, 1fr));
-            gap: 15px;
-            margin-bottom: 30px;
-        }
-        
-        .platform-btn {
-            padding: 15px 25px;
-            border: 2px solid #667eea;
-            background: rgba(102, 126, 234, 0.1);
-            color: #fff;
-            border-radius: 12px;
-            cursor: pointer;
-            transition: all 0.3s;
-            font-size: 16px;
-            font-weight: 600;
-        }
-        
-        .platform-btn:hover {
-            background: linear-gradient(135deg, #667eea, #764ba2);
-            transform: translateY(-3px);
-            box-shadow: 0 10px 25px rgba(102, 126, 234, 0.4);
-        }
-        
-        .platform-btn.active {
-            background: linear-gradient(135deg, #667eea, #764ba2);
-            box-shadow: 0 0 30px rgba(102, 126, 234, 0.6);
-        }
-        
-        .input-section {
-            background: rgba(255, 255, 255, 0.05);
-            backdrop-filter: blur(10px);
-            padding: 30px;
-            border-radius: 20px;
-            margin-bottom: 30px;
-            border: 1px solid rgba(255, 255, 255, 0.1);
-        }
-        
-        .input-group {
-            display: flex;
-            gap: 15px;
-            margin-bottom: 20px;
-            position: relative;
-        }
-        
-        .url-input {
-            flex: 1;
-            padding: 15px 100px 15px 20px;
-            border: 2px solid rgba(102, 126, 234, 0.5);
-            background: rgba(0, 0, 0, 0.3);
-            color: #fff;
-            border-radius: 12px;
-            font-size: 16px;
-        }
-        
-        .url-input:focus {
-            outline: none;
-            border-color: #667eea;
-            box-shadow: 0 0 20px rgba(102, 126, 234, 0.5);
-        }
-        
-        .input-actions {
-            position: absolute;
-            right: 10px;
-            top: 50%;
-            transform: translateY(-50%);
-            display: flex;
-            gap: 10px;
-        }
-        
-        .icon-btn {
-            padding: 10px 15px;
-            background: rgba(0, 242, 255, 0.2);
-            border: 2px solid #00f2ff;
-            border-radius: 8px;
-            color: #00f2ff;
-            cursor: pointer;
-            transition: all 0.3s;
-        }
-        
-        .icon-btn:hover {
-            background: #00f2ff;
-            color: #0f0c29;
-        }
-        
-        .format-selector {
-            display: flex;
-            gap: 10px;
-            justify-content: center;
-        }
-        
-        .format-btn {
-            padding: 12px 30px;
-            border: 2px solid #00f2ff;
-            background: rgba(0, 242, 255, 0.1);
-            color: #00f2ff;
-            border-radius: 10px;
-            cursor: pointer;
-            transition: all 0.3s;
-            font-weight: 600;
-        }
-        
-        .format-btn.active {
-            background: #00f2ff;
-            color: #0f0c29;
-        }
-        
-        .download-btn {
-            width: 100%;
-            padding: 18px;
-            background: linear-gradient(135deg, #f093fb 0%, #f5576c 100%);
-            border: none;
-            border-radius: 12px;
-            color: #fff;
-            font-size: 18px;
-            font-weight: 700;
-            cursor: pointer;
-            margin-top: 20px;
-            transition: all 0.3s;
-        }
-        
-        .download-btn:hover {
-            transform: translateY(-3px);
-            box-shadow: 0 15px 40px rgba(245, 87, 108, 0.4);
-        }
-        
-        .add-to-playlist-btn {
-            width: 100%;
-            padding: 18px;
-            background: linear-gradient(135deg, #00f2ff 0%, #667eea 100%);
-            border: none;
-            border-radius: 12px;
-            color: #fff;
-            font-size: 18px;
-            font-weight: 700;
-            cursor: pointer;
-            margin-top: 10px;
-            transition: all 0.3s;
-        }
-        
-        .loading {
-            display: none;
-            text-align: center;
-            padding: 20px;
-        }
-        
-        .spinner {
-            border: 4px solid rgba(255, 255, 255, 0.1);
-            border-top: 4px solid #667eea;
-            border-radius: 50%;
-            width: 50px;
-            height: 50px;
-            animation: spin 1s linear infinite;
-            margin: 0 auto;
-        }
-        
-        @keyframes spin {
-            0% { transform: rotate(0deg); }
-            100% { transform: rotate(360deg); }
-        }
-        
-        .preview-section {
-            display: none;
-            background: rgba(255, 255, 255, 0.05);
-            backdrop-filter: blur(10px);
-            padding: 30px;
-            border-radius: 20px;
-            margin-top: 30px;
-            border: 1px solid rgba(255, 255, 255, 0.1);
-        }
-        
-        .preview-grid {
-            display: grid;
-            grid-template-columns: repeat(auto-fit, minmax(250px, 1fr));
-            gap: 20px;
-            margin-top: 20px;
-        }
-        
-        .preview-card {
-            background: rgba(0, 0, 0, 0.3);
-            padding: 20px;
-            border-radius: 15px;
-            border: 2px solid rgba(102, 126, 234, 0.3);
-        }
-        
-        .preview-card h3 {
-            color: #00f2ff;
-            margin-bottom: 15px;
-        }
-        
-        .preview-card img {
-            width: 100%;
-            border-radius: 10px;
-            margin-bottom: 10px;
-        }
-        
-        .preview-card video {
-            width: 100%;
-            border-radius: 10px;
-            margin-bottom: 10px;
-        }
-        
-        .download-link {
-            display: inline-block;
-            padding: 10px 20px;
-            background: linear-gradient(135deg, #667eea, #764ba2);
-            color: #fff;
-            text-decoration: none;
-            border-radius: 8px;
-            margin-top: 10px;
-            transition: all 0.3s;
-        }
-        
-        .download-link:hover {
-            transform: translateY(-2px);
-            box-shadow: 0 5px 15px rgba(102, 126, 234, 0.4);
-        }
-        
-        .info-text {
-            color: #aaa;
-            font-size: 14px;
-            margin: 5px 0;
-        }
-        
-        /* PLAYLIST STYLES */
-        .playlist-header {
-            display: flex;
-            justify-content: space-between;
-            align-items: center;
-            margin-bottom: 30px;
-        }
-        
-        .create-playlist-btn {
-            padding: 15px 30px;
-            background: linear-gradient(135deg, #f093fb 0%, #f5576c 100%);
-            border: none;
-            border-radius: 12px;
-            color: #fff;
-            font-weight: 700;
-            cursor: pointer;
-        }
-        
-        .playlists-grid {
-            display: grid;
-            grid-template-columns: repeat(auto-fit, minmax(300px, 1fr));
-            gap: 20px;
-        }
-        
-        .playlist-card {
-            background: rgba(255, 255, 255, 0.05);
-            backdrop-filter: blur(10px);
-            padding: 25px;
-            border-radius: 15px;
-            border: 2px solid rgba(102, 126, 234, 0.3);
-            transition: all 0.3s;
-        }
-        
-        .playlist-card:hover {
-            transform: translateY(-5px);
-            box-shadow: 0 15px 40px rgba(102, 126, 234, 0.4);
-        }
-        
-        .playlist-title {
-            font-size: 1.5em;
-            color: #00f2ff;
-            margin-bottom: 10px;
-        }
-        
-        .playlist-meta {
-            color: #aaa;
-            font-size: 14px;
-            margin-bottom: 15px;
-        }
-        
-        .visibility-badge {
-            display: inline-block;
-            padding: 5px 15px;
-            border-radius: 20px;
-            font-size: 12px;
-            font-weight: 600;
-            margin-top: 10px;
-        }
-        
-        .visibility-public {
-            background: rgba(0, 255, 0, 0.2);
-            color: #0f0;
-        }
-        
-        .visibility-private {
-            background: rgba(255, 0, 0, 0.2);
-            color: #f55;
-        }
-        
-        .visibility-code {
-            background: rgba(255, 165, 0, 0.2);
-            color: #fa0;
-        }
-        
-        .modal {
-            display: none;
-            position: fixed;
-            top: 0;
-            left: 0;
-            width: 100%;
-            height: 100%;
-            background: rgba(0, 0, 0, 0.8);
-            z-index: 1000;
-            align-items: center;
-            justify-content: center;
-        }
-        
-        .modal.active {
-            display: flex;
-        }
-        
-        .modal-content {
-            background: linear-gradient(135deg, #0f0c29, #302b63);
-            padding: 40px;
-            border-radius: 20px;
-            max-width: 500px;
-            width: 90%;
-            max-height: 80vh;
-            overflow-y: auto;
-        }
-        
-        .modal-header {
-            display: flex;
-            justify-content: space-between;
-            align-items: center;
-            margin-bottom: 25px;
-        }
-        
-        .close-modal {
-            background: rgba(255, 0, 0, 0.3);
-            border: none;
-            color: #fff;
-            font-size: 24px;
-            width: 40px;
-            height: 40px;
-            border-radius: 50%;
-            cursor: pointer;
-        }
-        
-        .error-msg {
-            background: rgba(255, 0, 0, 0.2);
-            border: 1px solid #f55;
-            color: #f55;
-            padding: 15px;
-            border-radius: 10px;
-            margin-bottom: 20px;
-            display: none;
-        }
-        
-        .success-msg {
-            background: rgba(0, 255, 0, 0.2);
-            border: 1px solid #0f0;
-            color: #0f0;
-            padding: 15px;
-            border-radius: 10px;
-            margin-bottom: 20px;
-            display: none;
+# ==================== AUTENTICACIÓN ====================
+class HasherBusyError(Exception):
+    pass
+
+
+def hash_cost(method):
+    """(algoritmo, iteraciones) de un método de werkzeug como 'pbkdf2:sha256:600000'"""
+    name, _, params = method.partition(':')
+    if name != 'pbkdf2':
+        return method, 0
+    digest, _, iterations = params.partition(':')
+    return f"pbkdf2:{digest or 'sha256'}", int(iterations or DEFAULT_PBKDF2_ITERATIONS)
+
+
+class PasswordHasher:
+    """Ejecuta PBKDF2 en un pool acotado de hilos con un límite de cola.
+
+    hashlib libera el GIL durante PBKDF2, así que los hilos del pool no
+    bloquean al resto de peticiones del worker; si la cola se llena se
+    rechaza en lugar de acumular trabajo de CPU.
+    """
+
+    def __init__(self, method, max_workers, max_pending, timeout):
+        self.method = method
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.pending = 0
+        self.lock = threading.Lock()
+        self.executor = None
+        self.dummy_hash = None
+
+    def submit(self, func, *args):
+        with self.lock:
+            if self.pending >= self.max_pending:
+                raise HasherBusyError()
+            self.pending += 1
+            # Igual que la cola de trabajos: el executor se crea ya dentro del worker
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='hash')
+        future = self.executor.submit(func, *args)
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        with self.lock:
+            self.pending -= 1
+
+    def hash(self, password):
+        return self.submit(generate_password_hash, password, self.method).result(self.timeout)
+
+    def verify(self, hashed, password):
+        if hashed is None:
+            # Usuario inexistente: se gasta el mismo tiempo para no revelar qué arrobas existen
+            if self.dummy_hash is None:
+                self.dummy_hash = generate_password_hash(secrets.token_hex(16), self.method)
+            hashed = self.dummy_hash
+            password = ''
+        return self.submit(check_password_hash, hashed, password).result(self.timeout)
+
+    def needs_rehash(self, hashed):
+        """True si el hash usa otro algoritmo o menos iteraciones que las configuradas (nunca para bajarlas)"""
+        algorithm, iterations = hash_cost(hashed.split('$', 1)[0])
+        target_algorithm, target_iterations = hash_cost(self.method)
+        return algorithm != target_algorithm or iterations < target_iterations
+
+    def stats(self):
+        with self.lock:
+            return {'method': self.method, 'workers': self.max_workers, 'pending': self.pending,
+                    'max_pending': self.max_pending}
+
+
+password_hasher = PasswordHasher(PASSWORD_HASH_METHOD, PASSWORD_HASH_WORKERS, PASSWORD_HASH_QUEUE_MAX,
+                                 PASSWORD_HASH_TIMEOUT)
+
+
+def rehash_password(user_id, hashed, password):
+    """Actualiza el hash al método configurado; se ejecuta en el pool de hash tras un login correcto"""
+    new_hash = generate_password_hash(password, PASSWORD_HASH_METHOD)
+    with db_pool.connection() as conn:
+        # Solo si nadie ha cambiado la contraseña mientras tanto
+        conn.execute('UPDATE users SET password = ? WHERE id = ? AND password = ?', (new_hash, user_id, hashed))
+        conn.commit()
+
+
+class RateLimiter:
+    """Token bucket en memoria por clave (IP o arroba), con las claves más antiguas expulsadas (LRU).
+
+    Cada worker lleva su propia cuenta: con N workers el límite efectivo es
+    hasta N veces el configurado, suficiente para frenar ráfagas.
+    """
+
+    def __init__(self, burst, per_minute, max_keys=RATE_LIMIT_MAX_KEYS):
+        self.burst = burst
+        self.rate = per_minute / 60.0
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def consume(self, key):
+        """Gasta un token; devuelve 0 si se permite o los segundos hasta el próximo token"""
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                retry_after = 0
+            else:
+                retry_after = (1 - tokens) / self.rate
+            self.buckets[key] = (tokens, now)
+            while len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        return retry_after
+
+
+ip_limiter = RateLimiter(LOGIN_IP_BURST, LOGIN_IP_PER_MINUTE)
+arobase_limiter = RateLimiter(LOGIN_AROBASE_BURST, LOGIN_AROBASE_PER_MINUTE)
+
+
+def rate_limited(*checks):
+    """Respuesta 429 si algún (limitador, clave) se ha quedado sin tokens, None si no"""
+    retry_after = max(limiter.consume(key) for limiter, key in checks)
+    if not retry_after:
+        return None
+    response = jsonify({'success': False, 'error': 'Demasiados intentos, espera un momento'})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(int(retry_after) + 1)
+    return response
+
+
+def hasher_busy():
+    response = jsonify({'success': False, 'error': 'El servidor está ocupado, inténtalo de nuevo en unos segundos'})
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
+
+# ==================== CLIENTE HTTP ====================
+class CircuitOpenError(Exception):
+    pass
+
+
+class PrivateAddressError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """Deja de llamar a un host tras varios fallos seguidos y lo vuelve a probar pasado un tiempo"""
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.time() - self.opened_at >= self.reset_timeout:
+            return 'half_open'
+        return 'open'
+
+    def allow(self):
+        """True si la petición puede pasar; 'probe' si es la prueba del estado semiabierto"""
+        with self.lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            # En semiabierto solo pasa una petición de prueba a la vez
+            if state == 'half_open' and not self.probing:
+                self.probing = True
+                return 'probe'
+            return False
+
+    def end_probe(self):
+        with self.lock:
+            self.probing = False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.probing = False
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.time()
+
+
+class HTTPClient:
+    """Sesión HTTP compartida con pool keep-alive por host, timeouts, reintentos y circuit breaker"""
+
+    RETRY_STATUSES = {429, 502, 503, 504}
+
+    def __init__(self, pool_sizes, default_pool_size, timeout, retries, backoff, adapter_class=HTTPAdapter):
+        self.timeout = timeout
+        self.adapter_class = adapter_class
+        self.retries = retries
+        self.backoff = backoff
+        self.session = requests.Session()
+        self.adapters = {}
+        self._mount('', default_pool_size)
+        for host, size in pool_sizes.items():
+            self._mount(host, size)
+        self.breakers = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def _mount(self, host, size):
+        adapter = self.adapter_class(pool_connections=4, pool_maxsize=size)
+        self.adapters[host] = adapter
+        if host:
+            self.session.mount(f'https://{host}/', adapter)
+            self.session.mount(f'http://{host}/', adapter)
+        else:
+            self.session.mount('https://', adapter)
+            self.session.mount('http://', adapter)
+
+    def _host_state(self, host):
+        with self.lock:
+            if host not in self.breakers:
+                self._evict_host()
+                self.breakers[host] = CircuitBreaker(BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_TIMEOUT)
+                self.counters[host] = dict.fromkeys(
+                    ('requests', 'in_flight', 'retries', 'failures', 'short_circuited'), 0)
+            return self.breakers[host], self.counters[host]
+
+    def _evict_host(self):
+        # Se llama con self.lock tomado. Se olvida el host más antiguo sin peticiones en curso
+        if len(self.breakers) < BREAKER_MAX_HOSTS:
+            return
+        for host, counters in self.counters.items():
+            if counters['in_flight'] == 0 and host not in HTTP_POOL_SIZES:
+                del self.breakers[host]
+                del self.counters[host]
+                return
+
+    def _count(self, counters, name, delta=1):
+        with self.lock:
+            counters[name] += delta
+
+    def request(self, method, url, **kwargs):
+        host = urlsplit(url).hostname or ''
+        breaker, counters = self._host_state(host)
+        admitted = breaker.allow()
+        if not admitted:
+            self._count(counters, 'short_circuited')
+            raise CircuitOpenError(f'{host} no responde, inténtalo más tarde')
+
+        kwargs.setdefault('timeout', self.timeout)
+        attempt = 0
+        try:
+            while True:
+                self._count(counters, 'requests')
+                self._count(counters, 'in_flight')
+                started = time.perf_counter()
+                try:
+                    response = self.session.request(method, url, **kwargs)
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    UPSTREAM_LATENCY.labels(self._metric_host(host), type(e).__name__).observe(
+                        time.perf_counter() - started)
+                    breaker.record_failure()
+                    self._count(counters, 'failures')
+                    if attempt >= self.retries or not breaker.allow():
+                        raise
+                else:
+                    UPSTREAM_LATENCY.labels(self._metric_host(host), response.status_code).observe(
+                        time.perf_counter() - started)
+                    if response.status_code not in self.RETRY_STATUSES and response.status_code < 500:
+                        breaker.record_success()
+                        return response
+                    breaker.record_failure()
+                    self._count(counters, 'failures')
+                    if attempt >= self.retries or not breaker.allow():
+                        return response
+                    response.close()
+                finally:
+                    self._count(counters, 'in_flight', -1)
+
+                # Backoff exponencial con jitter para no sincronizar reintentos entre workers
+                time.sleep(min(self.backoff * 2 ** attempt, 5) * random.uniform(0.5, 1.5))
+                attempt += 1
+                self._count(counters, 'retries')
+        finally:
+            # record_success/record_failure ya la terminan; esto cubre excepciones que no son de requests
+            if admitted == 'probe':
+                breaker.end_probe()
+
+    def _metric_host(self, host):
+        # Solo los hosts configurados tienen etiqueta propia; los CDNs van juntos
+        return host if host in HTTP_POOL_SIZES else 'other'
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def stats(self):
+        """Contadores por host y ocupación de los pools de conexiones"""
+        with self.lock:
+            hosts = {host: dict(counters, circuit=self.breakers[host].state)
+                     for host, counters in self.counters.items()}
+        pools = []
+        for adapter in self.adapters.values():
+            manager = adapter.poolmanager
+            for key in list(manager.pools.keys()):
+                pool = manager.pools.get(key)
+                if pool is None:
+                    continue
+                idle = pool.pool.qsize() if pool.pool else 0
+                pools.append({
+                    'host': pool.host,
+                    'maxsize': pool.pool.maxsize if pool.pool else 0,
+                    'in_use': (pool.pool.maxsize - idle) if pool.pool else 0,
+                    'connections_opened': pool.num_connections,
+                    'requests': pool.num_requests,
+                })
+        return {'hosts': hosts, 'pools': pools}
+
+
+def is_public_address(address):
+    return ipaddress.ip_address(address.split('%', 1)[0]).is_global
+
+
+class PublicAddressConnectionMixin:
+    """Comprueba la dirección a la que se ha conectado de verdad el socket.
+
+    is_public_url resuelve el nombre antes de la petición, pero la conexión lo
+    vuelve a resolver: un DNS que cambia de respuesta entre las dos (DNS
+    rebinding) llevaría la petición a la red interna. Se comprueba antes del
+    handshake TLS y de enviar nada.
+    """
+
+    def _new_conn(self):
+        sock = super()._new_conn()
+        address = sock.getpeername()[0]
+        if not is_public_address(address):
+            sock.close()
+            raise PrivateAddressError(f'{self.host} ha resuelto a una dirección no pública ({address})')
+        return sock
+
+
+class PublicHTTPConnection(PublicAddressConnectionMixin, HTTPConnection):
+    pass
+
+
+class PublicHTTPSConnection(PublicAddressConnectionMixin, HTTPSConnection):
+    pass
+
+
+class PublicHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = PublicHTTPConnection
+
+
+class PublicHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = PublicHTTPSConnection
+
+
+class PublicAddressAdapter(HTTPAdapter):
+    """HTTPAdapter que solo abre conexiones a direcciones públicas"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {'http': PublicHTTPConnectionPool,
+                                                   'https': PublicHTTPSConnectionPool}
+
+
+http_client = HTTPClient(HTTP_POOL_SIZES, HTTP_DEFAULT_POOL_SIZE,
+                         (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT), HTTP_RETRIES, HTTP_BACKOFF)
+# Para las URLs que escriben los usuarios (fetch_public): sin pools por host, que son de las APIs conocidas
+public_http_client = HTTPClient({}, HTTP_DEFAULT_POOL_SIZE, (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT),
+                                HTTP_RETRIES, HTTP_BACKOFF, adapter_class=PublicAddressAdapter)
+
+
+def is_public_url(url):
+    """True si la URL es http(s) y su host solo resuelve a direcciones públicas.
+
+    Las URLs de los items las escribe el usuario: sin esta comprobación el
+    servidor podría descargar recursos de su red interna.
+    """
+    parts = urlsplit(url or '')
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        return False
+    try:
+        addresses = socket.getaddrinfo(parts.hostname, parts.port or 443, proto=socket.IPPROTO_TCP)
+    except (socket.gaierror, UnicodeError, ValueError):
+        return False
+    return all(is_public_address(address[4][0]) for address in addresses)
+
+
+def fetch_public(url, **kwargs):
+    """GET de una URL escrita por el usuario siguiendo las redirecciones a mano.
+
+    Cada salto se comprueba con is_public_url: un enlace público que redirige a
+    la red interna devuelve None, igual que demasiadas redirecciones. La
+    dirección a la que se conecta se vuelve a comprobar en PublicAddressAdapter.
+    """
+    for _ in range(PUBLIC_FETCH_MAX_REDIRECTS + 1):
+        if not is_public_url(url):
+            return None
+        try:
+            response = public_http_client.get(url, allow_redirects=False, **kwargs)
+        except PrivateAddressError:
+            return None
+        if not response.is_redirect:
+            return response
+        response.close()
+        url = urljoin(url, response.headers['Location'])
+    return None
+
+# ==================== CACHÉ DE METADATOS ====================
+# Parámetros de seguimiento que no cambian el contenido extraído
+TRACKING_PARAMS = {
+    'si', 'feature', 'pp', 'fbclid', 'gclid', 'igsh', 'igshid', 'ref', 'ref_src',
+    'is_from_webapp', 'sender_device', 'share_app_id', 'share_item_id', 'mibextid',
+    '_r', '_t', 'web_id', 'rdid', 'embed_source',
+}
+
+YOUTUBE_HOSTS = {'youtube.com', 'm.youtube.com', 'music.youtube.com', 'youtube-nocookie.com'}
+YOUTUBE_ID_PATHS = ('/shorts/', '/embed/', '/live/', '/v/')
+
+
+def normalize_url(url):
+    """Forma canónica de una URL para usarla como clave de caché"""
+    url = (url or '').strip()
+    parts = urlsplit(url if '://' in url else 'https://' + url)
+    host = (parts.hostname or '').lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    path = parts.path.rstrip('/') or '/'
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+             if k.lower() not in TRACKING_PARAMS and not k.lower().startswith('utm_')]
+
+    # YouTube: youtu.be/ID, /shorts/ID, /embed/ID... -> youtube.com/watch?v=ID
+    video_id = None
+    if host == 'youtu.be':
+        video_id = path.strip('/').split('/')[0]
+    elif host in YOUTUBE_HOSTS:
+        for prefix in YOUTUBE_ID_PATHS:
+            if path.startswith(prefix):
+                video_id = path[len(prefix):].split('/')[0]
+                break
+        if path == '/watch':
+            video_id = dict(query).get('v')
+    if video_id:
+        extra = [(k, v) for k, v in query if k == 'list']
+        return urlunsplit(('https', 'www.youtube.com', '/watch',
+                           urlencode([('v', video_id)] + extra), ''))
+
+    # TikTok e Instagram no usan la query string para identificar el contenido
+    if host.endswith('tiktok.com') or host.endswith('instagram.com'):
+        query = []
+
+    return urlunsplit(('https', host, path, urlencode(sorted(query)), ''))
+
+
+def cache_key(url, platform, format_type):
+    return f'{platform}|{(format_type or "").lower()}|{normalize_url(url)}'
+
+
+def signed_url_expiry(url):
+    """Timestamp de caducidad de una URL firmada de CDN (o None si no lo indica)"""
+    if not url or not isinstance(url, str):
+        return None
+    params = dict(parse_qsl(urlsplit(url).query))
+    try:
+        # googlevideo.com (YouTube) y CDNs de TikTok
+        for name in ('expire', 'x-expires', 'Expires'):
+            if name in params:
+                return int(params[name])
+        # fbcdn / cdninstagram usan un timestamp hexadecimal en 'oe'
+        if 'oe' in params:
+            return int(params['oe'], 16)
+        if 'X-Amz-Date' in params and 'X-Amz-Expires' in params:
+            # X-Amz-Date está en UTC: timegm, no mktime (que aplica la zona y el horario de verano locales)
+            signed = calendar.timegm(time.strptime(params['X-Amz-Date'], '%Y%m%dT%H%M%SZ'))
+            return signed + int(params['X-Amz-Expires'])
+    except (ValueError, OverflowError):
+        return None
+    # Algunas rutas firmadas llevan la caducidad en el path (/expire/1700000000/)
+    match = re.search(r'/expire/(\d{10})/', url)
+    return int(match.group(1)) if match else None
+
+
+def media_cache_ttl(data):
+    """TTL de una respuesta: nunca más allá de la caducidad de sus enlaces firmados"""
+    links = [data.get(k) for k in ('download_url', 'video', 'audio', 'thumbnail')]
+    links += list(data.get('images') or [])
+    expiries = [e for e in map(signed_url_expiry, links) if e]
+    ttl = CACHE_TTL
+    if expiries:
+        ttl = min(ttl, min(expiries) - time.time() - CACHE_EXPIRY_MARGIN)
+    return int(ttl)
+
+
+def thread_connection(local, path):
+    """Conexión SQLite propia de cada hilo (y de cada proceso tras un fork)"""
+    conn = getattr(local, 'conn', None)
+    if conn is None or local.pid != os.getpid():
+        conn = sqlite3.connect(path, timeout=10, factory=TimedConnection)
+        conn.database_label = 'cache'
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        local.conn = conn
+        local.pid = os.getpid()
+    return conn
+
+
+class MemoryCache:
+    """Caché LRU con TTL dentro del proceso"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self.lock:
+            self.entries[key] = (value, time.time() + ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class SQLiteCache:
+    """Caché LRU con TTL en un fichero SQLite compartido por todos los workers"""
+
+    # No reescribir accessed_at en cada acierto, basta con una resolución de un minuto
+    TOUCH_INTERVAL = 60
+
+    def __init__(self, path, max_entries):
+        self.path = path
+        self.max_entries = max_entries
+        self.local = threading.local()
+        conn = self._conn()
+        conn.execute('''CREATE TABLE IF NOT EXISTS media_cache (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            expires_at REAL NOT NULL,
+            accessed_at REAL NOT NULL
+        )''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_media_cache_accessed ON media_cache(accessed_at)')
+        conn.commit()
+
+    def _conn(self):
+        return thread_connection(self.local, self.path)
+
+    def get(self, key):
+        conn = self._conn()
+        now = time.time()
+        row = conn.execute('SELECT value, expires_at, accessed_at FROM media_cache WHERE key = ?',
+                           (key,)).fetchone()
+        if row is None:
+            return None
+        value, expires_at, accessed_at = row
+        if expires_at <= now:
+            conn.execute('DELETE FROM media_cache WHERE key = ?', (key,))
+            conn.commit()
+            return None
+        if now - accessed_at > self.TOUCH_INTERVAL:
+            conn.execute('UPDATE media_cache SET accessed_at = ? WHERE key = ?', (now, key))
+            conn.commit()
+        return json.loads(value)
+
+    def set(self, key, value, ttl):
+        conn = self._conn()
+        now = time.time()
+        conn.execute('INSERT OR REPLACE INTO media_cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)',
+                     (key, json.dumps(value), now + ttl, now))
+        conn.execute('DELETE FROM media_cache WHERE expires_at <= ?', (now,))
+        conn.execute('''DELETE FROM media_cache WHERE key IN (
+                            SELECT key FROM media_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)''',
+                     (self.max_entries,))
+        conn.commit()
+
+    def delete(self, key):
+        conn = self._conn()
+        conn.execute('DELETE FROM media_cache WHERE key = ?', (key,))
+        conn.commit()
+
+    def clear(self):
+        conn = self._conn()
+        conn.execute('DELETE FROM media_cache')
+        conn.commit()
+
+
+if CACHE_BACKEND == 'memory':
+    metadata_cache = MemoryCache(CACHE_MAX_ENTRIES)
+else:
+    metadata_cache = SQLiteCache(CACHE_DATABASE, CACHE_MAX_ENTRIES)
+
+
+# ==================== COALESCENCIA DE PETICIONES ====================
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Agrupa las llamadas concurrentes con la misma clave en una sola ejecución.
+
+    Dentro del proceso los seguidores esperan a un Event; entre workers el líder
+    toma una concesión (lease) en SQLite y publica ahí el resultado.
+    """
+
+    POLL_INTERVAL = 0.2
+
+    def __init__(self, path, lease_ttl, result_ttl):
+        self.path = path
+        self.lease_ttl = lease_ttl
+        self.result_ttl = result_ttl
+        self.flights = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.token = secrets.token_hex(4)
+        if path:
+            conn = self._conn()
+            conn.execute('''CREATE TABLE IF NOT EXISTS flights (
+                key TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                result TEXT
+            )''')
+            conn.commit()
+
+    @property
+    def owner(self):
+        # Con preload_app la instancia se crea antes del fork: el pid distingue a cada worker
+        return f'{os.getpid()}-{self.token}'
+
+    def _conn(self):
+        return thread_connection(self.local, self.path)
+
+    def do(self, key, func):
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = _Flight()
+
+        if not leader:
+            flight.done.wait()
+            # Si el líder falló, los seguidores fallan igual en lugar de devolver None
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = self._shared_do(key, func) if self.path else func()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+        return flight.result
+
+    def _shared_do(self, key, func):
+        deadline = time.time() + self.lease_ttl
+        while time.time() < deadline:
+            state, result = self._acquire(key)
+            if state == 'leader':
+                break
+            if state == 'done':
+                return result
+            time.sleep(self.POLL_INTERVAL)
+        else:
+            # El líder no terminó a tiempo: se ejecuta sin coordinación
+            return func()
+
+        try:
+            result = func()
+        except Exception:
+            self._release(key, None)
+            raise
+        self._release(key, result)
+        return result
+
+    def _acquire(self, key):
+        conn = self._conn()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT expires_at, result FROM flights WHERE key = ?', (key,)).fetchone()
+            if row and row[0] > now:
+                conn.rollback()
+                return ('done', json.loads(row[1])) if row[1] is not None else ('wait', None)
+            conn.execute('INSERT OR REPLACE INTO flights (key, owner, expires_at, result) VALUES (?, ?, ?, NULL)',
+                         (key, self.owner, now + self.lease_ttl))
+            conn.execute('DELETE FROM flights WHERE expires_at <= ?', (now,))
+            conn.commit()
+            return 'leader', None
+        except Exception:
+            conn.rollback()
+            raise
+
+    def _release(self, key, result):
+        conn = self._conn()
+        if result is None:
+            conn.execute('DELETE FROM flights WHERE key = ? AND owner = ?', (key, self.owner))
+        else:
+            # El resultado se deja visible unos segundos para los seguidores de otros workers
+            conn.execute('UPDATE flights SET result = ?, expires_at = ? WHERE key = ? AND owner = ?',
+                         (json.dumps(result), time.time() + self.result_ttl, key, self.owner))
+        conn.commit()
+
+
+singleflight = SingleFlight(CACHE_DATABASE if SINGLEFLIGHT_SHARED else None,
+                            SINGLEFLIGHT_LEASE_TTL, SINGLEFLIGHT_RESULT_TTL)
+
+
+def get_media_info(url, platform, format_type):
+    """Metadatos de un medio, servidos desde la caché cuando es posible"""
+    key = cache_key(url, platform, format_type)
+    data = metadata_cache.get(key)
+    if data is not None:
+        return data
+
+    # Las peticiones simultáneas de la misma clave comparten una sola extracción
+    return singleflight.do(key, lambda: extract_and_cache(key, url, platform, format_type))
+
+
+def extract_and_cache(key, url, platform, format_type):
+    # Otro worker pudo terminar la misma extracción mientras se esperaba la concesión
+    data = metadata_cache.get(key)
+    if data is not None:
+        return data
+
+    started = time.perf_counter()
+    if platform == 'tiktok':
+        data = extract_tiktok(url, format_type)
+    else:
+        data = extract_ytdlp(url, platform, format_type)
+    EXTRACTION_LATENCY.labels(platform if platform in METRIC_PLATFORMS else 'other', 'success' if data.get('success') else 'error').observe(
+        time.perf_counter() - started)
+
+    # Los errores no se cachean para poder reintentar enseguida
+    if data.get('success'):
+        ttl = media_cache_ttl(data)
+        if ttl > 0:
+            metadata_cache.set(key, data, ttl)
+    return data
+
+# ==================== COLA DE TRABAJOS ====================
+JOB_ACTIVE_STATUSES = ('queued', 'running')
+# Un ? por estado: no depender del repr de la tupla (('queued',) no es SQL válido)
+JOB_ACTIVE_PLACEHOLDERS = ', '.join('?' * len(JOB_ACTIVE_STATUSES))
+
+
+class JobQueue:
+    """Pool acotado de hilos que ejecuta extracciones fuera de la petición.
+
+    El estado de cada trabajo se guarda en la tabla jobs para que cualquier
+    worker de gunicorn pueda responder a /jobs/<id>.
+    """
+
+    def __init__(self, max_workers, max_pending):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.lock = threading.Lock()
+        self.executor = None
+
+    def update(self, job_id, **fields):
+        fields['updated_at'] = time.time()
+        with db_pool.connection() as conn:
+            conn.execute('UPDATE jobs SET ' + ', '.join(f'{k} = ?' for k in fields) + ' WHERE id = ?',
+                         (*fields.values(), job_id))
+            conn.commit()
+
+    def get(self, job_id, user_id):
+        """El trabajo si user_id lo encoló o se unió a él; si no, None (como si no existiera)"""
+        with db_pool.connection() as conn:
+            row = conn.execute('''SELECT * FROM jobs WHERE id = ? AND (user_id = ? OR EXISTS (
+                                      SELECT 1 FROM job_users WHERE job_id = jobs.id AND user_id = ?))''',
+                               (job_id, user_id, user_id)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+    def submit(self, user_id, job_key, func, *args):
+        """Encola func(*args) y devuelve (job_id, error).
+
+        Si ya hay un trabajo en curso con la misma clave se devuelve su id.
+        """
+        now = time.time()
+        with db_pool.connection() as conn:
+            # Los trabajos que no avanzan desde hace JOB_STALE_AFTER se dan por perdidos
+            # (p. ej. un worker reciclado a mitad de extracción)
+            conn.execute(f'''UPDATE jobs SET status = 'error', message = 'Trabajo interrumpido', updated_at = ?
+                             WHERE status IN ({JOB_ACTIVE_PLACEHOLDERS}) AND updated_at < ?''',
+                         (now, *JOB_ACTIVE_STATUSES, now - JOB_STALE_AFTER))
+            conn.execute('DELETE FROM jobs WHERE created_at < ?', (now - JOB_RETENTION,))
+            conn.commit()
+
+            existing = conn.execute(f'''SELECT id FROM jobs
+                                        WHERE job_key = ? AND status IN ({JOB_ACTIVE_PLACEHOLDERS})''',
+                                    (job_key, *JOB_ACTIVE_STATUSES)).fetchone()
+            if existing:
+                self._join(conn, existing['id'], user_id)
+                return existing['id'], None
+
+            active = conn.execute(f'''SELECT COUNT(*) FROM jobs
+                                      WHERE user_id = ? AND status IN ({JOB_ACTIVE_PLACEHOLDERS})''',
+                                  (user_id, *JOB_ACTIVE_STATUSES)).fetchone()[0]
+            if active >= JOBS_PER_USER:
+                return None, 'Demasiados trabajos en curso, espera a que terminen'
+
+            with self.lock:
+                if self.pending >= self.max_pending:
+                    return None, 'El servidor está ocupado, inténtalo de nuevo en unos segundos'
+                self.pending += 1
+
+            job_id = secrets.token_urlsafe(12)
+            try:
+                conn.execute('''INSERT INTO jobs (id, user_id, job_key, status, progress, created_at, updated_at)
+                                VALUES (?, ?, ?, 'queued', 0, ?, ?)''', (job_id, user_id, job_key, now, now))
+                conn.commit()
+            except sqlite3.IntegrityError:
+                # Otro worker acaba de encolar la misma clave
+                with self.lock:
+                    self.pending -= 1
+                existing = conn.execute(f'''SELECT id FROM jobs
+                                            WHERE job_key = ? AND status IN ({JOB_ACTIVE_PLACEHOLDERS})''',
+                                        (job_key, *JOB_ACTIVE_STATUSES)).fetchone()
+                if existing is None:
+                    return None, 'No se pudo encolar el trabajo'
+                self._join(conn, existing['id'], user_id)
+                return existing['id'], None
+
+        with self.lock:
+            # El executor se crea en el primer uso, ya dentro del worker (seguro con preload)
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='job')
+        JOBS_QUEUED.inc()
+        self.executor.submit(self._run, job_id, func, args)
+        return job_id, None
+
+    def _join(self, conn, job_id, user_id):
+        # Quien comparte la extracción de otro usuario también puede consultar su estado
+        conn.execute('''INSERT OR IGNORE INTO job_users (job_id, user_id)
+                        SELECT id, ? FROM jobs WHERE id = ? AND user_id != ?''', (user_id, job_id, user_id))
+        conn.commit()
+
+    def _run(self, job_id, func, args):
+        JOBS_QUEUED.dec()
+        JOBS_RUNNING.inc()
+        status = 'error'
+        try:
+            self.update(job_id, status='running', progress=10, message='Extrayendo información')
+            result = func(job_id, *args)
+            if result.get('success'):
+                status = 'done'
+                self.update(job_id, status='done', progress=100, message=None, result=json.dumps(result))
+            else:
+                self.update(job_id, status='error', progress=100, message=result.get('error'),
+                            result=json.dumps(result))
+        except Exception as e:
+            self.update(job_id, status='error', progress=100, message=str(e))
+        finally:
+            JOBS_RUNNING.dec()
+            JOBS_FINISHED.labels(status).inc()
+            with self.lock:
+                self.pending -= 1
+
+
+job_queue = JobQueue(JOB_WORKERS, JOB_QUEUE_MAX)
+
+
+def extraction_job(job_id, url, platform, format_type):
+    return get_media_info(url, platform, format_type)
+
+
+def job_payload(job):
+    return {
+        'id': job['id'],
+        'status': job['status'],
+        'progress': job['progress'],
+        'message': job['message'],
+        'result': job['result'],
+    }
+
+# ==================== DESCARGAS EN EL SERVIDOR ====================
+class DownloadProgress:
+    """Hooks de yt-dlp que escriben el avance en la fila del trabajo (dentro del proceso de descarga)"""
+
+    def __init__(self, conn, job_id):
+        self.conn = conn
+        self.job_id = job_id
+        self.last_update = 0
+        self.filepath = None
+
+    def update(self, progress, message):
+        self.conn.execute('UPDATE jobs SET progress = ?, message = ?, updated_at = ? WHERE id = ?',
+                          (progress, message, time.time(), self.job_id))
+        self.conn.commit()
+        self.last_update = time.time()
+
+    def download_hook(self, status):
+        if status['status'] == 'downloading':
+            total = status.get('total_bytes') or status.get('total_bytes_estimate')
+            # Una escritura cada DOWNLOAD_PROGRESS_INTERVAL como mucho: SQLite tiene un solo escritor
+            if total and time.time() - self.last_update >= DOWNLOAD_PROGRESS_INTERVAL:
+                done = min(status.get('downloaded_bytes', 0) / total, 1)
+                self.update(15 + int(75 * done), 'Descargando')
+        elif status['status'] == 'finished':
+            self.filepath = status.get('filename') or self.filepath
+            self.update(90, 'Descarga completada')
+
+    def postprocessor_hook(self, status):
+        if status['status'] == 'started' and status.get('postprocessor') == 'ExtractAudio':
+            self.update(92, 'Convirtiendo a MP3')
+        elif status['status'] == 'finished':
+            # Tras ExtractAudio la ruta final es la del .mp3, no la del archivo descargado
+            self.filepath = status.get('info_dict', {}).get('filepath') or self.filepath
+
+
+def download_options(format_type, progress):
+    # El id del vídeo y el formato en el nombre: cada pieza se descarga una sola vez
+    ydl_opts = {
+        'quiet': True,
+        'no_warnings': True,
+        'noprogress': True,
+        'outtmpl': os.path.join(DOWNLOAD_FOLDER, DOWNLOAD_MEDIA_PREFIX, f'%(extractor_key)s-%(id)s-{format_type}.%(ext)s'),
+        'progress_hooks': [progress.download_hook],
+        'postprocessor_hooks': [progress.postprocessor_hook],
+    }
+    if format_type == 'mp3':
+        ydl_opts.update({
+            'format': 'bestaudio/best',
+            'postprocessors': [{
+                'key': 'FFmpegExtractAudio',
+                'preferredcodec': 'mp3',
+                'preferredquality': '192',
+            }],
+        })
+    else:
+        ydl_opts['format'] = 'best'
+    return ydl_opts
+
+
+def download_media(job_id, url, platform, format_type):
+    """Descarga el medio (y lo convierte a mp3 si se pide). Se ejecuta en un proceso del pool."""
+    conn = sqlite3.connect(DATABASE, timeout=10)
+    conn.row_factory = sqlite3.Row
+    try:
+        progress = DownloadProgress(conn, job_id)
+        with yt_dlp.YoutubeDL(download_options(format_type, progress)) as ydl:
+            info = ydl.extract_info(url, download=False)
+            video_key = f"{info.get('extractor_key') or platform}:{info['id']}".lower()
+            # La misma pieza pudo pedirse antes con otra URL (youtu.be, /shorts/...)
+            existing = conn.execute('SELECT path, result FROM downloads WHERE video_key = ? AND format = ?',
+                                    (video_key, format_type)).fetchone()
+            if existing and os.path.isfile(os.path.join(DOWNLOAD_FOLDER, existing['path'])):
+                return json.loads(existing['result'])
+            progress.update(15, 'Descargando')
+            ydl.process_ie_result(info, download=True)
+
+        path = progress.filepath
+        if not path or not os.path.isfile(path):
+            return {'success': False, 'error': 'La descarga no generó ningún archivo'}
+        relpath = os.path.relpath(path, DOWNLOAD_FOLDER).replace(os.sep, '/')
+        duration_seconds = int(info.get('duration') or 0)
+        result = {
+            'success': True,
+            'platform': platform,
+            'source_url': info.get('webpage_url') or url,
+            'title': info.get('title', 'Sin título'),
+            'thumbnail': info.get('thumbnail'),
+            'duration': f"{duration_seconds // 60}:{duration_seconds % 60:02d}",
+            'duration_seconds': duration_seconds,
+            'quality': info.get('resolution', 'N/A'),
+            'format': format_type.upper(),
+            'download_url': f'/downloads/{quote(relpath)}',
+            'file_size': os.path.getsize(path),
+            'uploader': info.get('uploader', 'Desconocido'),
+            'upload_date': info.get('upload_date', 'N/A'),
         }
-    </style>
-</head>
-<body>
-    <div class="container">
-        <div class="user-info" id="userInfo">
-            <span id="userDisplay"></span>
-            <button class="logout-btn" onclick="logout()">Cerrar Sesión</button>
-        </div>
-        
-        <!-- AUTH SECTION -->
-        <div id="authSection">
-            <div class="header">
-                <h1>MediaDownloaderPRO v2.0</h1>
-                <p>Sistema avanzado de gestión multimedia</p>
-            </div>
-            
-            <div class="auth-container">
-                <div class="auth-tabs">
-                    <button class="auth-tab active" onclick="switchAuthTab('login')">Iniciar Sesión</button>
-                    <button class="auth-tab" onclick="switchAuthTab('register')">Registrarse</button>
-                </div>
-                
-                <div id="errorMsg" class="error-msg"></div>
-                <div id="successMsg" class="success-msg"></div>
-                
-                <!-- LOGIN FORM -->
-                <form class="auth-form active" id="loginForm" onsubmit="return handleLogin(event)">
-                    <div class="form-group">
-                        <label>Usuario (@usuario)</label>
-                        <input type="text" class="form-input" name="username" required placeholder="@tu_usuario">
-                    </div>
-                    <div class="form-group">
-                        <label>Contraseña</label>
-                        <input type="password" class="form-input" name="password" required>
-                    </div>
-                    <button type="submit" class="submit-btn">Iniciar Sesión</button>
-                </form>
-                
-                <!-- REGISTER FORM -->
-                <form class="auth-form" id="registerForm" onsubmit="return handleRegister(event)">
-                    <div class="form-group">
-                        <label>Nombre de Usuario</label>
-                        <input type="text" class="form-input" name="username" required placeholder="tu_nombre">
-                    </div>
-                    <div class="form-group">
-                        <label>Nombre de Arroba (@usuario)</label>
-                        <input type="text" class="form-input" name="arobase" required placeholder="@nombre_unico">
-                    </div>
-                    <div class="form-group">
-                        <label>Contraseña</label>
-                        <input type="password" class="form-input" name="password" required minlength="8">
-                    </div>
-                    <div class="form-group">
-                        <label>Verificar Contraseña</label>
-                        <input type="password" class="form-input" name="confirm_password" required minlength="8">
-                    </div>
-                    <button type="submit" class="submit-btn">Crear Cuenta</button>
-                </form>
-            </div>
-        </div>
-        
-        <!-- MAIN APP SECTION -->
-        <div class="main-content" id="mainContent">
-            <div class="header">
-                <h1>MediaDownloaderPRO v2.0</h1>
-                <p>Descarga y gestiona tu contenido multimedia</p>
-            </div>
-            
-            <div class="nav-menu">
-                <button class="nav-btn active" onclick="switchSection('downloader')">📥 Descargar</button>
-                <button class="nav-btn" onclick="switchSection('playlists')">🎵 Indiana Playlist</button>
-                <button class="nav-btn" onclick="showAccessByCode()">🔑 Acceder con Código</button>
-            </div>
-            
-            <!-- DOWNLOADER SECTION -->
-            <div class="section active" id="downloaderSection">
-                <div class="platform-selector">
-                    <button class="platform-btn active" data-platform="youtube">YouTube</button>
-                    <button class="platform-btn" data-platform="instagram">Instagram</button>
-                    <button class="platform-btn" data-platform="facebook">Facebook</button>
-                    <button class="platform-btn" data-platform="tiktok">TikTok</button>
-                </div>
-                
-                <div class="input-section">
-                    <div class="input-group">
-                        <input type="text" class="url-input" id="urlInput" placeholder="Pega la URL aquí...">
-                        <div class="input-actions">
-                            <button class="icon-btn" onclick="pasteUrl()" title="Pegar">📋</button>
-                            <button class="icon-btn" onclick="clearUrl()" title="Borrar">🗑️</button>
-                        </div>
-                    </div>
-                    
-                    <div class="format-selector">
-                        <button class="format-btn active" data-format="mp4">MP4</button>
-                        <button class="format-btn" data-format="mp3">MP3</button>
-                        <button class="format-btn" data-format="photo" id="photoBtn" style="display:none;">Fotos</button>
-                    </div>
-                    
-                    <button class="download-btn" onclick="processMedia()">Procesar Media</button>
-                    <button class="add-to-playlist-btn" onclick="showAddToPlaylist()">Añadir a Playlist</button>
-                </div>
-                
-                <div class="loading" id="loading">
-                    <div class="spinner"></div>
-                    <p style="margin-top: 15px;">Procesando...</p>
-                </div>
-                
-                <div class="preview-section" id="previewSection">
-                    <h2>Vista Previa</h2>
-                    <div class="preview-grid" id="previewGrid"></div>
-                </div>
-            </div>
-            
-            <!-- PLAYLISTS SECTION -->
-            <div class="section" id="playlistsSection">
-                <div class="playlist-header">
-                    <h2>🎵 Indiana Playlist - Almacenamiento Ilimitado</h2>
-                    <button class="create-playlist-btn" onclick="showCreatePlaylist()">+ Nueva Playlist</button>
-                </div>
-                
-                <div class="playlists-grid" id="playlistsGrid">
-                    <!-- Playlists will be loaded here -->
-                </div>
-            </div>
-        </div>
-        
-        <!-- CREATE PLAYLIST MODAL -->
-        <div class="modal" id="createPlaylistModal">
-            <div class="modal-content">
-                <div class="modal-header">
-                    <h2>Crear Nueva Playlist</h2>
-                    <button class="close-modal" onclick="closeModal('createPlaylistModal')">×</button>
-                </div>
-                <div id="playlistErrorMsg" class="error-msg"></div>
-                <form onsubmit="return createPlaylist(event)">
-                    <div class="form-group">
-                        <label>Nombre de la Playlist *</label>
-                        <input type="text" class="form-input" name="name" required placeholder="Mi Playlist">
-                    </div>
-                    <div class="form-group">
-                        <label>Descripción (opcional)</label>
-                        <input type="text" class="form-input" name="description" placeholder="Describe tu playlist...">
-                    </div>
-                    <div class="form-group">
-                        <label>Visibilidad</label>
-                        <select class="form-input" name="visibility" onchange="toggleCodeField(this)">
-                            <option value="private">🔒 Privada - Solo yo</option>
-                            <option value="public">🌍 Pública - Todos</option>
-                            <option value="code">🔑 Con Código - Acceso restringido</option>
-                        </select>
-                    </div>
-                    <div class="form-group" id="codeField" style="display:none;">
-                        <label>Código de Acceso</label>
-                        <input type="text" class="form-input" id="generatedCode" readonly style="background: rgba(0,242,255,0.1); border-color: #00f2ff; font-weight: 700; letter-spacing: 2px;">
-                        <p style="font-size: 12px; color: #aaa; margin-top: 5px;">Este código se generará automáticamente</p>
-                    </div>
-                    <button type="submit" class="submit-btn">✨ Crear Playlist</button>
-                </form>
-            </div>
+        conn.execute('''INSERT OR REPLACE INTO downloads (video_key, format, source_key, path, size, result, created_at)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                     (video_key, format_type, normalize_url(url), relpath, result['file_size'], json.dumps(result),
+                      time.time()))
+        conn.commit()
+        return result
+    except yt_dlp.utils.DownloadError as e:
+        return {'success': False, 'error': str(e)}
+    finally:
+        conn.close()
+
+
+_download_pool = None
+_download_pool_lock = threading.Lock()
+
+
+def download_job(job_id, url, platform, format_type):
+    """Trabajo de download_queue: el hilo solo espera al proceso, que descarga y convierte fuera del GIL"""
+    global _download_pool
+    with _download_pool_lock:
+        if _download_pool is None:
+            # spawn y no fork: el worker tiene hilos y un fork podría heredar locks tomados
+            _download_pool = ProcessPoolExecutor(max_workers=DOWNLOAD_PROCESSES,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+        pool = _download_pool
+    try:
+        result = pool.submit(download_media, job_id, url, platform, format_type).result()
+    except BrokenProcessPool:
+        # Un proceso murió (p. ej. por falta de memoria): el pool ya no sirve, se crea otro en el siguiente trabajo
+        with _download_pool_lock:
+            if _download_pool is pool:
+                _download_pool = None
+        return {'success': False, 'error': 'El proceso de descarga terminó inesperadamente'}
+    if result.get('success'):
+        sweep_downloads(keep=result['download_url'])
+    return result
+
+
+def sweep_downloads(keep=None):
+    """Borra las descargas caducadas y las más antiguas mientras se pase de DOWNLOAD_MEDIA_MAX_BYTES.
+
+    Los archivos que algún item de playlist usa no se tocan (ni cuentan), y
+    tampoco keep, la descarga que se acaba de entregar.
+    """
+    with db_pool.connection() as conn:
+        used = {row[0] for row in conn.execute(
+            'SELECT url FROM playlist_items WHERE url LIKE ?', (f'/downloads/{DOWNLOAD_MEDIA_PREFIX}%',))}
+        used.add(keep)
+        rows = [row for row in conn.execute('SELECT video_key, format, path, size, created_at FROM downloads '
+                                            'ORDER BY created_at').fetchall()
+                if f"/downloads/{quote(row['path'])}" not in used]
+        total = sum(row['size'] or 0 for row in rows)
+        expired_before = time.time() - DOWNLOAD_MEDIA_TTL
+        removed = []
+        for row in rows:
+            if row['created_at'] > expired_before and total <= DOWNLOAD_MEDIA_MAX_BYTES:
+                break
+            try:
+                os.remove(os.path.join(DOWNLOAD_FOLDER, row['path']))
+            except FileNotFoundError:
+                pass
+            total -= row['size'] or 0
+            removed.append((row['video_key'], row['format']))
+        if removed:
+            conn.executemany('DELETE FROM downloads WHERE video_key = ? AND format = ?', removed)
+            conn.commit()
+    return len(removed)
+
+
+download_queue = JobQueue(DOWNLOAD_PROCESSES, DOWNLOAD_QUEUE_MAX)
+
+
+def finished_download(url, format_type):
+    """Resultado de una descarga ya hecha de la misma URL y formato, si el archivo sigue ahí"""
+    with db_pool.connection() as conn:
+        row = conn.execute('SELECT path, result FROM downloads WHERE source_key = ? AND format = ?',
+                           (normalize_url(url), format_type)).fetchone()
+    if row and os.path.isfile(os.path.join(DOWNLOAD_FOLDER, row['path'])):
+        return json.loads(row['result'])
+    return None
+
+
+# ==================== ARCHIVO ZIP ====================
+ZIP_CHUNK_SIZE = 64 * 1024
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP_FLAGS = 0x0808  # bit 3: CRC y tamaños en el descriptor tras los datos; bit 11: nombres UTF-8
+ARCHIVE_NAME_UNSAFE = re.compile(r'[\x00-\x1f<>:"/\\|?*]+')
+
+
+def dos_datetime(added_at):
+    """Hora y fecha MS-DOS a partir de 'YYYY-MM-DD HH:MM:SS' (sin depender de la zona horaria)"""
+    try:
+        t = time.strptime(added_at, '%Y-%m-%d %H:%M:%S')
+    except (TypeError, ValueError):
+        t = time.gmtime(0)
+    return ((t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2),
+            ((max(t.tm_year, 1980) - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday)
+
+
+class ZipEntry:
+    """Un archivo dentro del zip (modo store: los datos van tal cual, sin recomprimir)"""
+
+    def __init__(self, name, added_at, size=None, source=None):
+        self.name = name.encode('utf-8')
+        self.time, self.date = dos_datetime(added_at)
+        self.size = size
+        self.source = source
+        self.crc = None
+        self.offset = None
+        # Sin tamaño previo (origen remoto) se reserva zip64 por si pasa de 4 GB
+        self.zip64 = size is None or size >= ZIP64_LIMIT
+
+    def local_header(self):
+        extra = struct.pack('<HHQQ', 1, 16, 0, 0) if self.zip64 else b''
+        marker = ZIP64_LIMIT if self.zip64 else 0
+        return struct.pack('<IHHHHHIIIHH', 0x04034b50, 45 if self.zip64 else 20, ZIP_FLAGS, 0, self.time,
+                           self.date, 0, marker, marker, len(self.name), len(extra)) + self.name + extra
+
+    def local_header_size(self):
+        return 30 + len(self.name) + (20 if self.zip64 else 0)
+
+    def descriptor(self):
+        if self.zip64:
+            return struct.pack('<IIQQ', 0x08074b50, self.crc, self.size, self.size)
+        return struct.pack('<IIII', 0x08074b50, self.crc, self.size, self.size)
+
+    def descriptor_size(self):
+        return 24 if self.zip64 else 16
+
+    def central_zip64(self):
+        return self.zip64 or self.offset >= ZIP64_LIMIT
+
+    def central_header(self):
+        if self.central_zip64():
+            extra = struct.pack('<HHQQQ', 1, 24, self.size, self.size, self.offset)
+            size = offset = ZIP64_LIMIT
+        else:
+            extra, size, offset = b'', self.size, self.offset
+        version = 45 if self.central_zip64() else 20
+        return struct.pack('<IHHHHHHIIIHHHHHII', 0x02014b50, version, version, ZIP_FLAGS, 0, self.time, self.date,
+                           self.crc, size, size, len(self.name), len(extra), 0, 0, 0, 0o100644 << 16,
+                           offset) + self.name + extra
+
+    def central_header_size(self):
+        return 46 + len(self.name) + (28 if self.central_zip64() else 0)
+
+
+def zip_end_records(count, cd_offset, cd_size):
+    """Fin del directorio central, con los registros zip64 cuando algún valor no cabe en 16/32 bits"""
+    records = b''
+    if count >= 0xFFFF or cd_offset >= ZIP64_LIMIT or cd_size >= ZIP64_LIMIT:
+        records += struct.pack('<IQHHIIQQQQ', 0x06064b50, 44, 45, 45, 0, 0, count, count, cd_size, cd_offset)
+        records += struct.pack('<IIQI', 0x07064b50, 0, cd_offset + cd_size, 1)
+    return records + struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, min(count, 0xFFFF), min(count, 0xFFFF),
+                                 min(cd_size, ZIP64_LIMIT), min(cd_offset, ZIP64_LIMIT), 0)
+
+
+def zip_end_records_size(count, cd_offset, cd_size):
+    return 22 + (76 if count >= 0xFFFF or cd_offset >= ZIP64_LIMIT or cd_size >= ZIP64_LIMIT else 0)
+
+
+def file_crc32(path):
+    crc = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(ZIP_CHUNK_SIZE), b''):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+
+class PlaylistArchive:
+    """Zip de los items de una playlist generado al vuelo, con memoria constante.
+
+    Los items de /downloads se leen del disco y el resto se descarga del
+    origen mientras se envía. Al final va manifest.json con los items que
+    no se pudieron incluir. Si todos los items son locales, la disposición
+    del zip se conoce de antemano y se puede servir por rangos.
+    """
+
+    def __init__(self, playlist, items):
+        self.playlist = playlist
+        self.entries = []
+        self.failed = []
+        for index, item in enumerate(items, start=1):
+            url = item['url'] or ''
+            title = ARCHIVE_NAME_UNSAFE.sub('_', item['title'] or '').strip(' .')[:100] or 'Sin título'
+            if url.startswith('/downloads/'):
+                path = safe_join(DOWNLOAD_FOLDER, url[len('/downloads/'):])
+                if path is None or not os.path.isfile(path):
+                    self.fail(item, 'Archivo no encontrado')
+                    continue
+                ext = os.path.splitext(path)[1].lstrip('.') or item['media_type']
+                self.entries.append(ZipEntry(f'{index:03d} - {title}.{ext}', item['added_at'],
+                                             os.path.getsize(path), ('file', path, item)))
+            elif url.startswith(('http://', 'https://')):
+                ext = item['media_type'] if re.fullmatch(r'[a-z0-9]{1,5}', item['media_type'] or '') else 'bin'
+                self.entries.append(ZipEntry(f'{index:03d} - {title}.{ext}', item['added_at'],
+                                             source=('url', url, item)))
+            else:
+                self.fail(item, 'El item no tiene un archivo descargable')
+
+    @property
+    def local(self):
+        return all(entry.source[0] == 'file' for entry in self.entries)
+
+    def fail(self, item, error):
+        self.failed.append({'id': item['id'], 'title': item['title'], 'url': item['url'], 'error': error})
+
+    def manifest_entry(self, files):
+        body = json.dumps({'playlist': self.playlist['name'], 'files': files, 'failed': self.failed},
+                          ensure_ascii=False, indent=2).encode('utf-8')
+        entry = ZipEntry('manifest.json', self.playlist['created_at'], len(body))
+        entry.crc = zlib.crc32(body)
+        return entry, body
+
+    def etag(self):
+        """Identifica la disposición exacta del zip (solo archivos locales, de contenido inmutable)"""
+        digest = hashlib.sha256()
+        for entry in self.entries:
+            digest.update(entry.name + b'\0' + entry.source[1].encode() + b'\0' + str(entry.size).encode())
+        digest.update(json.dumps(self.failed, sort_keys=True).encode())
+        return digest.hexdigest()[:32]
+
+    # Generación secuencial: vale para cualquier origen
+
+    def open_remote(self, entry):
+        url, item = entry.source[1], entry.source[2]
+        try:
+            response = fetch_public(url, stream=True)
+        except (requests.RequestException, CircuitOpenError) as e:
+            self.fail(item, str(e))
+            return None
+        if response is None:
+            self.fail(item, 'URL no permitida')
+            return None
+        content_type = response.headers.get('Content-Type', '')
+        if response.status_code != 200 or content_type.startswith(('text/html', 'application/json')):
+            # 403/410: enlace firmado caducado; HTML: es la página del vídeo, no el archivo
+            self.fail(item, f'El origen respondió {response.status_code} ({content_type or "sin tipo"})')
+            response.close()
+            return None
+        return response
+
+    def read_source(self, entry, response):
+        if response is None:
+            with open(entry.source[1], 'rb') as f:
+                yield from iter(lambda: f.read(ZIP_CHUNK_SIZE), b'')
+            return
+        try:
+            yield from response.iter_content(ZIP_CHUNK_SIZE)
+        except requests.RequestException as e:
+            # El zip sigue siendo válido: el descriptor recoge lo que llegó a enviarse
+            self.fail(entry.source[2], f'Descarga incompleta: {e}')
+        finally:
+            response.close()
+
+    def stream(self):
+        offset = 0
+        written = []
+        for entry in self.entries:
+            response = None
+            if entry.source[0] == 'url':
+                response = self.open_remote(entry)
+                if response is None:
+                    continue
+            entry.offset = offset
+            header = entry.local_header()
+            yield header
+            crc = size = 0
+            for chunk in self.read_source(entry, response):
+                crc = zlib.crc32(chunk, crc)
+                size += len(chunk)
+                yield chunk
+            entry.crc, entry.size = crc, size
+            descriptor = entry.descriptor()
+            yield descriptor
+            offset += len(header) + size + len(descriptor)
+            written.append(entry)
+
+        manifest, body = self.manifest_entry(len(written))
+        manifest.offset = offset
+        for part in (manifest.local_header(), body, manifest.descriptor()):
+            yield part
+            offset += len(part)
+        written.append(manifest)
+
+        central = b''.join(entry.central_header() for entry in written)
+        yield central
+        yield zip_end_records(len(written), offset, len(central))
+
+    # Disposición fija y rangos: solo con todos los archivos locales
+
+    def layout(self):
+        """Piezas (inicio, longitud, tipo, valor) del zip completo y su tamaño total"""
+        pieces = []
+        offset = 0
+
+        def add(length, kind, value):
+            nonlocal offset
+            pieces.append((offset, length, kind, value))
+            offset += length
+
+        manifest, body = self.manifest_entry(len(self.entries))
+        entries = self.entries + [manifest]
+        for entry in entries:
+            entry.offset = offset
+            add(entry.local_header_size(), 'header', entry)
+            add(entry.size, 'data', body if entry is manifest else entry)
+            add(entry.descriptor_size(), 'descriptor', entry)
+        cd_offset = offset
+        cd_size = sum(entry.central_header_size() for entry in entries)
+        add(cd_size, 'central', entries)
+        add(zip_end_records_size(len(entries), cd_offset, cd_size), 'end', (len(entries), cd_offset, cd_size))
+        return pieces, offset
+
+    def ensure_crc(self, entry):
+        if entry.crc is None:
+            entry.crc = file_crc32(entry.source[1])
+        return entry.crc
+
+    def piece_bytes(self, kind, value, start, stop):
+        """Bytes [start, stop) de una pieza; los datos de archivo se leen por bloques"""
+        if kind == 'data' and isinstance(value, ZipEntry):
+            with open(value.source[1], 'rb') as f:
+                f.seek(start)
+                # Si se envía el archivo entero se aprovecha para calcular su CRC
+                crc = 0 if start == 0 and stop == value.size else None
+                remaining = stop - start
+                while remaining > 0:
+                    chunk = f.read(min(ZIP_CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    if crc is not None:
+                        crc = zlib.crc32(chunk, crc)
+                    remaining -= len(chunk)
+                    yield chunk
+                if crc is not None and remaining == 0:
+                    value.crc = crc
+            return
+        if kind == 'header':
+            data = value.local_header()
+        elif kind == 'data':
+            data = value
+        elif kind == 'descriptor':
+            self.ensure_crc(value)
+            data = value.descriptor()
+        elif kind == 'central':
+            for entry in value:
+                self.ensure_crc(entry)
+            data = b''.join(entry.central_header() for entry in value)
+        else:
+            data = zip_end_records(*value)
+        yield data[start:stop]
+
+    def stream_range(self, pieces, start, stop):
+        for offset, length, kind, value in pieces:
+            if offset + length <= start or offset >= stop or length == 0:
+                continue
+            yield from self.piece_bytes(kind, value, max(start - offset, 0), min(stop - offset, length))
+
+# ==================== PROXY DE MEDIOS ====================
+class DiskLRUCache:
+    """Archivos en disco con un índice LRU en SQLite compartido por todos los workers.
+
+    Se escribe primero en un temporal y solo se publica (os.replace) el archivo
+    completo, así que nunca se sirve uno a medias. Al pasar de max_bytes se
+    borran los menos usados recientemente.
+    """
+
+    # Como en SQLiteCache, accessed_at se actualiza como mucho una vez por minuto
+    TOUCH_INTERVAL = 60
+    TEMP_MAX_AGE = 24 * 3600
+
+    def __init__(self, folder, index_path, namespace, max_bytes):
+        self.folder = os.path.join(folder, namespace)
+        self.temp_folder = os.path.join(self.folder, '.tmp')
+        self.index_path = index_path
+        self.namespace = namespace
+        self.max_bytes = max_bytes
+        self.local = threading.local()
+        os.makedirs(self.temp_folder, exist_ok=True)
+        conn = self._conn()
+        conn.execute('''CREATE TABLE IF NOT EXISTS disk_cache (
+            namespace TEXT NOT NULL,
+            key TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            content_type TEXT,
+            accessed_at REAL NOT NULL,
+            PRIMARY KEY (namespace, key)
+        )''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_disk_cache_accessed ON disk_cache(namespace, accessed_at)')
+        conn.commit()
+        self.prune_temp()
+
+    def _conn(self):
+        return thread_connection(self.local, self.index_path)
+
+    def path_for(self, digest):
+        return os.path.join(self.folder, digest[:2], digest)
+
+    def get(self, key):
+        """(ruta, content_type) del archivo guardado para key, o None"""
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        conn = self._conn()
+        row = conn.execute('SELECT content_type, accessed_at FROM disk_cache WHERE namespace = ? AND key = ?',
+                           (self.namespace, digest)).fetchone()
+        if row is None:
+            return None
+        path = self.path_for(digest)
+        now = time.time()
+        if not os.path.isfile(path):
+            conn.execute('DELETE FROM disk_cache WHERE namespace = ? AND key = ?', (self.namespace, digest))
+            conn.commit()
+            return None
+        if now - row[1] > self.TOUCH_INTERVAL:
+            conn.execute('UPDATE disk_cache SET accessed_at = ? WHERE namespace = ? AND key = ?',
+                         (now, self.namespace, digest))
+            conn.commit()
+        return path, row[0]
+
+    def temp_path(self):
+        return os.path.join(self.temp_folder, secrets.token_hex(16))
+
+    def put(self, key, temp_path, content_type):
+        """Publica un temporal ya completo y hace sitio expulsando los menos usados"""
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        path = self.path_for(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        size = os.path.getsize(temp_path)
+        os.replace(temp_path, path)
+        conn = self._conn()
+        conn.execute('''INSERT OR REPLACE INTO disk_cache (namespace, key, size, content_type, accessed_at)
+                        VALUES (?, ?, ?, ?, ?)''', (self.namespace, digest, size, content_type, time.time()))
+        conn.commit()
+        self.evict()
+        return path
+
+    def evict(self):
+        conn = self._conn()
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM disk_cache WHERE namespace = ?',
+                             (self.namespace,)).fetchone()[0]
+        while total > self.max_bytes:
+            victims = conn.execute('''SELECT key, size FROM disk_cache WHERE namespace = ?
+                                      ORDER BY accessed_at LIMIT 32''', (self.namespace,)).fetchall()
+            if not victims:
+                break
+            for digest, size in victims:
+                if total <= self.max_bytes:
+                    break
+                # En Linux quien ya lo tenga abierto (send_file) termina de enviarlo igualmente
+                try:
+                    os.remove(self.path_for(digest))
+                except FileNotFoundError:
+                    pass
+                conn.execute('DELETE FROM disk_cache WHERE namespace = ? AND key = ?', (self.namespace, digest))
+                total -= size
+            conn.commit()
+
+    def prune_temp(self):
+        """Borra temporales huérfanos de workers que murieron a mitad de una descarga"""
+        cutoff = time.time() - self.TEMP_MAX_AGE
+        for entry in os.scandir(self.temp_folder):
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        entries, size = self._conn().execute('''SELECT COUNT(*), COALESCE(SUM(size), 0) FROM disk_cache
+                                                WHERE namespace = ?''', (self.namespace,)).fetchone()
+        return {'entries': entries, 'bytes': size, 'max_bytes': self.max_bytes}
+
+
+media_files = DiskLRUCache(MEDIA_CACHE_FOLDER, CACHE_DATABASE, 'media', MEDIA_CACHE_MAX_BYTES)
+
+
+def resolve_item_url(item, dead_url=None):
+    """Vuelve a extraer el enlace de un item desde su página de origen y lo guarda.
+
+    La extracción es red (y puede tardar segundos): no se llama con una conexión
+    del pool tomada, y la de la escritura se pide solo al final.
+    """
+    platform = item['platform'] or 'other'
+    format_type = 'mp3' if item['media_type'] == 'mp3' else 'mp4'
+    key = cache_key(item['source_url'], platform, format_type)
+    # Solo se descarta la entrada con el enlace caducado: si otra petición ya lo
+    # renovó se reutiliza, y las simultáneas comparten la extracción (singleflight)
+    cached = metadata_cache.get(key)
+    if cached is not None and media_link(cached) == dead_url:
+        metadata_cache.delete(key)
+    try:
+        data = get_media_info(item['source_url'], platform, format_type)
+    except Exception:
+        data = {}
+    url = media_link(data) if data.get('success') else None
+    MEDIA_RESOLVES.labels('success' if url else 'error').inc()
+    if url:
+        # Las portadas de TikTok también van firmadas y caducan con el enlace
+        with db_pool.connection() as conn:
+            conn.execute('''UPDATE playlist_items SET url = ?, url_expires_at = ?, thumbnail = COALESCE(?, thumbnail)
+                            WHERE id = ?''', (url, signed_url_expiry(url), data.get('thumbnail'), item['id']))
+            conn.commit()
+    return url
+
+
+def open_media_upstream(url, range_header):
+    if not url:
+        return None
+    # identity: el cuerpo se reenvía y se guarda tal cual, con el Content-Length del origen
+    headers = {'Accept-Encoding': 'identity'}
+    if range_header:
+        headers['Range'] = range_header
+    return fetch_public(url, stream=True, headers=headers)
+
+
+def media_stream_response(key, upstream):
+    """Reenvía la respuesta del origen y, si es el archivo entero, lo guarda en la caché a la vez"""
+    content_type = upstream.headers.get('Content-Type') or 'application/octet-stream'
+    length = upstream.headers.get('Content-Length')
+    length = int(length) if length and length.isdigit() else None
+    content_range = upstream.headers.get('Content-Range')
+    # Un 206 que abarca el archivo entero (el "bytes=0-" de <video>) también sirve para la caché
+    whole = re.fullmatch(r'bytes 0-(\d+)/(\d+)', content_range or '')
+    complete = upstream.status_code == 200 or bool(whole and int(whole[1]) + 1 == int(whole[2]))
+    cacheable = (complete and (length or 0) <= MEDIA_CACHE_MAX_OBJECT and
+                 not content_type.startswith(('text/html', 'application/json')))
+
+    def generate():
+        temp_path = media_files.temp_path() if cacheable else None
+        temp = open(temp_path, 'wb') if temp_path else None
+        written = 0
+        finished = False
+        try:
+            for chunk in upstream.iter_content(MEDIA_CHUNK_SIZE):
+                written += len(chunk)
+                if temp is not None and written > MEDIA_CACHE_MAX_OBJECT:
+                    temp.close()
+                    os.remove(temp_path)
+                    temp = None
+                if temp is not None:
+                    temp.write(chunk)
+                yield chunk
+            finished = True
+        finally:
+            # También si el cliente corta a mitad: el temporal incompleto se descarta
+            upstream.close()
+            if temp is not None:
+                temp.close()
+                if finished and (length is None or written == length):
+                    media_files.put(key, temp_path, content_type)
+                else:
+                    os.remove(temp_path)
+
+    response = Response(generate(), status=upstream.status_code, content_type=content_type)
+    if length is not None:
+        response.content_length = length
+    if content_range:
+        response.headers['Content-Range'] = content_range
+    response.headers['Accept-Ranges'] = upstream.headers.get('Accept-Ranges', 'bytes')
+    response.cache_control.private = True
+    return response
+
+
+def link_expiry(item):
+    # Las filas anteriores a url_expires_at la llevan solo dentro de la propia URL firmada
+    return item['url_expires_at'] or signed_url_expiry(item['url'])
+
+
+def link_expired(item, now):
+    """True si el enlace ya no sirve: sin resolver (extract_flat) o con la firma caducada"""
+    if item['url'] == item['source_url']:
+        return True
+    expires_at = link_expiry(item)
+    return expires_at is not None and expires_at <= now
+
+
+def link_needs_refresh(item, now):
+    """True si el enlace se puede renovar y caduca (o ha caducado) antes de LINK_REFRESH_MARGIN"""
+    if not item['source_url'] or not (item['url'] or '').startswith(('http://', 'https://')):
+        return False
+    if link_expired(item, now):
+        return True
+    expires_at = link_expiry(item)
+    return expires_at is not None and expires_at - now < LINK_REFRESH_MARGIN
+
+
+class LinkRefresher:
+    """Renueva en segundo plano los enlaces de los items que están a punto de caducar.
+
+    Las rutas solo encolan ids. Cada plataforma tiene su cola y un máximo de
+    extracciones simultáneas, para que abrir una playlist grande no lance
+    decenas de peticiones a la vez contra YouTube o tikwm.
+    """
+
+    def __init__(self, budgets, default_budget, max_pending, workers):
+        self.budgets = budgets
+        self.default_budget = default_budget
+        self.max_pending = max_pending
+        self.workers = workers
+        self.pending = {}
+        self.running = {}
+        self.queued = set()
+        self.lock = threading.Lock()
+        self.executor = None
+
+    def schedule(self, items):
+        with self.lock:
+            for item in items:
+                if item['id'] in self.queued or len(self.queued) >= self.max_pending:
+                    continue
+                self.queued.add(item['id'])
+                self.pending.setdefault(item['platform'] or 'other', deque()).append(item['id'])
+            self._dispatch()
+
+    def _dispatch(self):
+        # Se llama con self.lock tomado
+        if self.executor is None:
+            # Como en JobQueue, el executor se crea ya dentro del worker (seguro con preload)
+            self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='refresh')
+        for platform, pending in self.pending.items():
+            budget = self.budgets.get(platform, self.default_budget)
+            while pending and self.running.get(platform, 0) < budget:
+                self.running[platform] = self.running.get(platform, 0) + 1
+                self.executor.submit(self._refresh, platform, pending.popleft())
+
+    def _refresh(self, platform, item_id):
+        try:
+            with db_pool.connection() as conn:
+                item = conn.execute('''SELECT id, url, media_type, source_url, platform, url_expires_at
+                                       FROM playlist_items WHERE id = ?''', (item_id,)).fetchone()
+            # Otro worker pudo renovarlo mientras esperaba en la cola
+            if item is not None and link_needs_refresh(item, time.time()):
+                resolve_item_url(item, dead_url=item['url'])
+        except Exception:
+            MEDIA_RESOLVES.labels('error').inc()
+        finally:
+            with self.lock:
+                self.running[platform] -= 1
+                self.queued.discard(item_id)
+                self._dispatch()
+
+    def stats(self):
+        with self.lock:
+            return {'pending': {platform: len(pending) for platform, pending in self.pending.items() if pending},
+                    'running': {platform: count for platform, count in self.running.items() if count}}
+
+
+link_refresher = LinkRefresher(LINK_REFRESH_BUDGETS, LINK_REFRESH_DEFAULT_BUDGET, LINK_REFRESH_QUEUE_MAX,
+                               LINK_REFRESH_WORKERS)
+
+
+def live_links(items, code=None):
+    """Los items de una página con enlaces utilizables, sin esperar a ninguna extracción.
+
+    Los que caducan pronto se renuevan en segundo plano; mientras tanto, los que
+    ya no sirven apuntan a /media, que los renueva al pedirlos.
+    """
+    now = time.time()
+    for item in items:
+        # Antes de cambiar url: la versión es la de la imagen que /thumb va a usar
+        item['thumb_version'] = thumb_version(item)
+    stale = [item for item in items if link_needs_refresh(item, now)]
+    for item in stale:
+        if link_expired(item, now):
+            item['url'] = url_for('media_proxy', item_id=item['id'], code=code)
+    if stale:
+        link_refresher.schedule(stale)
+    return items
+
+
+# ==================== MINIATURAS ====================
+THUMB_MIMETYPES = {'avif': 'image/avif', 'webp': 'image/webp', 'jpeg': 'image/jpeg'}
+IMAGE_MEDIA_TYPES = ('jpg', 'jpeg', 'png', 'webp', 'gif', 'image')
+AUDIO_MEDIA_TYPES = ('mp3', 'audio', 'wav', 'ogg')
+
+
+def available_thumb_formats():
+    """Formatos que se pueden generar, del más ligero al más compatible"""
+    if Image is not None:
+        extensions = Image.registered_extensions()
+        return tuple(fmt for fmt, ext in (('avif', '.avif'), ('webp', '.webp'), ('jpeg', '.jpg')) if ext in extensions)
+    if FFMPEG is None:
+        return ()
+    encoders = subprocess.run([FFMPEG, '-hide_banner', '-encoders'], capture_output=True, text=True).stdout
+    return ('webp', 'jpeg') if 'libwebp' in encoders else ('jpeg',)
+
+
+THUMB_FORMATS = available_thumb_formats()
+thumb_files = DiskLRUCache(MEDIA_CACHE_FOLDER, CACHE_DATABASE, 'thumbs', THUMB_CACHE_MAX_BYTES)
+
+
+def thumb_width(value):
+    """Ancho pedido redondeado hacia arriba a uno de THUMB_WIDTHS (pocas variantes en caché)"""
+    try:
+        width = int(value)
+    except (TypeError, ValueError):
+        return THUMB_DEFAULT_WIDTH
+    return next((w for w in THUMB_WIDTHS if w >= width), THUMB_WIDTHS[-1])
+
+
+def thumb_format(accept):
+    # Solo cuenta lo que el navegador nombra explícitamente: */* no garantiza que entienda AVIF
+    accepted = {mimetype for mimetype, quality in accept if quality > 0}
+    for fmt in THUMB_FORMATS:
+        if THUMB_MIMETYPES[fmt] in accepted or fmt == 'jpeg':
+            return fmt
+    return None
+
+
+def thumb_source_key(item):
+    """Identidad de la imagen de origen: los items que comparten blob o portada comparten miniaturas"""
+    if item['thumbnail']:
+        return 'url:' + item['thumbnail']
+    if item['blob_hash']:
+        return 'blob:' + item['blob_hash']
+    return 'url:' + (item['url'] or '')
+
+
+def thumb_version(item):
+    """Versión de la miniatura para su URL: cambia con la imagen de origen (p. ej. al renovar el enlace)"""
+    return hashlib.sha256(thumb_source_key(item).encode('utf-8')).hexdigest()[:12]
+
+
+def local_download_path(url):
+    if url and url.startswith('/downloads/'):
+        return safe_join(DOWNLOAD_FOLDER, url[len('/downloads/'):])
+    return None
+
+
+def fetch_thumb_source(url, path):
+    """Descarga una imagen remota a path (con límite de tamaño); False si no es una imagen válida"""
+    response = fetch_public(url, stream=True)
+    if response is None:
+        return False
+    try:
+        if response.status_code != 200 or not response.headers.get('Content-Type', '').startswith('image/'):
+            return False
+        size = 0
+        with open(path, 'wb') as f:
+            for chunk in response.iter_content(MEDIA_CHUNK_SIZE):
+                size += len(chunk)
+                if size > THUMB_SOURCE_MAX_BYTES:
+                    return False
+                f.write(chunk)
+        return True
+    finally:
+        response.close()
+
+
+def extract_video_frame(video_path, path):
+    """Un fotograma del vídeo como PNG (en el segundo 1, o el primero si es más corto)"""
+    for seek in ('1', '0'):
+        result = subprocess.run([FFMPEG, '-v', 'error', '-ss', seek, '-i', video_path, '-frames:v', '1',
+                                 '-f', 'image2', '-c:v', 'png', '-y', path], capture_output=True, timeout=THUMB_TIMEOUT)
+        if result.returncode == 0 and os.path.getsize(path) > 0:
+            return True
+    return False
+
+
+def thumb_source(item):
+    """Ruta local de la imagen de origen de un item, descargándola o extrayéndola una sola vez"""
+    key = thumb_source_key(item)
+    image = item['thumbnail'] or (item['url'] if item['media_type'] in IMAGE_MEDIA_TYPES else None)
+    local_image = local_download_path(image)
+    if local_image and os.path.isfile(local_image):
+        return local_image
+
+    cached = thumb_files.get(key + '|source')
+    if cached is not None:
+        return cached[0]
+
+    video = local_download_path(item['url'])
+    temp_path = thumb_files.temp_path()
+    try:
+        if image and image.startswith(('http://', 'https://')):
+            ok = fetch_thumb_source(image, temp_path)
+        elif video and os.path.isfile(video) and item['media_type'] not in AUDIO_MEDIA_TYPES and FFMPEG:
+            ok = extract_video_frame(video, temp_path)
+        else:
+            ok = False
+        if ok:
+            return thumb_files.put(key + '|source', temp_path, None)
+        return None
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def render_thumbnail(source, width, fmt):
+    """Bytes de la miniatura de la imagen source con el ancho dado (sin ampliar nunca)"""
+    if Image is not None:
+        with Image.open(source) as img:
+            # JPEG: se decodifica ya reducido (escalado en la DCT), mucho más rápido con fotos grandes
+            img.draft('RGB', (width * 2, width * 2))
+            img = ImageOps.exif_transpose(img)
+            img.thumbnail((width, width * 4))
+            if img.mode not in ('RGB', 'RGBA') or fmt == 'jpeg':
+                img = img.convert('RGBA' if fmt != 'jpeg' and img.mode in ('LA', 'PA', 'P') else 'RGB')
+            output = io.BytesIO()
+            img.save(output, fmt.upper(), quality=THUMB_QUALITY[fmt])
+            return output.getvalue()
+    codec = ['-c:v', 'libwebp', '-quality', str(THUMB_QUALITY['webp'])] if fmt == 'webp' else ['-c:v', 'mjpeg', '-q:v', '4']
+    result = subprocess.run([FFMPEG, '-v', 'error', '-i', source, '-vf', f"scale='min({width},iw)':-2", '-frames:v', '1',
+                             *codec, '-f', 'image2pipe', '-'], capture_output=True, check=True, timeout=THUMB_TIMEOUT)
+    return result.stdout
+
+
+def build_thumbnail(item, width, fmt):
+    """Ruta en caché de la miniatura (width, fmt) de un item, o None si no tiene imagen de origen"""
+    key = f'{thumb_source_key(item)}|{width}|{fmt}'
+    cached = thumb_files.get(key)
+    if cached is not None:
+        return cached[0]
+    source = thumb_source(item)
+    if source is None:
+        return None
+    # Se convierte antes de crear el temporal: si la imagen no se puede leer no queda nada a medias
+    data = render_thumbnail(source, width, fmt)
+    temp_path = thumb_files.temp_path()
+    try:
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        return thumb_files.put(key, temp_path, THUMB_MIMETYPES[fmt])
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+class ThumbnailPool:
+    """Pool acotado para descargar y convertir miniaturas fuera de los hilos de las peticiones.
+
+    Las peticiones simultáneas de la misma miniatura esperan al mismo trabajo.
+    """
+
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self.inflight = {}
+        # Reentrante: si el trabajo ya terminó, add_done_callback llama a _forget en este mismo hilo
+        self.lock = threading.RLock()
+        self.executor = None
+
+    def submit(self, item, width, fmt):
+        key = (thumb_source_key(item), width, fmt)
+        with self.lock:
+            future = self.inflight.get(key)
+            if future is None:
+                # Creado en el primer uso, ya dentro del worker (seguro con preload)
+                if self.executor is None:
+                    self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='thumb')
+                future = self.executor.submit(build_thumbnail, item, width, fmt)
+                self.inflight[key] = future
+                future.add_done_callback(lambda done: self._forget(key, done))
+        return future
+
+    def _forget(self, key, future):
+        with self.lock:
+            if self.inflight.get(key) is future:
+                del self.inflight[key]
+
+    def prewarm(self, item):
+        """Genera en segundo plano la miniatura por defecto de un item recién subido"""
+        if THUMB_FORMATS:
+            self.submit(item, THUMB_DEFAULT_WIDTH, THUMB_FORMATS[0])
+
+
+thumbnail_pool = ThumbnailPool(THUMB_WORKERS)
+
+
+# ==================== HTML TEMPLATE ====================
+HTML_TEMPLATE = '''
+<!DOCTYPE html>
+<html lang="es">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>MediaDownloaderPRO v2.0</title>
+    <script src="https://www.google.com/recaptcha/api.js" async defer></script>
+    <link rel="stylesheet" href="{{ asset_url('app.css') }}">
+</head>
+<body>
+    <div class="container">
+        <div class="user-info" id="userInfo">
+            <span id="userDisplay"></span>
+            <button class="logout-btn" onclick="logout()">Cerrar Sesión</button>
         </div>
-    </div>
-    
-    <script>
-        let selectedPlatform = 'youtube';
-        let selectedFormat = 'mp4';
-        let currentMedia = null;
-        
-        // Auth functions
-        function switchAuthTab(tab) {
-            document.querySelectorAll('.auth-tab').forEach(t => t.classList.remove('active'));
-            document.querySelectorAll('.auth-form').forEach(f => f.classList.remove('active'));
-            
-            event.target.classList.add('active');
-            document.getElementById(tab + 'Form').classList.add('active');
-        }
-        
-        async function handleLogin(e) {
-            e.preventDefault();
-            const formData = new FormData(e.target);
-            
-            try {
-                const response = await fetch('/login', {
-                    method: 'POST',
-                    headers: {'Content-Type': 'application/json'},
-                    body: JSON.stringify(Object.fromEntries(formData))
-                });
-                
-                const data = await response.json();
-                
-                if (data.success) {
-                    showSuccess('¡Inicio de sesión exitoso!');
-                    setTimeout(() => {
-                        document.getElementById('authSection').style.display = 'none';
-                        document.getElementById('mainContent').classList.add('active');
-                        document.getElementById('userInfo').classList.add('active');
-                        document.getElementById('userDisplay').textContent = data.arobase;
-                        loadPlaylists();
-                    }, 1000);
-                } else {
-                    showError(data.error);
-                }
-            } catch (error) {
-                showError('Error de conexión');
-            }
-        }
-        
-        async function handleRegister(e) {
-            e.preventDefault();
-            const formData = new FormData(e.target);
-            const data = Object.fromEntries(formData);
-            
-            if (data.password !== data.confirm_password) {
-                showError('Las contraseñas no coinciden');
-                return false;
-            }
-            
-            if (!data.arobase.startsWith('@')) {
-                showError('El nombre de arroba debe comenzar con @');
-                return false;
-            }
-            
-            try {
-                const response = await fetch('/register', {
-                    method: 'POST',
-                    headers: {'Content-Type': 'application/json'},
-                    body: JSON.stringify(data)
-                });
-                
-                const result = await response.json();
-                
-                if (result.success) {
-                    showSuccess('¡Cuenta creada exitosamente! Ahora puedes iniciar sesión.');
-                    setTimeout(() => {
-                        switchAuthTab('login');
-                    }, 2000);
-                } else {
-                    showError(result.error);
-                }
-            } catch (error) {
-                showError('Error de conexión');
-            }
-            
-            return false;
-        }
-        
-        async function logout() {
-            try {
-                await fetch('/logout', { method: 'POST' });
-                location.reload();
-            } catch (error) {
-                console.error('Error al cerrar sesión');
-            }
-        }
-        
-        function showError(msg) {
-            const errorDiv = document.getElementById('errorMsg');
-            if (errorDiv) {
-                errorDiv.textContent = msg;
-                errorDiv.style.display = 'block';
-                setTimeout(() => errorDiv.style.display = 'none', 5000);
-            }
-            console.error('Error:', msg);
-        }
-        
-        function showSuccess(msg) {
-            const successDiv = document.getElementById('successMsg');
-            if (successDiv) {
-                successDiv.textContent = msg;
-                successDiv.style.display = 'block';
-                setTimeout(() => successDiv.style.display = 'none', 3000);
-            }
-            console.log('Success:', msg);
-        }
-        
-        // Section switching
-        function switchSection(section) {
-            document.querySelectorAll('.nav-btn').forEach(btn => btn.classList.remove('active'));
-            document.querySelectorAll('.section').forEach(s => s.classList.remove('active'));
-            
-            event.target.classList.add('active');
-            document.getElementById(section + 'Section').classList.add('active');
-            
-            if (section === 'playlists') {
-                loadPlaylists();
-            }
-        }
-        
-        // Platform selection
-        document.querySelectorAll('.platform-btn').forEach(btn => {
-            btn.addEventListener('click', function() {
-                document.querySelectorAll('.platform-btn').forEach(b => b.classList.remove('active'));
-                this.classList.add('active');
-                selectedPlatform = this.dataset.platform;
-                
-                document.getElementById('photoBtn').style.display = 
-                    selectedPlatform === 'tiktok' ? 'inline-block' : 'none';
-            });
-        });
-        
-        // Format selection
-        document.querySelectorAll('.format-btn').forEach(btn => {
-            btn.addEventListener('click', function() {
-                document.querySelectorAll('.format-btn').forEach(b => b.classList.remove('active'));
-                this.classList.add('active');
-                selectedFormat = this.dataset.format;
-            });
-        });
-        
-        // URL functions
-        async function pasteUrl() {
-            try {
-                const text = await navigator.clipboard.readText();
-                document.getElementById('urlInput').value = text;
-            } catch (error) {
-                showError('No se pudo pegar desde el portapapeles');
-            }
-        }
-        
-        function clearUrl() {
-            document.getElementById('urlInput').value = '';
-            document.getElementById('previewSection').style.display = 'none';
-            currentMedia = null;
-        }
-        
-        async function processMedia() {
-            const url = document.getElementById('urlInput').value;
-            if (!url) {
-                showError('Por favor ingresa una URL');
-                return;
-            }
-            
-            document.getElementById('loading').style.display = 'block';
-            document.getElementById('previewSection').style.display = 'none';
-            
-            try {
-                const response = await fetch('/process', {
-                    method: 'POST',
-                    headers: {'Content-Type': 'application/json'},
-                    body: JSON.stringify({
-                        url: url,
-                        platform: selectedPlatform,
-                        format: selectedFormat
-                    })
-                });
-                
-                const data = await response.json();
-                
-                if (data.success) {
-                    currentMedia = data;
-                    displayPreview(data);
-                } else {
-                    showError('Error: ' + data.error);
-                }
-            } catch (error) {
-                showError('Error de conexión: ' + error);
-            } finally {
-                document.getElementById('loading').style.display = 'none';
-            }
-        }
         
-        function displayPreview(data) {
-            const previewSection = document.getElementById('previewSection');
-            const previewGrid = document.getElementById('previewGrid');
-            previewGrid.innerHTML = '';
+        <!-- AUTH SECTION -->
+        <div id="authSection">
+            <div class="header">
+                <h1>MediaDownloaderPRO v2.0</h1>
+                <p>Sistema avanzado de gestión multimedia</p>
+            </div>
             
-            if (data.platform === 'tiktok') {
-                // Info card para TikTok
-                previewGrid.innerHTML += `
-                    <div class="preview-card">
-                        <h3>📊 Información</h3>
-                        <p class="info-text">👤 ${data.uploader || 'Desconocido'}</p>
-                        <p class="info-text">👁️ ${formatNumber(data.view_count || 0)} vistas</p>
-                        <p class="info-text">❤️ ${formatNumber(data.like_count || 0)} likes</p>
-                        <p class="info-text">💬 ${formatNumber(data.comment_count || 0)} comentarios</p>
-                        <p class="info-text">↗️ ${formatNumber(data.share_count || 0)} compartidos</p>
-                    </div>
-                `;
-                
-                if (data.video) {
-                    previewGrid.innerHTML += `
-                        <div class="preview-card">
-                            <h3>🎥 Video</h3>
-                            ${data.thumbnail ? `<img src="${data.thumbnail}" alt="Thumbnail">` : ''}
-                            <p class="info-text"><strong>${data.title || 'Sin título'}</strong></p>
-                            <p class="info-text">⏱️ Duración: ${data.duration || 'N/A'}</p>
-                            <p class="info-text">📺 Calidad: ${data.quality || 'N/A'}</p>
-                            <a href="${data.video}" class="download-link" download="${sanitizeFilename(data.title)}.mp4">Descargar Video</a>
-                        </div>
-                    `;
-                }
+            <div class="auth-container">
+                <div class="auth-tabs">
+                    <button class="auth-tab active" onclick="switchAuthTab('login')">Iniciar Sesión</button>
+                    <button class="auth-tab" onclick="switchAuthTab('register')">Registrarse</button>
+                </div>
                 
-                if (data.audio) {
-                    previewGrid.innerHTML += `
-                        <div class="preview-card">
-                            <h3>🎵 Audio</h3>
-                            <audio controls src="${data.audio}" style="width:100%;"></audio>
-                            <a href="${data.audio}" class="download-link" download="${sanitizeFilename(data.title)}.mp3">Descargar Audio</a>
-                        </div>
-                    `;
-                }
+                <div id="errorMsg" class="error-msg"></div>
+                <div id="successMsg" class="success-msg"></div>
                 
-                if (data.images && data.images.length > 0) {
-                    data.images.forEach((img, idx) => {
-                        previewGrid.innerHTML += `
-                            <div class="preview-card">
-                                <h3>📷 Foto ${idx + 1}</h3>
-                                <img src="${img}" alt="Image ${idx + 1}">
-                                <a href="${img}" class="download-link" download="${sanitizeFilename(data.title)}_${idx + 1}.jpg">Descargar</a>
-                            </div>
-                        `;
-                    });
-                }
-            } else {
-                // Info card para YouTube y otras plataformas
-                previewGrid.innerHTML += `
-                    <div class="preview-card">
-                        <h3>📊 Información del Video</h3>
-                        ${data.thumbnail ? `<img src="${data.thumbnail}" alt="Thumbnail">` : ''}
-                        <p class="info-text"><strong>${data.title || 'Sin título'}</strong></p>
-                        <p class="info-text">👤 ${data.uploader || 'Desconocido'}</p>
-                        <p class="info-text">👁️ ${formatNumber(data.view_count || 0)} vistas</p>
-                        <p class="info-text">❤️ ${formatNumber(data.like_count || 0)} likes</p>
-                        <p class="info-text">⏱️ Duración: ${data.duration || 'N/A'}</p>
-                        <p class="info-text">📅 Subido: ${formatDate(data.upload_date)}</p>
+                <!-- LOGIN FORM -->
+                <form class="auth-form active" id="loginForm" onsubmit="return handleLogin(event)">
+                    <div class="form-group">
+                        <label>Usuario (@usuario)</label>
+                        <input type="text" class="form-input" name="username" required placeholder="@tu_usuario">
                     </div>
-                `;
-                
-                previewGrid.innerHTML += `
-                    <div class="preview-card">
-                        <h3>📥 Descargar</h3>
-                        <p class="info-text">Formato: ${data.format || 'N/A'}</p>
-                        <p class="info-text">Calidad: ${data.quality || 'N/A'}</p>
-                        <a href="${data.download_url}" class="download-link" download="${sanitizeFilename(data.title)}.${data.format.toLowerCase()}">
-                            Descargar ${data.format}
-                        </a>
+                    <div class="form-group">
+                        <label>Contraseña</label>
+                        <input type="password" class="form-input" name="password" required>
                     </div>
-                `;
-                
-                if (data.description) {
-                    previewGrid.innerHTML += `
-                        <div class="preview-card" style="grid-column: 1 / -1;">
-                            <h3>📝 Descripción</h3>
-                            <p class="info-text">${data.description}</p>
-                        </div>
-                    `;
-                }
-            }
-            
-            previewSection.style.display = 'block';
-        }
-        
-        function formatNumber(num) {
-            if (num >= 1000000) {
-                return (num / 1000000).toFixed(1) + 'M';
-            } else if (num >= 1000) {
-                return (num / 1000).toFixed(1) + 'K';
-            }
-            return num.toString();
-        }
-        
-        function formatDate(dateStr) {
-            if (!dateStr || dateStr === 'N/A') return 'N/A';
-            try {
-                const year = dateStr.substring(0, 4);
-                const month = dateStr.substring(4, 6);
-                const day = dateStr.substring(6, 8);
-                return `${day}/${month}/${year}`;
-            } catch {
-                return dateStr;
-            }
-        }
-        
-        function sanitizeFilename(filename) {
-            return filename.replace(/[^a-z0-9]/gi, '_').substring(0, 50);
-        }
-        
-        // Playlist functions
-        async function loadPlaylists() {
-            try {
-                const response = await fetch('/playlists');
-                
-                if (response.status === 401) {
-                    showError('Sesión expirada. Por favor inicia sesión nuevamente.');
-                    setTimeout(() => location.reload(), 2000);
-                    return;
-                }
-                
-                const data = await response.json();
-                console.log('Playlists cargadas:', data);
+                    <button type="submit" class="submit-btn">Iniciar Sesión</button>
+                </form>
                 
-                if (data.success) {
-                    displayPlaylists(data.playlists);
-                } else {
-                    console.error('Error al cargar playlists:', data.error);
-                    if (data.redirect) {
-                        showError('Sesión expirada. Recargando...');
-                        setTimeout(() => location.reload(), 2000);
-                    } else {
-                        showError(data.error || 'Error al cargar playlists');
-                    }
-                }
-            } catch (error) {
-                console.error('Error de conexión:', error);
-                showError('Error al cargar playlists: ' + error.message);
-            }
-        }
-        
-        function displayPlaylists(playlists) {
-            const grid = document.getElementById('playlistsGrid');
-            
-            console.log('Mostrando', playlists.length, 'playlists');
-            
-            if (!playlists || playlists.length === 0) {
-                grid.innerHTML = `
-                    <div style="grid-column: 1/-1; text-align: center; padding: 40px;">
-                        <p style="color:#aaa; font-size: 18px; margin-bottom: 20px;">
-                            📂 No tienes playlists aún
-                        </p>
-                        <p style="color:#666; margin-bottom: 30px;">
-                            ¡Crea tu primera playlist y comienza a organizar tu música y videos!
-                        </p>
-                        <button class="create-playlist-btn" onclick="showCreatePlaylist()">
-                            ✨ Crear Mi Primera Playlist
-                        </button>
+                <!-- REGISTER FORM -->
+                <form class="auth-form" id="registerForm" onsubmit="return handleRegister(event)">
+                    <div class="form-group">
+                        <label>Nombre de Usuario</label>
+                        <input type="text" class="form-input" name="username" required placeholder="tu_nombre">
                     </div>
-                `;
-                return;
-            }
-            
-            grid.innerHTML = playlists.map(playlist => `
-                <div class="playlist-card">
-                    <h3 class="playlist-title">${playlist.name}</h3>
-                    <p class="info-text">${playlist.description || 'Sin descripción'}</p>
-                    <p class="playlist-meta">📁 ${playlist.item_count || 0} elementos</p>
-                    <p class="playlist-meta">📅 Creada: ${new Date(playlist.created_at).toLocaleDateString()}</p>
-                    <span class="visibility-badge visibility-${playlist.visibility}">
-                        ${playlist.visibility === 'public' ? '🌍 Pública' : 
-                          playlist.visibility === 'private' ? '🔒 Privada' : 
-                          '🔑 Código: ' + (playlist.access_code || 'N/A')}
-                    </span>
-                    <div style="margin-top: 15px;">
-                        <button class="download-link" onclick="viewPlaylist(${playlist.id})">👁️ Ver Contenido</button>
+                    <div class="form-group">
+                        <label>Nombre de Arroba (@usuario)</label>
+                        <input type="text" class="form-input" name="arobase" required placeholder="@nombre_unico">
                     </div>
-                </div>
-            `).join('');
-        }
-        
-        function showCreatePlaylist() {
-            document.getElementById('createPlaylistModal').classList.add('active');
-        }
-        
-        function closeModal(modalId) {
-            document.getElementById(modalId).classList.remove('active');
-        }
-        
-        function toggleCodeField(select) {
-            const codeField = document.getElementById('codeField');
-            const codeInput = document.getElementById('generatedCode');
-            
-            if (select.value === 'code') {
-                codeField.style.display = 'block';
-                codeInput.value = generateAccessCode();
-            } else {
-                codeField.style.display = 'none';
-            }
-        }
-        
-        function generateAccessCode() {
-            return Math.random().toString(36).substring(2, 10).toUpperCase();
-        }
-        
-        async function createPlaylist(e) {
-            e.preventDefault();
-            const formData = new FormData(e.target);
-            const data = Object.fromEntries(formData);
-            
-            console.log('Datos del formulario:', data);
-            
-            if (data.visibility === 'code') {
-                data.access_code = document.getElementById('generatedCode').value;
-            } else {
-                data.access_code = null;
-            }
-            
-            console.log('Enviando datos:', data);
-            
-            try {
-                const response = await fetch('/create_playlist', {
-                    method: 'POST',
-                    headers: {'Content-Type': 'application/json'},
-                    body: JSON.stringify(data)
-                });
-                
-                const result = await response.json();
-                console.log('Respuesta del servidor:', result);
-                
-                if (result.success) {
-                    showSuccess('¡Playlist creada exitosamente!');
-                    closeModal('createPlaylistModal');
-                    setTimeout(() => {
-                        loadPlaylists();
-                    }, 500);
-                    e.target.reset();
-                    document.getElementById('codeField').style.display = 'none';
-                } else {
-                    showError(result.error || 'Error al crear playlist');
-                }
-            } catch (error) {
-                console.error('Error:', error);
-                showError('Error de conexión: ' + error.message);
-            }
-            
-            return false;
-        }
-        
-        async function showAddToPlaylist() {
-            if (!currentMedia) {
-                showError('Primero procesa un medio');
-                return;
-            }
-            
-            try {
-                const response = await fetch('/playlists');
-                const data = await response.json();
-                
-                if (data.success && data.playlists.length > 0) {
-                    const playlistSelect = data.playlists.map(p => 
-                        `<option value="${p.id}">${p.name}</option>`
-                    ).join('');
-                    
-                    const modalHTML = `
-                        <div class="modal active" id="addToPlaylistModal">
-                            <div class="modal-content">
-                                <div class="modal-header">
-                                    <h2>Añadir a Playlist</h2>
-                                    <button class="close-modal" onclick="closeAddToPlaylist()">×</button>
-                                </div>
-                                <div class="form-group">
-                                    <label>Selecciona una Playlist</label>
-                                    <select class="form-input" id="selectPlaylist">
-                                        ${playlistSelect}
-                                    </select>
-                                </div>
-                                <button class="submit-btn" onclick="addMediaToPlaylist()">Añadir</button>
-                            </div>
-                        </div>
-                    `;
-                    
-                    document.body.insertAdjacentHTML('beforeend', modalHTML);
-                } else {
-                    showError('Primero crea una playlist');
-                }
-            } catch (error) {
-                showError('Error al cargar playlists');
-            }
-        }
-        
-        function closeAddToPlaylist() {
-            const modal = document.getElementById('addToPlaylistModal');
-            if (modal) modal.remove();
-        }
-        
-        async function addMediaToPlaylist() {
-            const playlistId = document.getElementById('selectPlaylist').value;
-            
-            try {
-                const response = await fetch('/add_to_playlist', {
-                    method: 'POST',
-                    headers: {'Content-Type': 'application/json'},
-                    body: JSON.stringify({
-                        playlist_id: playlistId,
-                        media: currentMedia
-                    })
-                });
-                
-                const data = await response.json();
-                
-                if (data.success) {
-                    showSuccess('¡Media añadido a la playlist!');
-                    closeAddToPlaylist();
-                } else {
-                    showError(data.error);
-                }
-            } catch (error) {
-                showError('Error al añadir a playlist');
-            }
-        }
-        
-        function viewPlaylist(playlistId) {
-            loadPlaylistContent(playlistId);
-        }
-        
-        async function loadPlaylistContent(playlistId) {
-            try {
-                const response = await fetch(`/playlist/${playlistId}`);
-                const data = await response.json();
-                
-                if (data.success) {
-                    showPlaylistModal(data.playlist, data.items);
-                } else {
-                    showError(data.error);
-                }
-            } catch (error) {
-                showError('Error al cargar contenido');
-            }
-        }
-        
-        function showPlaylistModal(playlist, items) {
-            const itemsHTML = items.length > 0 ? items.map((item, idx) => {
-                const isAudio = item.media_type === 'mp3' || item.media_type === 'audio';
-                const isVideo = item.media_type === 'mp4' || item.media_type === 'video';
-                const isImage = item.media_type === 'jpg' || item.media_type === 'png' || item.media_type === 'image';
-                
-                let mediaPreview = '';
-                if (isImage || item.thumbnail) {
-                    mediaPreview = `<img src="${item.thumbnail || item.url}" alt="${item.title}">`;
-                } else if (isAudio) {
-                    mediaPreview = `
-                        <div style="background: rgba(0,242,255,0.1); padding: 30px; border-radius: 10px; text-align: center;">
-                            <p style="font-size: 48px; margin: 0;">🎵</p>
-                            <audio controls src="${item.url}" style="width:100%; margin-top: 10px;"></audio>
-                        </div>
-                    `;
-                } else if (isVideo) {
-                    mediaPreview = `<video controls src="${item.url}" style="width:100%; border-radius: 10px;"></video>`;
-                }
-                
-                return `
-                    <div class="preview-card" id="item-${item.id}">
-                        <div style="display: flex; justify-content: space-between; align-items: start;">
-                            <h3 contenteditable="true" 
-                                id="title-${item.id}" 
-                                onblur="renameItem(${item.id}, this.textContent)"
-                                style="flex: 1; cursor: text; border: 2px dashed transparent; padding: 5px; border-radius: 5px;"
-                                onfocus="this.style.borderColor='#00f2ff'"
-                                onblur="this.style.borderColor='transparent'">
-                                ${idx + 1}. ${item.title}
-                            </h3>
-                            <span style="font-size: 12px; color: #aaa; margin-left: 10px;">✏️</span>
-                        </div>
-                        ${mediaPreview}
-                        <p class="info-text">📁 Tipo: ${item.media_type.toUpperCase()}</p>
-                        <p class="info-text">⏱️ Duración: ${item.duration || 'N/A'}</p>
-                        <p class="info-text">📅 Añadido: ${new Date(item.added_at).toLocaleDateString()}</p>
-                        <div style="display: flex; gap: 10px; margin-top: 10px;">
-                            <a href="${item.url}" class="download-link" download="${item.title}.${item.media_type}" target="_blank" style="flex: 1; text-align: center;">
-                                📥 Descargar
-                            </a>
-                            <button class="icon-btn" onclick="removeFromPlaylist(${playlist.id}, ${item.id})" style="background: rgba(255,0,0,0.2); border-color: #f55; color: #f55;">
-                                🗑️
-                            </button>
-                        </div>
+                    <div class="form-group">
+                        <label>Contraseña</label>
+                        <input type="password" class="form-input" name="password" required minlength="8">
                     </div>
-                `;
-            }).join('') : '<p style="text-align:center;color:#aaa;">Esta playlist está vacía</p>';
-            
-            const shareHTML = playlist.visibility === 'code' ? `
-                <div style="background: rgba(255,165,0,0.2); padding: 15px; border-radius: 10px; margin: 20px 0;">
-                    <p style="color: #fa0; font-weight: 600;">🔑 Código de Acceso:</p>
-                    <p style="font-size: 24px; font-weight: 700; letter-spacing: 3px;">${playlist.access_code}</p>
-                    <button class="icon-btn" onclick="copyCode('${playlist.access_code}')">📋 Copiar</button>
-                </div>
-            ` : playlist.visibility === 'public' ? `
-                <div style="background: rgba(0,255,0,0.2); padding: 15px; border-radius: 10px; margin: 20px 0;">
-                    <p style="color: #0f0; font-weight: 600;">🌍 Esta playlist es pública</p>
-                    <p style="font-size: 14px; color: #aaa;">Cualquiera puede verla</p>
-                </div>
-            ` : `
-                <div style="background: rgba(255,0,0,0.2); padding: 15px; border-radius: 10px; margin: 20px 0;">
-                    <p style="color: #f55; font-weight: 600;">🔒 Esta playlist es privada</p>
-                    <p style="font-size: 14px; color: #aaa;">Solo tú puedes verla</p>
-                </div>
-            `;
-            
-            const modalHTML = `
-                <div class="modal active" id="playlistContentModal">
-                    <div class="modal-content" style="max-width: 900px;">
-                        <div class="modal-header">
-                            <div>
-                                <h2>${playlist.name}</h2>
-                                <p style="color: #aaa;">${playlist.description || 'Sin descripción'}</p>
-                            </div>
-                            <button class="close-modal" onclick="closePlaylistModal()">×</button>
-                        </div>
-                        ${shareHTML}
-                        
-                        <!-- Botón para subir archivos -->
-                        <div style="margin-bottom: 20px;">
-                            <input type="file" id="fileUpload-${playlist.id}" accept="audio/*,video/*,image/*" style="display:none;" onchange="uploadFile(${playlist.id})">
-                            <button class="submit-btn" onclick="document.getElementById('fileUpload-${playlist.id}').click()">
-                                📤 Subir Archivo desde Mi Dispositivo
-                            </button>
-                        </div>
-                        
-                        <div class="preview-grid" style="max-height: 400px; overflow-y: auto;">
-                            ${itemsHTML}
-                        </div>
-                        <div style="margin-top: 20px;">
-                            <button class="submit-btn" onclick="downloadAllPlaylist(${playlist.id})">📥 Descargar Todas</button>
-                            <button class="logout-btn" style="width:100%; margin-top:10px;" onclick="deletePlaylist(${playlist.id})">🗑️ Eliminar Playlist</button>
-                        </div>
+                    <div class="form-group">
+                        <label>Verificar Contraseña</label>
+                        <input type="password" class="form-input" name="confirm_password" required minlength="8">
                     </div>
-                </div>
-            `;
-            
-            document.body.insertAdjacentHTML('beforeend', modalHTML);
-        }
-        
-        async function renameItem(itemId, newTitle) {
-            if (!newTitle || newTitle.trim() === '') {
-                showError('El título no puede estar vacío');
-                return;
-            }
-            
-            try {
-                const response = await fetch('/rename_item', {
-                    method: 'POST',
-                    headers: {'Content-Type': 'application/json'},
-                    body: JSON.stringify({ 
-                        item_id: itemId, 
-                        new_title: newTitle.trim() 
-                    })
-                });
-                
-                const data = await response.json();
-                
-                if (data.success) {
-                    showSuccess('✏️ Título actualizado');
-                } else {
-                    showError(data.error);
-                }
-            } catch (error) {
-                showError('Error al renombrar');
-            }
-        }
-        
-        async function uploadFile(playlistId) {
-            const fileInput = document.getElementById(`fileUpload-${playlistId}`);
-            const file = fileInput.files[0];
-            
-            if (!file) return;
-            
-            const formData = new FormData();
-            formData.append('file', file);
-            formData.append('playlist_id', playlistId);
-            
-            try {
-                showSuccess('📤 Subiendo archivo...');
-                
-                const response = await fetch('/upload_to_playlist', {
-                    method: 'POST',
-                    body: formData
-                });
-                
-                const data = await response.json();
-                
-                if (data.success) {
-                    showSuccess('✅ Archivo subido exitosamente');
-                    closePlaylistModal();
-                    setTimeout(() => loadPlaylistContent(playlistId), 500);
-                } else {
-                    showError(data.error);
-                }
-            } catch (error) {
-                showError('Error al subir archivo');
-            }
-        }
-        
-        function closePlaylistModal() {
-            const modal = document.getElementById('playlistContentModal');
-            if (modal) modal.remove();
-        }
-        
-        function copyCode(code) {
-            navigator.clipboard.writeText(code);
-            showSuccess('¡Código copiado al portapapeles!');
-        }
+                    <button type="submit" class="submit-btn">Crear Cuenta</button>
+                </form>
+            </div>
+        </div>
         
-        async function removeFromPlaylist(playlistId, itemId) {
-            if (!confirm('¿Eliminar este elemento?')) return;
+        <!-- MAIN APP SECTION -->
+        <div class="main-content" id="mainContent">
+            <div class="header">
+                <h1>MediaDownloaderPRO v2.0</h1>
+                <p>Descarga y gestiona tu contenido multimedia</p>
+            </div>
             
-            try {
-                const response = await fetch('/remove_from_playlist', {
-                    method: 'POST',
-                    headers: {'Content-Type': 'application/json'},
-                    body: JSON.stringify({ item_id: itemId })
-                });
-                
-                const data = await response.json();
-                
-                if (data.success) {
-                    showSuccess('Elemento eliminado');
-                    closePlaylistModal();
-                    loadPlaylistContent(playlistId);
-                } else {
-                    showError(data.error);
-                }
-            } catch (error) {
-                showError('Error al eliminar');
-            }
-        }
-        
-        async function deletePlaylist(playlistId) {
-            if (!confirm('¿Eliminar esta playlist completa?')) return;
+            <div class="nav-menu">
+                <button class="nav-btn active" onclick="switchSection('downloader')">📥 Descargar</button>
+                <button class="nav-btn" onclick="switchSection('playlists')">🎵 Indiana Playlist</button>
+                <button class="nav-btn" onclick="showAccessByCode()">🔑 Acceder con Código</button>
+            </div>
             
-            try {
-                const response = await fetch('/delete_playlist', {
-                    method: 'POST',
-                    headers: {'Content-Type': 'application/json'},
-                    body: JSON.stringify({ playlist_id: playlistId })
-                });
-                
-                const data = await response.json();
+            <!-- DOWNLOADER SECTION -->
+            <div class="section active" id="downloaderSection">
+                <div class="platform-selector">
+                    <button class="platform-btn active" data-platform="youtube">YouTube</button>
+                    <button class="platform-btn" data-platform="instagram">Instagram</button>
+                    <button class="platform-btn" data-platform="facebook">Facebook</button>
+                    <button class="platform-btn" data-platform="tiktok">TikTok</button>
+                </div>
                 
-                if (data.success) {
-                    showSuccess('Playlist eliminada');
-                    closePlaylistModal();
-                    loadPlaylists();
-                } else {
-                    showError(data.error);
-                }
-            } catch (error) {
-                showError('Error al eliminar playlist');
-            }
-        }
-        
-        function downloadAllPlaylist(playlistId) {
-            showSuccess('Iniciando descarga de todos los archivos...');
-            fetch(`/playlist/${playlistId}`)
-                .then(res => res.json())
-                .then(data => {
-                    if (data.success) {
-                        data.items.forEach((item, idx) => {
-                            setTimeout(() => {
-                                const a = document.createElement('a');
-                                a.href = item.url;
-                                a.download = `${item.title}.${item.media_type}`;
-                                a.click();
-                            }, idx * 1000);
-                        });
-                    }
-                });
-        }
-        
-        function showAccessByCode() {
-            const modalHTML = `
-                <div class="modal active" id="accessCodeModal">
-                    <div class="modal-content">
-                        <div class="modal-header">
-                            <h2>🔑 Acceder con Código</h2>
-                            <button class="close-modal" onclick="closeAccessCodeModal()">×</button>
-                        </div>
-                        <div class="form-group">
-                            <label>Introduce el Código de Acceso</label>
-                            <input type="text" class="form-input" id="accessCodeInput" placeholder="XXXXXXXX" style="text-transform: uppercase;">
+                <div class="input-section">
+                    <div class="input-group">
+                        <input type="text" class="url-input" id="urlInput" placeholder="Pega la URL aquí...">
+                        <div class="input-actions">
+                            <button class="icon-btn" onclick="pasteUrl()" title="Pegar">📋</button>
+                            <button class="icon-btn" onclick="clearUrl()" title="Borrar">🗑️</button>
                         </div>
-                        <button class="submit-btn" onclick="accessPlaylistByCode()">Acceder</button>
                     </div>
+                    
+                    <div class="format-selector">
+                        <button class="format-btn active" data-format="mp4">MP4</button>
+                        <button class="format-btn" data-format="mp3">MP3</button>
+                        <button class="format-btn" data-format="photo" id="photoBtn" style="display:none;">Fotos</button>
+                    </div>
+                    
+                    <label class="server-download">
+                        <input type="checkbox" id="serverDownload"> Descargar en el servidor (MP3 convertido con ffmpeg)
+                    </label>
+                    
+                    <button class="download-btn" onclick="processMedia()">Procesar Media</button>
+                    <button class="add-to-playlist-btn" onclick="showAddToPlaylist()">Añadir a Playlist</button>
                 </div>
-            `;
-            
-            document.body.insertAdjacentHTML('beforeend', modalHTML);
-        }
-        
-        function closeAccessCodeModal() {
-            const modal = document.getElementById('accessCodeModal');
-            if (modal) modal.remove();
-        }
-        
-        async function accessPlaylistByCode() {
-            const code = document.getElementById('accessCodeInput').value.toUpperCase();
-            
-            if (!code) {
-                showError('Introduce un código');
-                return;
-            }
-            
-            try {
-                const response = await fetch('/access_playlist', {
-                    method: 'POST',
-                    headers: {'Content-Type': 'application/json'},
-                    body: JSON.stringify({ access_code: code })
-                });
-                
-                const data = await response.json();
                 
-                if (data.success) {
-                    closeAccessCodeModal();
-                    showPlaylistModal(data.playlist, data.items);
-                } else {
-                    showError(data.error);
-                }
-            } catch (error) {
-                showError('Error al acceder');
-            }
-        }
-        
-        async function checkSession() {
-            try {
-                const response = await fetch('/check_session');
-                const data = await response.json();
+                <div class="loading" id="loading">
+                    <div class="spinner"></div>
+                    <p style="margin-top: 15px;" id="loadingMessage">Procesando...</p>
+                </div>
                 
-                console.log('Estado de sesión:', data);
+                <div class="preview-section" id="previewSection">
+                    <h2>Vista Previa</h2>
+                    <div class="preview-grid" id="previewGrid"></div>
+                </div>
+            </div>
+            
+            <!-- PLAYLISTS SECTION -->
+            <div class="section" id="playlistsSection">
+                <div class="playlist-header">
+                    <h2>🎵 Indiana Playlist - Almacenamiento Ilimitado</h2>
+                    <button class="create-playlist-btn" onclick="showCreatePlaylist()">+ Nueva Playlist</button>
+                </div>
                 
-                if (data.logged_in) {
-                    document.getElementById('authSection').style.display = 'none';
-                    document.getElementById('mainContent').classList.add('active');
-                    document.getElementById('userInfo').classList.add('active');
-                    document.getElementById('userDisplay').textContent = data.arobase;
-                    return true;
-                } else {
-                    document.getElementById('authSection').style.display = 'block';
-                    document.getElementById('mainContent').classList.remove('active');
-                    return false;
-                }
-            } catch (error) {
-                console.error('Error al verificar sesión:', error);
-                return false;
-            }
-        }
+                <div class="playlists-grid" id="playlistsGrid">
+                    <!-- Playlists will be loaded here -->
+                </div>
+            </div>
+        </div>
         
-        window.addEventListener('DOMContentLoaded', async () => {
-            console.log('Página cargada, verificando sesión...');
-            const isLoggedIn = await checkSession();
-            if (isLoggedIn) {
-                console.log('Usuario con sesión activa');
-            } else {
-                console.log('No hay sesión activa');
-            }
-        });
-    </script>
+        <!-- CREATE PLAYLIST MODAL -->
+        <div class="modal" id="createPlaylistModal">
+            <div class="modal-content">
+                <div class="modal-header">
+                    <h2>Crear Nueva Playlist</h2>
+                    <button class="close-modal" onclick="closeModal('createPlaylistModal')">×</button>
+                </div>
+                <div id="playlistErrorMsg" class="error-msg"></div>
+                <form onsubmit="return createPlaylist(event)">
+                    <div class="form-group">
+                        <label>Nombre de la Playlist *</label>
+                        <input type="text" class="form-input" name="name" required placeholder="Mi Playlist">
+                    </div>
+                    <div class="form-group">
+                        <label>Descripción (opcional)</label>
+                        <input type="text" class="form-input" name="description" placeholder="Describe tu playlist...">
+                    </div>
+                    <div class="form-group">
+                        <label>Visibilidad</label>
+                        <select class="form-input" name="visibility" onchange="toggleCodeField(this)">
+                            <option value="private">🔒 Privada - Solo yo</option>
+                            <option value="public">🌍 Pública - Todos</option>
+                            <option value="code">🔑 Con Código - Acceso restringido</option>
+                        </select>
+                    </div>
+                    <div class="form-group" id="codeField" style="display:none;">
+                        <label>Código de Acceso</label>
+                        <input type="text" class="form-input" id="generatedCode" readonly style="background: rgba(0,242,255,0.1); border-color: #00f2ff; font-weight: 700; letter-spacing: 2px;">
+                        <p style="font-size: 12px; color: #aaa; margin-top: 5px;">Este código se generará automáticamente</p>
+                    </div>
+                    <button type="submit" class="submit-btn">✨ Crear Playlist</button>
+                </form>
+            </div>
+        </div>
+    </div>
+    
+    <script src="{{ asset_url('app.js') }}"></script>
 </body>
 </html>
 '''
 
+# ==================== RECURSOS ESTÁTICOS ====================
+class StaticAsset:
+    """Recurso servido desde memoria con variantes comprimidas precalculadas"""
+
+    def __init__(self, body, mimetype):
+        self.mimetype = mimetype
+        self.digest = hashlib.sha256(body).hexdigest()[:16]
+        self.variants = {'identity': body, 'gzip': gzip.compress(body, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            self.variants['br'] = brotli.compress(body, quality=11)
+
+    def encoding_for(self, accept_encodings):
+        # Se prefiere la variante más pequeña que acepte el cliente
+        accepted = [e for e in self.variants if e == 'identity' or accept_encodings[e]]
+        return min(accepted, key=lambda e: len(self.variants[e]))
+
+    def response(self, max_age, immutable=False):
+        encoding = self.encoding_for(request.accept_encodings)
+        etag = f'{self.digest}-{encoding}'
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+        else:
+            response = Response(self.variants[encoding], mimetype=self.mimetype)
+            if encoding != 'identity':
+                response.headers['Content-Encoding'] = encoding
+        response.set_etag(etag)
+        response.vary.add('Accept-Encoding')
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+        if immutable:
+            response.cache_control.immutable = True
+        else:
+            response.cache_control.no_cache = True
+        return response
+
+
+STATIC_ASSETS = {}
+
+
+def build_assets():
+    """Huella de cada recurso, sus variantes comprimidas y la página principal, una sola vez al arrancar"""
+    urls = {}
+    for filename in ('app.css', 'app.js'):
+        with open(os.path.join(app.static_folder, filename), 'rb') as f:
+            body = f.read()
+        asset = StaticAsset(body, mimetypes.guess_type(filename)[0])
+        stem, ext = os.path.splitext(filename)
+        fingerprinted = f'{stem}.{asset.digest}{ext}'
+        STATIC_ASSETS[fingerprinted] = asset
+        urls[filename] = f'/assets/{fingerprinted}'
+
+    with app.app_context():
+        html = render_template_string(HTML_TEMPLATE, asset_url=urls.__getitem__)
+    return StaticAsset(html.encode('utf-8'), 'text/html')
+
+
+INDEX_PAGE = build_assets()
+
+@app.route('/assets/<name>')
+def static_asset(name):
+    """CSS/JS con huella en el nombre: se pueden cachear indefinidamente"""
+    asset = STATIC_ASSETS.get(name)
+    if asset is None:
+        return jsonify({'success': False, 'error': 'Recurso no encontrado'}), 404
+    return asset.response(365 * 24 * 3600, immutable=True)
+
 @app.route('/')
 def index():
-    return render_template_string(HTML_TEMPLATE)
+    # La página se revalida siempre (ETag) para recoger nuevas huellas tras un despliegue
+    return INDEX_PAGE.response(0)
 
 @app.route('/register', methods=['POST'])
 def register():
@@ -1681,22 +3226,27 @@ def register():
     if not arobase.startswith('@'):
         return jsonify({'success': False, 'error': 'El nombre de arroba debe comenzar con @'})
     
+    limited = rate_limited((ip_limiter, request.remote_addr))
+    if limited:
+        return limited
+    
     try:
-        conn = sqlite3.connect(DATABASE)
+        conn = get_db()
         c = conn.cursor()
         
         c.execute('SELECT id FROM users WHERE username = ? OR arobase = ?', (username, arobase))
         if c.fetchone():
             return jsonify({'success': False, 'error': 'Usuario o arroba ya existe'})
         
-        hashed_password = generate_password_hash(password, method='pbkdf2:sha256')
+        hashed_password = password_hasher.hash(password)
         
         c.execute('INSERT INTO users (username, arobase, password) VALUES (?, ?, ?)',
                   (username, arobase, hashed_password))
         conn.commit()
-        conn.close()
         
         return jsonify({'success': True})
+    except HasherBusyError:
+        return hasher_busy()
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
@@ -1709,20 +3259,32 @@ def login():
     if not username.startswith('@'):
         username = '@' + username
     
+    # Se rechaza antes de tocar la base de datos o gastar CPU en el hash
+    limited = rate_limited((ip_limiter, request.remote_addr), (arobase_limiter, username.lower()))
+    if limited:
+        return limited
+    
     try:
-        conn = sqlite3.connect(DATABASE)
+        conn = get_db()
         c = conn.cursor()
         
         c.execute('SELECT id, arobase, password FROM users WHERE arobase = ?', (username,))
         user = c.fetchone()
-        conn.close()
         
-        if user and check_password_hash(user[2], password):
+        valid = password_hasher.verify(user[2] if user else None, password)
+        if user and valid:
+            if password_hasher.needs_rehash(user[2]):
+                try:
+                    password_hasher.submit(rehash_password, user[0], user[2], password)
+                except HasherBusyError:
+                    pass  # se reintentará en el próximo login
             session['user_id'] = user[0]
             session['arobase'] = user[1]
             return jsonify({'success': True, 'arobase': user[1]})
         else:
             return jsonify({'success': False, 'error': 'Credenciales incorrectas'})
+    except HasherBusyError:
+        return hasher_busy()
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
@@ -1752,6 +3314,10 @@ def process_media():
     format_type = data.get('format')
     
     try:
+        if data.get('download') and format_type in ('mp4', 'mp3'):
+            return enqueue_download_job(url, platform, format_type)
+        if data.get('async'):
+            return enqueue_media_job(url, platform, format_type)
         if platform == 'tiktok':
             return process_tiktok(url, format_type)
         else:
@@ -1759,20 +3325,93 @@ def process_media():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+def enqueue_media_job(url, platform, format_type):
+    """Encola la extracción y devuelve el id del trabajo sin esperar"""
+    key = cache_key(url, platform, format_type)
+    cached = metadata_cache.get(key)
+    if cached is not None:
+        return jsonify({'success': True, 'status': 'done', 'result': cached})
+    
+    job_id, error = job_queue.submit(session['user_id'], key, extraction_job, url, platform, format_type)
+    if error:
+        return jsonify({'success': False, 'error': error}), 429
+    return job_accepted(job_id)
+
+def enqueue_download_job(url, platform, format_type):
+    """Encola la descarga real (y la conversión a mp3); el archivo se sirve después desde /downloads"""
+    result = finished_download(url, format_type)
+    if result is not None:
+        return jsonify({'success': True, 'status': 'done', 'result': result})
+    
+    # Las peticiones de la misma URL y formato comparten trabajo mientras está en curso
+    key = f'download|{format_type}|{normalize_url(url)}'
+    job_id, error = download_queue.submit(session['user_id'], key, download_job, url, platform, format_type)
+    if error:
+        return jsonify({'success': False, 'error': error}), 429
+    return job_accepted(job_id)
+
+def job_accepted(job_id):
+    return jsonify({
+        'success': True,
+        'job_id': job_id,
+        'status': 'queued',
+        'status_url': url_for('get_job', job_id=job_id),
+        'stream_url': url_for('stream_job', job_id=job_id)
+    }), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+@login_required
+def get_job(job_id):
+    job = job_queue.get(job_id, session['user_id'])
+    if not job:
+        return jsonify({'success': False, 'error': 'Trabajo no encontrado'}), 404
+    return jsonify({'success': True, 'job': job_payload(job)})
+
+@app.route('/jobs/<job_id>/stream', methods=['GET'])
+@login_required
+def stream_job(job_id):
+    """Progreso del trabajo como Server-Sent Events"""
+    user_id = session['user_id']
+    if not job_queue.get(job_id, user_id):
+        return jsonify({'success': False, 'error': 'Trabajo no encontrado'}), 404
+    
+    def events():
+        last_update = None
+        deadline = time.time() + JOB_STREAM_TIMEOUT
+        while time.time() < deadline:
+            job = job_queue.get(job_id, user_id)
+            if job is None:
+                break
+            if job['updated_at'] != last_update:
+                last_update = job['updated_at']
+                yield f"data: {json.dumps(job_payload(job))}\n\n"
+            if job['status'] not in JOB_ACTIVE_STATUSES:
+                break
+            time.sleep(0.5)
+    
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 def process_tiktok(url, format_type):
+    return jsonify(get_media_info(url, 'tiktok', format_type))
+
+def process_ytdlp(url, platform, format_type):
+    return jsonify(get_media_info(url, platform, format_type))
+
+def extract_tiktok(url, format_type):
     try:
-        api_url = 'https://www.tikwm.com/api/'
-        response = requests.post(api_url, data={'url': url, 'hd': 1})
+        response = http_client.post(TIKWM_API_URL, data={'url': url, 'hd': 1})
         result = response.json()
         
         if result.get('code') != 0:
-            return jsonify({'success': False, 'error': 'Error al obtener datos de TikTok'})
+            return {'success': False, 'error': 'Error al obtener datos de TikTok'}
         
         data = result.get('data', {})
         
         response_data = {
             'success': True,
             'platform': 'tiktok',
+            'source_url': url,
             'title': data.get('title', 'TikTok Video'),
             'duration': f"{data.get('duration', 0)}s",
             'duration_seconds': data.get('duration', 0),
@@ -1788,12 +3427,12 @@ def process_tiktok(url, format_type):
             'thumbnail': data.get('cover', '')
         }
         
-        return jsonify(response_data)
+        return response_data
         
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)})
+        return {'success': False, 'error': str(e)}
 
-def process_ytdlp(url, platform, format_type):
+def extract_ytdlp(url, platform, format_type):
     try:
         ydl_opts = {
             'quiet': True,
@@ -1827,6 +3466,7 @@ def process_ytdlp(url, platform, format_type):
             response_data = {
                 'success': True,
                 'platform': platform,
+                'source_url': info.get('webpage_url') or url,
                 'title': info.get('title', 'Sin título'),
                 'thumbnail': info.get('thumbnail'),
                 'duration': duration_formatted,
@@ -1841,10 +3481,10 @@ def process_ytdlp(url, platform, format_type):
                 'description': info.get('description', '')[:200] if info.get('description') else 'Sin descripción'
             }
             
-            return jsonify(response_data)
+            return response_data
             
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)})
+        return {'success': False, 'error': str(e)}
 
 @app.route('/create_playlist', methods=['POST'])
 @login_required
@@ -1861,7 +3501,7 @@ def create_playlist():
         return jsonify({'success': False, 'error': 'El nombre es requerido'})
     
     try:
-        conn = sqlite3.connect(DATABASE)
+        conn = get_db()
         c = conn.cursor()
         
         c.execute('''INSERT INTO playlists (user_id, name, description, visibility, access_code)
@@ -1870,11 +3510,10 @@ def create_playlist():
         
         conn.commit()
         playlist_id = c.lastrowid
-        conn.close()
         
         return jsonify({'success': True, 'playlist_id': playlist_id, 'message': 'Playlist creada exitosamente'})
     except sqlite3.IntegrityError:
-        return jsonify({'success': False, 'error': 'Error al crear la playlist'})
+        return jsonify({'success': False, 'error': 'Error al crear la playlist: el código de acceso ya está en uso'})
     except Exception as e:
         return jsonify({'success': False, 'error': f'Error: {str(e)}'})
 
@@ -1884,24 +3523,61 @@ def get_playlists():
     user_id = session['user_id']
     
     try:
-        conn = sqlite3.connect(DATABASE)
-        conn.row_factory = sqlite3.Row
+        conn = get_db()
         c = conn.cursor()
         
-        c.execute('''SELECT p.*, COUNT(pi.id) as item_count 
-                     FROM playlists p 
-                     LEFT JOIN playlist_items pi ON p.id = pi.playlist_id 
-                     WHERE p.user_id = ? 
-                     GROUP BY p.id 
-                     ORDER BY p.created_at DESC''', (user_id,))
+        # item_count y los totales los mantienen los triggers de playlist_items
+        c.execute('SELECT * FROM playlists WHERE user_id = ? ORDER BY created_at DESC', (user_id,))
         
         playlists = [dict(row) for row in c.fetchall()]
-        conn.close()
         
         return jsonify({'success': True, 'playlists': playlists})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+ITEM_INSERT = '''INSERT INTO playlist_items (playlist_id, title, url, media_type, thumbnail, duration, duration_seconds,
+                                            source_url, platform, url_expires_at)
+                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'''
+
+
+def media_link(media):
+    """Enlace al archivo de un medio procesado (vídeo, o audio si no hay vídeo)"""
+    return media.get('download_url') or media.get('video') or media.get('audio', '')
+
+
+def media_item_row(playlist_id, media):
+    """Fila de playlist_items (en el orden de ITEM_INSERT) a partir de un medio procesado"""
+    url = media_link(media)
+    media_type = (media.get('format') or 'mp4').lower()
+    duration_seconds = duration_to_seconds(media.get('duration_seconds') or media.get('duration'))
+    return (playlist_id, media.get('title') or 'Sin título', url, media_type, media.get('thumbnail'),
+            media.get('duration'), duration_seconds, media.get('source_url'), media.get('platform'),
+            signed_url_expiry(url))
+
+
+MEDIA_TEXT_FIELDS = ('title', 'download_url', 'video', 'audio', 'format', 'thumbnail', 'duration',
+                     'source_url', 'platform')
+
+
+def media_item_error(media):
+    """Motivo por el que un medio no se puede guardar, o None si media_item_row lo acepta"""
+    if not isinstance(media, dict):
+        return 'El medio debe ser un objeto'
+    for field in MEDIA_TEXT_FIELDS:
+        if media.get(field) is not None and not isinstance(media[field], str):
+            return f'{field} debe ser texto'
+    seconds = media.get('duration_seconds')
+    if seconds is not None and (isinstance(seconds, bool) or not isinstance(seconds, (int, float))
+                                or not 0 <= seconds < 2 ** 31):
+        return 'duration_seconds debe ser un número de segundos'
+    seconds = duration_to_seconds(media.get('duration'))
+    if seconds is not None and not 0 <= seconds < 2 ** 31:
+        return 'Duración fuera de rango'
+    if not media_link(media):
+        return 'Medio sin URL'
+    return None
+
+
 @app.route('/add_to_playlist', methods=['POST'])
 @login_required
 def add_to_playlist():
@@ -1910,7 +3586,7 @@ def add_to_playlist():
     media = data.get('media')
     
     try:
-        conn = sqlite3.connect(DATABASE)
+        conn = get_db()
         c = conn.cursor()
         
         c.execute('SELECT user_id FROM playlists WHERE id = ?', (playlist_id,))
@@ -1919,25 +3595,95 @@ def add_to_playlist():
         if not playlist or playlist[0] != session['user_id']:
             return jsonify({'success': False, 'error': 'Playlist no encontrada'})
         
-        # Determinar la URL y tipo de medio correcto
-        media_url = media.get('download_url') or media.get('video') or media.get('audio', '')
-        media_type = media.get('format', 'mp4').lower()
-        
-        c.execute('''INSERT INTO playlist_items (playlist_id, title, url, media_type, thumbnail, duration)
-                     VALUES (?, ?, ?, ?, ?, ?)''',
-                  (playlist_id, media.get('title', 'Sin título'), 
-                   media_url,
-                   media_type,
-                   media.get('thumbnail'),
-                   media.get('duration')))
+        c.execute(ITEM_INSERT, media_item_row(playlist_id, media))
         
         conn.commit()
-        conn.close()
         
         return jsonify({'success': True})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+def expand_source_playlist(url, limit):
+    """Entradas de una playlist remota (YouTube, etc.) sin resolver cada vídeo (extract_flat)"""
+    ydl_opts = {
+        'quiet': True,
+        'no_warnings': True,
+        'extract_flat': 'in_playlist',
+        'skip_download': True,
+        'playlistend': limit,
+    }
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(url, download=False)
+    
+    entries = []
+    for entry in info.get('entries') or []:
+        if not entry:
+            continue
+        duration_seconds = int(entry['duration']) if entry.get('duration') else None
+        thumbnails = entry.get('thumbnails') or []
+        entries.append({
+            'title': entry.get('title'),
+            # Con extract_flat la URL es la de la página del vídeo, no la del archivo
+            'download_url': entry.get('url') or entry.get('webpage_url'),
+            # /media la resuelve la primera vez que se reproduce
+            'source_url': entry.get('url') or entry.get('webpage_url'),
+            'platform': (entry.get('ie_key') or '').lower() or None,
+            'format': 'mp4',
+            'thumbnail': thumbnails[-1].get('url') if thumbnails else entry.get('thumbnail'),
+            'duration': f"{duration_seconds // 60}:{duration_seconds % 60:02d}" if duration_seconds else None,
+            'duration_seconds': duration_seconds,
+        })
+    return info.get('title'), entries
+
+@app.route('/playlist/<int:playlist_id>/items:batch', methods=['POST'])
+@login_required
+def add_items_batch(playlist_id):
+    """Añade varios medios (o una playlist remota entera) en una sola transacción"""
+    data = request.json or {}
+    items = data.get('items') or []
+    source_url = data.get('source_url')
+    
+    if not isinstance(items, list):
+        return jsonify({'success': False, 'error': 'items debe ser una lista'}), 400
+    
+    # Antes de leer la playlist remota, que ya solo puede aportar lo que quede hasta el máximo
+    if len(items) > BATCH_MAX_ITEMS or (source_url and len(items) >= BATCH_MAX_ITEMS):
+        return jsonify({'success': False, 'error': f'Máximo {BATCH_MAX_ITEMS} elementos por lote'}), 400
+    
+    try:
+        conn = get_db()
+        playlist = conn.execute('SELECT user_id FROM playlists WHERE id = ?', (playlist_id,)).fetchone()
+        if not playlist or playlist[0] != session['user_id']:
+            return jsonify({'success': False, 'error': 'Playlist no encontrada'}), 404
+        
+        source_title = None
+        if source_url:
+            if not isinstance(source_url, str):
+                return jsonify({'success': False, 'error': 'source_url debe ser texto'}), 400
+            # Leer la playlist remota es red: la conexión vuelve al pool mientras tanto
+            release_db(None)
+            source_title, entries = expand_source_playlist(source_url, BATCH_MAX_ITEMS - len(items))
+            items = items + entries
+        
+        rows, skipped = [], []
+        for index, media in enumerate(items):
+            error = media_item_error(media)
+            if error:
+                skipped.append({'index': index, 'error': error})
+                continue
+            rows.append(media_item_row(playlist_id, media))
+        
+        conn = get_db()
+        # Una sola transacción (y un solo fsync) para todo el lote
+        conn.executemany(ITEM_INSERT, rows)
+        conn.commit()
+        
+        return jsonify({'success': True, 'added': len(rows), 'skipped': skipped, 'source_title': source_title})
+    except yt_dlp.utils.DownloadError as e:
+        return jsonify({'success': False, 'error': f'No se pudo leer la playlist de origen: {e}'}), 422
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
 @app.route('/upload_to_playlist', methods=['POST'])
 @login_required
 def upload_to_playlist():
@@ -1953,7 +3699,7 @@ def upload_to_playlist():
             return jsonify({'success': False, 'error': 'No se seleccionó archivo'})
         
         # Verificar que la playlist pertenece al usuario
-        conn = sqlite3.connect(DATABASE)
+        conn = get_db()
         c = conn.cursor()
         
         c.execute('SELECT user_id FROM playlists WHERE id = ?', (playlist_id,))
@@ -1962,32 +3708,210 @@ def upload_to_playlist():
         if not playlist or playlist[0] != session['user_id']:
             return jsonify({'success': False, 'error': 'Playlist no encontrada'})
         
-        # Guardar archivo
-        filename = file.filename
-        filepath = os.path.join(DOWNLOAD_FOLDER, filename)
-        file.save(filepath)
+        if user_storage_used(conn, session['user_id']) + (request.content_length or 0) > USER_STORAGE_QUOTA:
+            return jsonify({'success': False, 'error': 'Has superado tu espacio de almacenamiento'}), 413
+        
+        # Guardar archivo en el almacén de blobs (el hash se calcula mientras se copia)
+        tmp_path = temp_upload_path()
+        digest, size = hash_stream_to_file(file.stream, tmp_path)
+        relpath = store_blob(conn, tmp_path, digest, size, blob_extension(file.filename))
         
         # Determinar tipo de medio
-        ext = filename.rsplit('.', 1)[1].lower() if '.' in filename else 'unknown'
-        media_type = 'mp3' if ext in ['mp3', 'wav', 'ogg'] else 'mp4' if ext in ['mp4', 'avi', 'mov'] else ext
+        media_type = media_type_for(file.filename)
         
         # Añadir a playlist
-        c.execute('''INSERT INTO playlist_items (playlist_id, title, url, media_type, thumbnail, duration)
-                     VALUES (?, ?, ?, ?, ?, ?)''',
-                  (playlist_id, filename.rsplit('.', 1)[0], 
-                   f'/downloads/{filename}',
+        c.execute('''INSERT INTO playlist_items (playlist_id, title, url, media_type, thumbnail, duration,
+                                                 size_bytes, blob_hash)
+                     VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+                  (playlist_id, file.filename.rsplit('.', 1)[0], 
+                   f'/downloads/{relpath}',
                    media_type,
                    None,
-                   'N/A'))
+                   'N/A',
+                   size,
+                   digest))
+        item_id = c.lastrowid
         
         conn.commit()
-        conn.close()
+        thumbnail_pool.prewarm(dict(conn.execute('SELECT * FROM playlist_items WHERE id = ?', (item_id,)).fetchone()))
         
         return jsonify({'success': True, 'message': 'Archivo subido exitosamente'})
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+def media_type_for(filename):
+    ext = filename.rsplit('.', 1)[1].lower() if '.' in filename else 'unknown'
+    return 'mp3' if ext in ['mp3', 'wav', 'ogg'] else 'mp4' if ext in ['mp4', 'avi', 'mov'] else ext
+
+def user_storage_used(conn, user_id):
+    """Bytes subidos por el usuario, incluidas las subidas en curso"""
+    stored = conn.execute('SELECT IFNULL(SUM(total_bytes), 0) FROM playlists WHERE user_id = ?',
+                          (user_id,)).fetchone()[0]
+    pending = conn.execute('SELECT IFNULL(SUM(size), 0) FROM uploads WHERE user_id = ?',
+                           (user_id,)).fetchone()[0]
+    return stored + pending
+
+def cleanup_stale_uploads(conn):
+    """Borra las subidas abandonadas (y su archivo parcial)"""
+    stale = conn.execute('SELECT id, path FROM uploads WHERE updated_at < ?',
+                         (time.time() - UPLOAD_EXPIRY,)).fetchall()
+    for upload in stale:
+        if os.path.exists(upload['path']):
+            os.remove(upload['path'])
+    conn.executemany('DELETE FROM uploads WHERE id = ?', [(u['id'],) for u in stale])
+    conn.commit()
+
+def get_user_upload(conn, upload_id):
+    return conn.execute('SELECT * FROM uploads WHERE id = ? AND user_id = ?',
+                        (upload_id, session['user_id'])).fetchone()
+
+@app.route('/uploads', methods=['POST'])
+@login_required
+def create_upload():
+    """Inicia una subida por partes: devuelve el id y el tamaño de parte"""
+    data = request.json
+    playlist_id = data.get('playlist_id')
+    filename = os.path.basename(data.get('filename') or '')
+    user_id = session['user_id']
+    
+    try:
+        size = int(data.get('size'))
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'Tamaño de archivo inválido'}), 400
+    
+    if not filename:
+        return jsonify({'success': False, 'error': 'No se seleccionó archivo'})
+    if size <= 0 or size > MAX_UPLOAD_SIZE:
+        return jsonify({'success': False, 'error': 'El archivo supera el tamaño máximo permitido'}), 413
+    
+    try:
+        conn = get_db()
+        c = conn.cursor()
+        
+        c.execute('SELECT user_id FROM playlists WHERE id = ?', (playlist_id,))
+        playlist = c.fetchone()
+        
+        if not playlist or playlist[0] != user_id:
+            return jsonify({'success': False, 'error': 'Playlist no encontrada'})
+        
+        cleanup_stale_uploads(conn)
+        if user_storage_used(conn, user_id) + size > USER_STORAGE_QUOTA:
+            return jsonify({'success': False, 'error': 'Has superado tu espacio de almacenamiento'}), 413
+        
+        # Las partes se escriben en un archivo del mismo sistema de ficheros que el almacén:
+        # al finalizar basta un rename para llevarlo a su blob
+        upload_id = secrets.token_urlsafe(16)
+        path = temp_upload_path()
+        open(path, 'wb').close()
+        
+        now = time.time()
+        c.execute('''INSERT INTO uploads (id, user_id, playlist_id, filename, path, size, received, created_at, updated_at)
+                     VALUES (?, ?, ?, ?, ?, ?, 0, ?, ?)''',
+                  (upload_id, user_id, playlist_id, filename, path, size, now, now))
+        conn.commit()
+        
+        return jsonify({'success': True, 'upload_id': upload_id, 'received': 0, 'size': size,
+                        'chunk_size': UPLOAD_CHUNK_SIZE})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/uploads/<upload_id>', methods=['GET'])
+@login_required
+def get_upload(upload_id):
+    """Estado de una subida, para reanudarla desde el último byte recibido"""
+    upload = get_user_upload(get_db(), upload_id)
+    if not upload:
+        return jsonify({'success': False, 'error': 'Subida no encontrada'}), 404
+    return jsonify({'success': True, 'upload_id': upload_id, 'received': upload['received'],
+                    'size': upload['size'], 'chunk_size': UPLOAD_CHUNK_SIZE})
+
+@app.route('/uploads/<upload_id>', methods=['PUT'])
+@login_required
+def put_upload_chunk(upload_id):
+    """Recibe una parte en ?offset=N; solo se acepta la continuación exacta de lo ya recibido"""
+    conn = get_db()
+    upload = get_user_upload(conn, upload_id)
+    if not upload:
+        return jsonify({'success': False, 'error': 'Subida no encontrada'}), 404
+    
+    offset = request.args.get('offset', type=int)
+    if offset != upload['received']:
+        return jsonify({'success': False, 'error': 'Offset incorrecto', 'received': upload['received']}), 409
+    
+    length = request.content_length
+    if length is None or length > UPLOAD_CHUNK_SIZE or offset + length > upload['size']:
+        return jsonify({'success': False, 'error': 'Parte demasiado grande', 'received': offset}), 413
+    
+    written = 0
+    try:
+        # El cuerpo se copia por bloques del socket al archivo, sin pasar por el parser multipart
+        with open(upload['path'], 'r+b') as f:
+            f.seek(offset)
+            while written < length:
+                block = request.stream.read(min(64 * 1024, length - written))
+                if not block:
+                    break
+                f.write(block)
+                written += len(block)
+    finally:
+        # Si la conexión se corta se conserva lo escrito para reanudar desde ahí
+        conn.execute('UPDATE uploads SET received = ?, updated_at = ? WHERE id = ?',
+                     (offset + written, time.time(), upload_id))
+        conn.commit()
+    
+    return jsonify({'success': True, 'received': offset + written, 'size': upload['size']})
+
+@app.route('/uploads/<upload_id>/finalize', methods=['POST'])
+@login_required
+def finalize_upload(upload_id):
+    """Completa la subida y solo entonces crea el item de la playlist"""
+    try:
+        conn = get_db()
+        c = conn.cursor()
+        
+        upload = get_user_upload(conn, upload_id)
+        if not upload:
+            return jsonify({'success': False, 'error': 'Subida no encontrada'}), 404
+        if upload['received'] != upload['size'] or os.path.getsize(upload['path']) != upload['size']:
+            return jsonify({'success': False, 'error': 'La subida está incompleta',
+                            'received': upload['received']}), 409
+        
+        # Las partes pueden llegar a workers distintos, así que el hash se calcula al final
+        digest = hash_file(upload['path'])
+        relpath = store_blob(conn, upload['path'], digest, upload['size'], blob_extension(upload['filename']))
+        c.execute('''INSERT INTO playlist_items (playlist_id, title, url, media_type, thumbnail, duration,
+                                                 size_bytes, blob_hash)
+                     VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+                  (upload['playlist_id'], upload['filename'].rsplit('.', 1)[0],
+                   f'/downloads/{relpath}',
+                   media_type_for(upload['filename']),
+                   None,
+                   'N/A',
+                   upload['size'],
+                   digest))
+        item_id = c.lastrowid
+        c.execute('DELETE FROM uploads WHERE id = ?', (upload_id,))
+        conn.commit()
+        thumbnail_pool.prewarm(dict(conn.execute('SELECT * FROM playlist_items WHERE id = ?', (item_id,)).fetchone()))
+        
+        return jsonify({'success': True, 'item_id': item_id, 'message': 'Archivo subido exitosamente'})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/uploads/<upload_id>', methods=['DELETE'])
+@login_required
+def cancel_upload(upload_id):
+    conn = get_db()
+    upload = get_user_upload(conn, upload_id)
+    if not upload:
+        return jsonify({'success': False, 'error': 'Subida no encontrada'}), 404
+    if os.path.exists(upload['path']):
+        os.remove(upload['path'])
+    conn.execute('DELETE FROM uploads WHERE id = ?', (upload_id,))
+    conn.commit()
+    return jsonify({'success': True})
+
 @app.route('/rename_item', methods=['POST'])
 @login_required
 def rename_item():
@@ -1998,7 +3922,7 @@ def rename_item():
     user_id = session['user_id']
     
     try:
-        conn = sqlite3.connect(DATABASE)
+        conn = get_db()
         c = conn.cursor()
         
         # Verificar que el item pertenece a una playlist del usuario
@@ -2011,7 +3935,6 @@ def rename_item():
         
         c.execute('UPDATE playlist_items SET title = ? WHERE id = ?', (new_title, item_id))
         conn.commit()
-        conn.close()
         
         return jsonify({'success': True})
     except Exception as e:
@@ -2023,8 +3946,7 @@ def get_playlist_content(playlist_id):
     user_id = session['user_id']
     
     try:
-        conn = sqlite3.connect(DATABASE)
-        conn.row_factory = sqlite3.Row
+        conn = get_db()
         c = conn.cursor()
         
         c.execute('SELECT * FROM playlists WHERE id = ? AND user_id = ?', (playlist_id, user_id))
@@ -2033,16 +3955,18 @@ def get_playlist_content(playlist_id):
         if not playlist:
             return jsonify({'success': False, 'error': 'Playlist no encontrada'})
         
-        c.execute('SELECT * FROM playlist_items WHERE playlist_id = ? ORDER BY added_at DESC', (playlist_id,))
-        items = [dict(row) for row in c.fetchall()]
-        
-        conn.close()
+        items, next_cursor = fetch_items_page(conn, playlist_id, request.args.get('cursor'),
+                                              request.args.get('limit'))
+        items = live_links(items)
         
         return jsonify({
             'success': True,
             'playlist': dict(playlist),
-            'items': items
+            'items': items,
+            'next_cursor': next_cursor
         })
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Cursor inválido'}), 400
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
@@ -2054,7 +3978,7 @@ def remove_from_playlist():
     user_id = session['user_id']
     
     try:
-        conn = sqlite3.connect(DATABASE)
+        conn = get_db()
         c = conn.cursor()
         
         c.execute('''SELECT pi.id FROM playlist_items pi 
@@ -2066,7 +3990,7 @@ def remove_from_playlist():
         
         c.execute('DELETE FROM playlist_items WHERE id = ?', (item_id,))
         conn.commit()
-        conn.close()
+        gc_blobs(conn)
         
         return jsonify({'success': True})
     except Exception as e:
@@ -2080,7 +4004,7 @@ def delete_playlist():
     user_id = session['user_id']
     
     try:
-        conn = sqlite3.connect(DATABASE)
+        conn = get_db()
         c = conn.cursor()
         
         c.execute('SELECT id FROM playlists WHERE id = ? AND user_id = ?', (playlist_id, user_id))
@@ -2088,11 +4012,11 @@ def delete_playlist():
         if not c.fetchone():
             return jsonify({'success': False, 'error': 'Playlist no encontrada'})
         
-        c.execute('DELETE FROM playlist_items WHERE playlist_id = ?', (playlist_id,))
+        # Los items se borran en cascada (ON DELETE CASCADE)
         c.execute('DELETE FROM playlists WHERE id = ?', (playlist_id,))
         
         conn.commit()
-        conn.close()
+        gc_blobs(conn)
         
         return jsonify({'success': True})
     except Exception as e:
@@ -2105,8 +4029,7 @@ def access_playlist():
     access_code = data.get('access_code')
     
     try:
-        conn = sqlite3.connect(DATABASE)
-        conn.row_factory = sqlite3.Row
+        conn = get_db()
         c = conn.cursor()
         
         c.execute('SELECT * FROM playlists WHERE access_code = ? AND visibility = ?', 
@@ -2116,27 +4039,355 @@ def access_playlist():
         if not playlist:
             return jsonify({'success': False, 'error': 'Código inválido'})
         
-        c.execute('SELECT * FROM playlist_items WHERE playlist_id = ? ORDER BY added_at DESC', 
-                  (playlist['id'],))
-        items = [dict(row) for row in c.fetchall()]
-        
-        conn.close()
+        items, next_cursor = fetch_items_page(conn, playlist['id'], data.get('cursor'), data.get('limit'))
+        items = live_links(items, code=access_code)
         
         return jsonify({
             'success': True,
             'playlist': dict(playlist),
-            'items': items
+            'items': items,
+            'next_cursor': next_cursor
         })
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Cursor inválido'}), 400
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+@app.route('/playlist/<int:playlist_id>/archive', methods=['GET'])
+@login_required
+def playlist_archive(playlist_id):
+    """Todos los items de la playlist en un único zip (propietario o ?code= de acceso)"""
+    conn = get_db()
+    playlist = conn.execute('SELECT * FROM playlists WHERE id = ?', (playlist_id,)).fetchone()
+    code = request.args.get('code')
+    if not playlist or (playlist['user_id'] != session['user_id'] and
+                        not (code and playlist['visibility'] == 'code' and code == playlist['access_code'])):
+        return jsonify({'success': False, 'error': 'Playlist no encontrada'}), 404
+    
+    items = conn.execute('''SELECT id, title, url, media_type, added_at FROM playlist_items
+                            WHERE playlist_id = ? ORDER BY added_at DESC, id DESC''', (playlist_id,)).fetchall()
+    archive = PlaylistArchive(dict(playlist), [dict(item) for item in items])
+    filename = ARCHIVE_NAME_UNSAFE.sub('_', playlist['name']).strip(' .') or 'playlist'
+    headers = {'Content-Disposition': f"attachment; filename*=UTF-8''{quote(filename)}.zip"}
+    
+    if not archive.local:
+        # Con items remotos el tamaño no se conoce hasta terminar: sin Content-Length ni rangos
+        return Response(archive.stream(), mimetype='application/zip', headers=headers)
+    
+    pieces, total = archive.layout()
+    etag = archive.etag()
+    start, stop, status = 0, total, 200
+    if_range = request.if_range
+    # If-Range con fecha no puede validarse (no hay Last-Modified): se envía el zip completo
+    if request.range and (if_range.etag == etag or not (if_range.etag or if_range.date)):
+        byte_range = request.range.range_for_length(total)
+        if byte_range is None:
+            response = Response(status=416)
+            response.headers['Content-Range'] = f'bytes */{total}'
+            return response
+        start, stop = byte_range
+        status = 206
+    
+    response = Response(archive.stream_range(pieces, start, stop), status=status, mimetype='application/zip',
+                        headers=headers)
+    response.content_length = stop - start
+    if status == 206:
+        response.headers['Content-Range'] = f'bytes {start}-{stop - 1}/{total}'
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.set_etag(etag)
+    response.cache_control.private = True
+    return response
+
+def accessible_item(conn, item_id):
+    """Item de una playlist propia o de una compartida cuyo código llega en ?code=, o None"""
+    item = conn.execute('''SELECT i.*, p.user_id, p.visibility, p.access_code
+                           FROM playlist_items i JOIN playlists p ON p.id = i.playlist_id
+                           WHERE i.id = ?''', (item_id,)).fetchone()
+    code = request.args.get('code')
+    if not item or (item['user_id'] != session['user_id'] and
+                    not (code and item['visibility'] == 'code' and code == item['access_code'])):
+        return None
+    return item
+
+@app.route('/media/<int:item_id>', methods=['GET'])
+@login_required
+def media_proxy(item_id):
+    """Archivo de un item a través de la caché en disco, renovando el enlace si ha caducado"""
+    conn = get_db()
+    item = accessible_item(conn, item_id)
+    if not item:
+        return jsonify({'success': False, 'error': 'Item no encontrado'}), 404
+    
+    url = item['url'] or ''
+    if url.startswith('/downloads/'):
+        return redirect(url)
+    
+    # La página de origen no cambia al renovar el enlace firmado: la caché sobrevive a la renovación
+    key = f"{item['media_type']}|{item['source_url'] or url}"
+    cached = media_files.get(key)
+    if cached is not None:
+        MEDIA_PROXY_REQUESTS.labels('hit').inc()
+        path, content_type = cached
+        response = send_file(os.path.abspath(path), mimetype=content_type or 'application/octet-stream',
+                             conditional=True, etag=True, max_age=DOWNLOAD_MAX_AGE)
+        response.headers['Accept-Ranges'] = 'bytes'
+        response.cache_control.public = False
+        response.cache_control.private = True
+        return response
+    
+    # Lo que queda (extracción y descarga del origen) es red: la conexión vuelve al pool
+    release_db(None)
+    range_header = request.headers.get('Range')
+    try:
+        # Sin resolver (importado con extract_flat) o con la firma ya caducada: ni se intenta
+        if item['source_url'] and link_expired(item, time.time()):
+            url = resolve_item_url(item, dead_url=url)
+        upstream = open_media_upstream(url, range_header)
+        # 403/410: enlace firmado caducado. Se renueva aquí una vez en lugar de que el navegador reintente
+        if upstream is not None and upstream.status_code in (403, 410) and item['source_url']:
+            upstream.close()
+            url = resolve_item_url(item, dead_url=url)
+            upstream = open_media_upstream(url, range_header)
+    except (requests.RequestException, CircuitOpenError) as e:
+        MEDIA_PROXY_REQUESTS.labels('error').inc()
+        return jsonify({'success': False, 'error': str(e)}), 502
+    
+    if upstream is None or upstream.status_code not in (200, 206, 416):
+        MEDIA_PROXY_REQUESTS.labels('error').inc()
+        error = 'No se pudo obtener el enlace del medio'
+        if upstream is not None:
+            error = f'El origen respondió {upstream.status_code}'
+            upstream.close()
+        return jsonify({'success': False, 'error': error}), 502
+    if upstream.status_code == 416:
+        upstream.close()
+        response = Response(status=416)
+        if 'Content-Range' in upstream.headers:
+            response.headers['Content-Range'] = upstream.headers['Content-Range']
+        return response
+    
+    MEDIA_PROXY_REQUESTS.labels('miss').inc()
+    return media_stream_response(key, upstream)
+
+@app.route('/thumb/<int:item_id>', methods=['GET'])
+@login_required
+def item_thumbnail(item_id):
+    """Miniatura de un item: ancho fijo (?w=), AVIF/WebP según Accept y cacheada en disco"""
+    conn = get_db()
+    item = accessible_item(conn, item_id)
+    if not item:
+        return jsonify({'success': False, 'error': 'Item no encontrado'}), 404
+    
+    width = thumb_width(request.args.get('w'))
+    fmt = thumb_format(request.accept_mimetypes)
+    path = None
+    if fmt:
+        try:
+            path = thumbnail_pool.submit(dict(item), width, fmt).result(timeout=THUMB_TIMEOUT)
+        except Exception:
+            path = None
+    if path is None:
+        # Sin Pillow ni ffmpeg, o si el origen falla, el navegador pide la portada original,
+        # solo si es un archivo propio o una URL pública (la escribe el usuario)
+        fallback = item['thumbnail']
+        if fallback and (local_download_path(fallback) or is_public_url(fallback)):
+            return redirect(fallback)
+        return jsonify({'success': False, 'error': 'El item no tiene miniatura'}), 404
+    
+    # Con la versión de la imagen de origen en la URL (?v=) la respuesta no cambia nunca;
+    # sin ella el navegador revalida con el ETag
+    versioned = request.args.get('v') == thumb_version(item)
+    response = send_file(os.path.abspath(path), mimetype=THUMB_MIMETYPES[fmt], conditional=True, etag=True,
+                         max_age=365 * 24 * 3600 if versioned else 0)
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.immutable = versioned
+    response.vary.add('Accept')
+    return response
+
+@app.route('/stats', methods=['GET'])
+@login_required
+def stats():
+    """Contadores internos del worker que atiende la petición (solo para STATS_AROBASES)"""
+    # Incluye pids, estado de los pools y hosts escritos por los usuarios: no es para cualquiera
+    if session.get('arobase') not in STATS_AROBASES:
+        return jsonify({'success': False, 'error': 'No encontrado'}), 404
+    return jsonify({'success': True, 'pid': os.getpid(), 'http': http_client.stats(),
+                    'http_public': public_http_client.stats(), 'db': db_pool.stats(),
+                    'password_hasher': password_hasher.stats(), 'media_cache': media_files.stats(),
+                    'thumb_cache': thumb_files.stats(),
+                    'link_refresher': link_refresher.stats()})
+
 @app.route('/downloads/<path:filename>')
 def download_file(filename):
-    """Servir archivos subidos"""
+    """Servir archivos subidos (Range, ETag y peticiones condicionales)"""
     try:
-        return send_file(os.path.join(DOWNLOAD_FOLDER, filename), as_attachment=True)
+        path = safe_join(DOWNLOAD_FOLDER, filename)
+        if path is None or not os.path.isfile(path):
+            return jsonify({'success': False, 'error': 'Archivo no encontrado'}), 404
+        
+        if SENDFILE_MODE == 'x-accel':
+            return x_accel_response(filename, path)
+        
+        # send_file responde 206/304/412 según Range, If-Range, If-None-Match e If-Modified-Since;
+        # con SENDFILE_MODE='x-sendfile' delega el envío del cuerpo al servidor web
+        response = send_file(os.path.abspath(path), as_attachment=True, conditional=True, etag=True,
+                             max_age=DOWNLOAD_MAX_AGE)
+        response.headers['Accept-Ranges'] = 'bytes'
+        if response.status_code in (200, 206) and not app.config['USE_X_SENDFILE']:
+            DOWNLOAD_BYTES.labels(response.status_code).inc(response.content_length or 0)
+        if filename.startswith(BLOB_PREFIX):
+            # El nombre de un blob es su hash: el contenido nunca cambia
+            response.cache_control.max_age = 365 * 24 * 3600
+            response.cache_control.immutable = True
+        return response
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 404
 
+def x_accel_response(filename, path):
+    """Deja que nginx sirva el archivo desde una location interna (rangos y ETag incluidos)"""
+    response = Response(mimetype=mimetypes.guess_type(path)[0] or 'application/octet-stream')
+    response.headers['X-Accel-Redirect'] = SENDFILE_INTERNAL_PREFIX + quote(filename)
+    response.headers['Content-Disposition'] = f"attachment; filename*=UTF-8''{quote(os.path.basename(path))}"
+    response.cache_control.public = True
+    response.cache_control.max_age = DOWNLOAD_MAX_AGE
+    if filename.startswith(BLOB_PREFIX):
+        response.cache_control.max_age = 365 * 24 * 3600
+        response.cache_control.immutable = True
+    return response
+
+# ==================== COMPRESIÓN DE RESPUESTAS ====================
+class StreamCompressor:
+    """Compresor incremental con la misma interfaz para gzip, brotli y zstd"""
+
+    def __init__(self, encoding):
+        level = COMPRESSION_LEVELS[encoding]
+        if encoding == 'zstd':
+            obj = zstandard.ZstdCompressor(level=level).compressobj()
+            self.compress, self.finish = obj.compress, obj.flush
+        elif encoding == 'br':
+            obj = brotli.Compressor(quality=level)
+            self.compress, self.finish = obj.process, obj.finish
+        else:
+            obj = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits=31: formato gzip
+            self.compress, self.finish = obj.compress, obj.flush
+
+
+class CompressionMiddleware:
+    """Capa WSGI que comprime las respuestas según Accept-Encoding.
+
+    El cuerpo se comprime a medida que la aplicación lo produce, sin
+    acumularlo entero en memoria. Las respuestas por debajo de
+    COMPRESSION_MIN_SIZE, los medios ya comprimidos, los rangos y los
+    flujos SSE se envían tal cual.
+    """
+
+    def __init__(self, wsgi_app, min_size=COMPRESSION_MIN_SIZE):
+        self.wsgi_app = wsgi_app
+        self.min_size = min_size
+        self.encodings = [e for e, module in (('zstd', zstandard), ('br', brotli), ('gzip', zlib))
+                          if module is not None]
+
+    def negotiate(self, environ):
+        if environ.get('REQUEST_METHOD') == 'HEAD' or environ.get('HTTP_RANGE'):
+            return None
+        if environ.get('PATH_INFO', '').startswith(COMPRESSION_SKIP_PREFIXES):
+            return None
+        accept = parse_accept_header(environ.get('HTTP_ACCEPT_ENCODING', ''))
+        # A igual calidad gana el orden de preferencia del servidor (zstd, br, gzip)
+        best, best_q = None, 0
+        for encoding in self.encodings:
+            if accept[encoding] > best_q:
+                best, best_q = encoding, accept[encoding]
+        return best
+
+    def compressible(self, status, headers):
+        if int(status.split(' ', 1)[0]) in (204, 206, 304):
+            return False
+        if 'Content-Encoding' in headers or 'Content-Range' in headers:
+            return False
+        if 'no-transform' in headers.get('Cache-Control', ''):
+            return False
+        mimetype = headers.get('Content-Type', '').split(';', 1)[0].strip()
+        return mimetype in COMPRESSIBLE_MIMETYPES
+
+    def __call__(self, environ, start_response):
+        encoding = self.negotiate(environ)
+        if encoding is None:
+            return self.wsgi_app(environ, start_response)
+
+        captured = []
+
+        def capture(status, headers, exc_info=None):
+            captured[:] = [status, headers, exc_info]
+            return self._no_write
+
+        # Werkzeug llama a start_response antes de devolver el iterable, así que
+        # aquí se conocen las cabeceras sin haber consumido todavía el cuerpo
+        app_iter = self.wsgi_app(environ, capture)
+        status, header_list, exc_info = captured
+        headers = Headers(header_list)
+        if not self.compressible(status, headers):
+            start_response(status, header_list, exc_info)
+            return app_iter
+
+        self._add_vary(headers)
+        length = headers.get('Content-Length', type=int)
+        body = iter(app_iter)
+        head = []
+        if length is None:
+            # Longitud desconocida (generador): se adelanta lo justo para saber si supera el umbral
+            buffered = 0
+            for chunk in body:
+                head.append(chunk)
+                buffered += len(chunk)
+                if buffered >= self.min_size:
+                    break
+            else:
+                length = buffered
+                headers['Content-Length'] = str(buffered)
+        if length is not None and length < self.min_size:
+            start_response(status, headers.to_wsgi_list(), exc_info)
+            return self._chain(head, body, app_iter)
+
+        del headers['Content-Length']
+        headers['Content-Encoding'] = encoding
+        etag = headers.get('ETag')
+        if etag and not etag.startswith('W/'):
+            # El cuerpo cambia de bytes: la etiqueta deja de ser fuerte
+            headers['ETag'] = 'W/' + etag
+        start_response(status, headers.to_wsgi_list(), exc_info)
+        return self._compress(StreamCompressor(encoding), head, body, app_iter)
+
+    @staticmethod
+    def _no_write(data):
+        raise RuntimeError('CompressionMiddleware no admite el callable write() de WSGI')
+
+    @staticmethod
+    def _add_vary(headers):
+        vary = [v.strip() for v in headers.get('Vary', '').split(',') if v.strip()]
+        if 'Accept-Encoding' not in vary:
+            vary.append('Accept-Encoding')
+        headers['Vary'] = ', '.join(vary)
+
+    @staticmethod
+    def _chain(head, body, app_iter):
+        try:
+            yield from head
+            yield from body
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+
+    def _compress(self, compressor, head, body, app_iter):
+        for chunk in self._chain(head, body, app_iter):
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.finish()
+
+
+app.wsgi_app = CompressionMiddleware(app.wsgi_app)
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
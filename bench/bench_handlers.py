@@ -0,0 +1,38 @@
+"""Micro-benchmarks de las rutas respaldadas por SQLite (ver bench/conftest.py)"""
+import app
+
+
+def get_ok(client, url):
+    response = client.get(url)
+    assert response.status_code == 200 and response.json['success'], response.data
+    return response
+
+
+def bench_get_playlists(benchmark, client):
+    response = benchmark(get_ok, client, '/playlists')
+    assert len(response.json['playlists']) == 200
+
+
+def bench_get_playlist_content_first_page(benchmark, client):
+    response = benchmark(get_ok, client, '/playlist/1')
+    assert len(response.json['items']) == app.PAGE_SIZE_DEFAULT
+
+
+def bench_get_playlist_content_deep_page(benchmark, client):
+    # Cursor a mitad de la playlist grande: con keyset cuesta lo mismo que la primera página
+    with app.db_pool.connection() as conn:
+        total = conn.execute('SELECT item_count FROM playlists WHERE id = 1').fetchone()[0]
+        middle = conn.execute('''SELECT id, added_at FROM playlist_items WHERE playlist_id = 1
+                                 ORDER BY added_at DESC, id DESC LIMIT 1 OFFSET ?''', (total // 2,)).fetchone()
+    benchmark(get_ok, client, f'/playlist/1?cursor={app.encode_cursor(middle)}')
+
+
+def bench_add_to_playlist(benchmark, client):
+    media = {'title': 'bench', 'download_url': 'https://example.com/bench.mp4', 'format': 'mp4', 'duration': '3:25',
+             'thumbnail': 'https://example.com/bench.jpg'}
+
+    def add():
+        response = client.post('/add_to_playlist', json={'playlist_id': 2, 'media': media})
+        assert response.json['success'], response.data
+
+    benchmark(add)
@@ -0,0 +1,92 @@
+"""Compara un resultado de locust (--csv) con la línea base guardada y falla si hay regresión.
+
+Uso:
+    python bench/compare_load.py bench/results/run_stats.csv            # comparar
+    python bench/compare_load.py bench/results/run_stats.csv --save     # guardar como línea base
+    python bench/compare_load.py run_stats.csv --baseline otra.json --tolerance 0.25
+
+Por ruta se comparan p50, p95 y la tasa de fallos; en el agregado también las peticiones/s.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines', 'load.json')
+# Por debajo de este valor las diferencias de latencia son ruido
+MIN_LATENCY_MS = 5
+
+
+def read_stats(path):
+    stats = {}
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            requests = int(row['Request Count'])
+            if not requests:
+                continue
+            name = f"{row['Type']} {row['Name']}" if row['Type'] else row['Name']
+            stats[name] = {
+                'requests': requests,
+                'p50': float(row['50%']),
+                'p95': float(row['95%']),
+                'rps': float(row['Requests/s']),
+                'failure_rate': int(row['Failure Count']) / requests,
+            }
+    return stats
+
+
+def compare(current, baseline, tolerance):
+    """Lista de (ruta, métrica, base, actual) que empeoran más de lo tolerado"""
+    regressions = []
+    for name, base in baseline.items():
+        now = current.get(name)
+        if now is None:
+            continue
+        for metric in ('p50', 'p95'):
+            limit = max(base[metric], MIN_LATENCY_MS) * (1 + tolerance)
+            if now[metric] > limit:
+                regressions.append((name, metric, base[metric], now[metric]))
+        if now['failure_rate'] > base['failure_rate'] + 0.01:
+            regressions.append((name, 'failure_rate', base['failure_rate'], now['failure_rate']))
+        if name == 'Aggregated' and now['rps'] < base['rps'] * (1 - tolerance):
+            regressions.append((name, 'rps', base['rps'], now['rps']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('stats_csv', help='archivo *_stats.csv generado por locust --csv')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--tolerance', type=float, default=0.2, help='empeoramiento relativo admitido')
+    parser.add_argument('--save', action='store_true', help='guardar este resultado como línea base')
+    args = parser.parse_args()
+
+    current = read_stats(args.stats_csv)
+    if args.save:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump(current, f, indent=2, sort_keys=True)
+        print(f'Línea base guardada en {args.baseline} ({len(current)} rutas)')
+        return
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+
+    print(f"{'ruta':<40} {'p50 base':>9} {'p50':>9} {'p95 base':>9} {'p95':>9}")
+    for name in sorted(current):
+        base = baseline.get(name)
+        now = current[name]
+        if base:
+            print(f"{name:<40} {base['p50']:>9.0f} {now['p50']:>9.0f} {base['p95']:>9.0f} {now['p95']:>9.0f}")
+        else:
+            print(f"{name:<40} {'-':>9} {now['p50']:>9.0f} {'-':>9} {now['p95']:>9.0f}")
+
+    regressions = compare(current, baseline, args.tolerance)
+    for name, metric, base, now in regressions:
+        print(f'REGRESIÓN {name} {metric}: {base:.3f} -> {now:.3f}')
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
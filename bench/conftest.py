@@ -0,0 +1,105 @@
+"""Datos generados y cliente autenticado para los micro-benchmarks de las rutas con SQLite.
+
+Uso (desde la raíz del repositorio):
+    pytest bench/ --items 10000,100000,1000000
+    pytest bench/ --benchmark-save=baseline
+    pytest bench/ --benchmark-compare=0001 --benchmark-compare-fail=median:25%
+
+Los resultados guardados quedan en bench/baselines/.
+"""
+import os
+import random
+import sys
+import tempfile
+
+import pytest
+
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines')
+
+# app.py crea su base de datos y carpetas al importarse: se hace en un directorio temporal
+WORKDIR = tempfile.mkdtemp(prefix='bench-')
+os.environ.setdefault('DATABASE', os.path.join(WORKDIR, 'app.db'))
+os.environ.setdefault('CACHE_DATABASE', os.path.join(WORKDIR, 'cache.db'))
+os.environ.setdefault('SECRET_KEY', 'bench')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(WORKDIR)
+
+import app  # noqa: E402
+
+USERS = 1000
+BENCH_USER_PLAYLISTS = 200
+PLAYLISTS_PER_USER = 5
+BIG_PLAYLIST_SHARE = 0.1  # fracción de los items que va a la playlist 1
+
+
+def pytest_addoption(parser):
+    parser.addoption('--items', default='10000',
+                     help='tamaños de conjunto de datos separados por comas (items de playlists en total)')
+
+
+def pytest_configure(config):
+    # Se cambia de directorio al importar app: las líneas base se fijan a una ruta absoluta
+    if config.getoption('benchmark_storage', None) == 'file://./.benchmarks':
+        config.option.benchmark_storage = 'file://' + BASELINES
+
+
+def pytest_generate_tests(metafunc):
+    if 'dataset' in metafunc.fixturenames:
+        sizes = [int(size) for size in metafunc.config.getoption('items').split(',')]
+        metafunc.parametrize('dataset', sizes, indirect=True, ids=[f'{size}items' for size in sizes],
+                             scope='session')
+
+
+def populate(conn, items):
+    """Usuario 1 (@bench) con muchas playlists y una muy grande; el resto repartido al azar"""
+    rng = random.Random(items)
+    conn.executemany('INSERT INTO users (id, username, arobase, password) VALUES (?, ?, ?, ?)',
+                     ((u, f'user{u}', '@bench' if u == 1 else f'@user{u}', 'x') for u in range(1, USERS + 1)))
+
+    owners = [1] * BENCH_USER_PLAYLISTS + [u for u in range(2, USERS + 1) for _ in range(PLAYLISTS_PER_USER)]
+    conn.executemany('''INSERT INTO playlists (id, user_id, name, visibility, access_code, created_at)
+                        VALUES (?, ?, ?, 'code', ?, datetime('now', ?))''',
+                     ((p, owner, f'playlist {p}', f'CODE{p}', f'-{p} minutes')
+                      for p, owner in enumerate(owners, start=1)))
+
+    def rows():
+        for i in range(items):
+            playlist_id = 1 if rng.random() < BIG_PLAYLIST_SHARE else rng.randint(2, len(owners))
+            yield (playlist_id, f'item {i}', f'https://example.com/{i}.mp4', rng.randint(10, 3600),
+                   f'-{items - i} seconds')
+
+    # Los triggers mantienen item_count/total_duration igual que en producción
+    conn.executemany('''INSERT INTO playlist_items (playlist_id, title, url, media_type, duration_seconds, added_at)
+                        VALUES (?, ?, ?, 'mp4', ?, datetime('now', ?))''', rows())
+    conn.commit()
+    conn.execute('ANALYZE')
+
+
+@pytest.fixture
+def dataset(request):
+    """Pool de conexiones sobre una base con `request.param` items; se genera una vez por tamaño"""
+    pools = request.config.__dict__.setdefault('bench_pools', {})
+    items = request.param
+    if items not in pools:
+        path = os.path.join(WORKDIR, f'dataset-{items}.db')
+        pool = app.ConnectionPool(path, app.DB_POOL_SIZE, app.DB_POOL_TIMEOUT)
+        conn = pool.connect()
+        app.migrate(conn)
+        conn.isolation_level = ''
+        populate(conn, items)
+        conn.close()
+        pools[items] = pool
+    previous = app.db_pool
+    app.db_pool = pools[items]
+    yield items
+    app.db_pool = previous
+
+
+@pytest.fixture
+def client(dataset):
+    """Cliente de pruebas con la sesión de @bench ya iniciada (sin pasar por el hash de contraseñas)"""
+    client = app.app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = 1
+        session['arobase'] = '@bench'
+    return client
@@ -0,0 +1,63 @@
+"""Doble local de la API de tikwm para las pruebas de carga (latencia y errores configurables).
+
+Uso: python bench/fake_tikwm.py [--port 9100] [--latency 0.3] [--jitter 0.2] [--error-rate 0.02]
+La app se apunta aquí con TIKWM_API_URL=http://127.0.0.1:9100/api/
+"""
+import argparse
+import hashlib
+import json
+import random
+import time
+
+from werkzeug.serving import run_simple
+from werkzeug.wrappers import Request, Response
+
+
+def video_data(url):
+    """Respuesta estable para una misma URL, con la forma de la API real"""
+    video_id = hashlib.sha1(url.encode()).hexdigest()[:12]
+    return {
+        'id': video_id,
+        'title': f'Vídeo de prueba {video_id}',
+        'duration': int(video_id[:4], 16) % 180 + 5,
+        'play': f'https://cdn.example.com/{video_id}.mp4',
+        'hdplay': f'https://cdn.example.com/{video_id}-hd.mp4',
+        'music': f'https://cdn.example.com/{video_id}.mp3',
+        'cover': f'https://cdn.example.com/{video_id}.jpg',
+        'images': [],
+        'play_count': 1000,
+        'digg_count': 100,
+        'comment_count': 10,
+        'share_count': 1,
+        'author': {'nickname': 'bench'},
+    }
+
+
+def make_app(args):
+    @Request.application
+    def application(request):
+        if request.path != '/api/':
+            return Response('Not found', status=404)
+        time.sleep(max(0, args.latency + random.uniform(-args.jitter, args.jitter)))
+        if random.random() < args.error_rate:
+            return Response('upstream error', status=503)
+        url = request.form.get('url', '')
+        body = {'code': 0, 'msg': 'success', 'data': video_data(url)}
+        return Response(json.dumps(body), mimetype='application/json')
+
+    return application
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9100)
+    parser.add_argument('--latency', type=float, default=0.3, help='segundos por respuesta')
+    parser.add_argument('--jitter', type=float, default=0.2)
+    parser.add_argument('--error-rate', type=float, default=0.02, help='fracción de respuestas 503')
+    args = parser.parse_args()
+    run_simple(args.host, args.port, make_app(args), threaded=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""Escenario de carga: login → procesar → añadir a playlist → listar, como lo hace el frontend.
+
+Uso (con bench/stub_app.py y bench/fake_tikwm.py en marcha):
+    locust -f bench/locustfile.py --host http://127.0.0.1:8000 --headless -u 50 -r 1 -t 3m \
+        --csv bench/results/run
+    python bench/compare_load.py bench/results/run_stats.csv
+
+Con -r 1 los registros y logins (dos PBKDF2 de ~0,4 s por usuario) no saturan una sola CPU;
+la línea base de bench/baselines/load.json se tomó así.
+
+Las peticiones llevan nombres fijos (/playlist/[id], /jobs/[id]) para agregarse por ruta.
+"""
+import random
+import secrets
+import time
+
+from locust import HttpUser, between, task
+
+# Parte de las URLs se repite entre usuarios (aciertos de caché y coalescencia) y parte es única
+POPULAR_VIDEOS = 200
+POPULAR_SHARE = 0.7
+JOB_POLL_INTERVAL = 0.5
+JOB_POLL_TIMEOUT = 30
+
+
+def media_url():
+    if random.random() < POPULAR_SHARE:
+        video = f'popular{random.randrange(POPULAR_VIDEOS)}'
+    else:
+        video = secrets.token_hex(6)
+    if random.random() < 0.3:
+        return 'tiktok', f'https://www.tiktok.com/@bench/video/{video}'
+    return 'youtube', f'https://www.youtube.com/watch?v={video}'
+
+
+class MediaUser(HttpUser):
+    wait_time = between(1, 3)
+
+    def on_start(self):
+        self.arobase = f'@bench{secrets.token_hex(4)}'
+        password = secrets.token_hex(8)
+        self.client.post('/register', json={'username': self.arobase[1:], 'arobase': self.arobase,
+                                            'password': password})
+        self.client.post('/login', json={'username': self.arobase, 'password': password})
+        response = self.client.post('/create_playlist', json={'name': 'bench'})
+        self.playlist_id = response.json().get('playlist_id')
+
+    def process(self):
+        platform, url = media_url()
+        with self.client.post('/process', json={'url': url, 'platform': platform, 'format': 'mp4', 'async': True},
+                              catch_response=True) as response:
+            body = response.json()
+            if not body.get('success'):
+                response.failure(body.get('error'))
+                return None
+            if body.get('status') == 'done':
+                return body['result']
+            job_id = body['job_id']
+
+        deadline = time.time() + JOB_POLL_TIMEOUT
+        while time.time() < deadline:
+            time.sleep(JOB_POLL_INTERVAL)
+            job = self.client.get(f'/jobs/{job_id}', name='/jobs/[id]').json().get('job', {})
+            if job.get('status') == 'done':
+                return job['result']
+            if job.get('status') == 'error':
+                return None
+        return None
+
+    @task(3)
+    def process_and_add(self):
+        media = self.process()
+        if not media or not self.playlist_id:
+            return
+        self.client.post('/add_to_playlist', json={
+            'playlist_id': self.playlist_id,
+            'media': {
+                'title': media.get('title'),
+                'download_url': media.get('download_url'),
+                'video': media.get('video'),
+                'format': 'mp4',
+                'duration': media.get('duration'),
+                'duration_seconds': media.get('duration_seconds'),
+                'thumbnail': media.get('thumbnail'),
+            },
+        })
+
+    @task(5)
+    def list_playlists(self):
+        self.client.get('/playlists')
+
+    @task(5)
+    def playlist_content(self):
+        if self.playlist_id:
+            self.client.get(f'/playlist/{self.playlist_id}', name='/playlist/[id]')
+
+    @task(1)
+    def check_session(self):
+        self.client.get('/check_session')
@@ -0,0 +1,89 @@
+"""Planes de consulta y tiempos antes/después de las migraciones de índices y contadores.
+
+Uso: python bench/query_plans.py [--users N] [--playlists N] [--items N]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+# app.py crea su base de datos y carpetas al importarse: se hace en un directorio temporal
+WORKDIR = tempfile.mkdtemp(prefix='bench-')
+os.environ.setdefault('DATABASE', os.path.join(WORKDIR, 'app.db'))
+os.environ.setdefault('CACHE_DATABASE', os.path.join(WORKDIR, 'cache.db'))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(WORKDIR)
+
+import app  # noqa: E402
+
+QUERIES = {
+    'get_playlists': ('''SELECT p.*, COUNT(pi.id) as item_count
+                         FROM playlists p
+                         LEFT JOIN playlist_items pi ON p.id = pi.playlist_id
+                         WHERE p.user_id = ?
+                         GROUP BY p.id
+                         ORDER BY p.created_at DESC''', lambda a: (random.randint(1, a.users),)),
+    # Desde la migración 3 item_count está almacenado en playlists
+    'get_playlists (contadores)': ('SELECT * FROM playlists WHERE user_id = ? ORDER BY created_at DESC',
+                                   lambda a: (random.randint(1, a.users),), 3),
+    'get_playlist_content': ('SELECT * FROM playlist_items WHERE playlist_id = ? ORDER BY added_at DESC',
+                             lambda a: (random.randint(1, a.users * a.playlists),)),
+    'access_playlist': ('SELECT * FROM playlists WHERE access_code = ? AND visibility = ?',
+                        lambda a: (f'CODE{random.randint(1, a.users * a.playlists)}', 'code')),
+}
+
+
+def populate(conn, args):
+    conn.executemany('INSERT INTO users (id, username, arobase, password) VALUES (?, ?, ?, ?)',
+                     ((u, f'user{u}', f'@user{u}', 'x') for u in range(1, args.users + 1)))
+    conn.executemany('''INSERT INTO playlists (id, user_id, name, visibility, access_code, created_at)
+                        VALUES (?, ?, ?, 'code', ?, datetime('now', ?))''',
+                     ((p, (p - 1) // args.playlists + 1, f'playlist {p}', f'CODE{p}', f'-{p} minutes')
+                      for p in range(1, args.users * args.playlists + 1)))
+    total = args.users * args.playlists
+    conn.executemany('''INSERT INTO playlist_items (playlist_id, title, url, media_type, added_at)
+                        VALUES (?, 'item', 'https://example.com/v.mp4', 'mp4', datetime('now', ?))''',
+                     ((random.randint(1, total), f'-{i} seconds') for i in range(args.items * total)))
+    conn.commit()
+
+
+def report(conn, label, args, repeat):
+    print(f'\n=== {label} ===')
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    for name, (sql, params, *min_version) in QUERIES.items():
+        if min_version and version < min_version[0]:
+            continue
+        plan = conn.execute('EXPLAIN QUERY PLAN ' + sql, params(args)).fetchall()
+        start = time.perf_counter()
+        for _ in range(repeat):
+            conn.execute(sql, params(args)).fetchall()
+        elapsed = (time.perf_counter() - start) / repeat * 1000
+        print(f'{name}: {elapsed:.3f} ms/consulta')
+        for row in plan:
+            print(f'    {row[3]}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--playlists', type=int, default=10, help='playlists por usuario')
+    parser.add_argument('--items', type=int, default=50, help='items por playlist (media)')
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(os.path.join(WORKDIR, 'plans.db'))
+    app.migrate(conn, target=1)
+    populate(conn, args)
+    conn.execute('ANALYZE')
+    report(conn, 'Esquema v1 (sin índices)', args, args.repeat)
+
+    app.migrate(conn)
+    conn.execute('ANALYZE')
+    report(conn, f'Esquema v{app.MIGRATIONS[-1][0]}', args, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""La app con yt-dlp sustituido por un extractor falso, para las pruebas de carga.
+
+Uso (desde la raíz del repositorio):
+    python bench/fake_tikwm.py --port 9100 &
+    TIKWM_API_URL=http://127.0.0.1:9100/api/ gunicorn -c gunicorn.conf.py bench.stub_app:app
+
+BENCH_EXTRACT_LATENCY fija los segundos que tarda cada extracción falsa (0.8 por defecto). Como
+todos los usuarios de locust llegan desde la misma IP, el límite de logins por IP se desactiva.
+"""
+import hashlib
+import os
+import random
+import time
+
+import yt_dlp
+
+EXTRACT_LATENCY = float(os.environ.get('BENCH_EXTRACT_LATENCY', 0.8))
+os.environ.setdefault('LOGIN_IP_BURST', '1000000')
+
+
+class FakeYoutubeDL:
+    """Sustituto de yt_dlp.YoutubeDL: sin red, con la latencia y la forma de extract_info"""
+
+    def __init__(self, params=None):
+        self.params = params or {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def extract_info(self, url, download=False):
+        time.sleep(EXTRACT_LATENCY * random.uniform(0.5, 1.5))
+        video_id = hashlib.sha1(url.encode()).hexdigest()[:11]
+        return {
+            'id': video_id,
+            'title': f'Vídeo de prueba {video_id}',
+            'thumbnail': f'https://i.example.com/{video_id}.jpg',
+            'duration': int(video_id[:4], 16) % 600 + 30,
+            'resolution': '1280x720',
+            # Con expire como los enlaces firmados reales, para que la caché calcule su TTL
+            'url': f'https://rr.example.com/videoplayback?id={video_id}&expire={int(time.time()) + 6 * 3600}',
+            'view_count': 12345,
+            'like_count': 678,
+            'uploader': 'bench',
+            'upload_date': '20240101',
+            'description': 'Descripción de prueba ' * 20,
+        }
+
+
+# Antes de importar la app: extract_ytdlp resuelve yt_dlp.YoutubeDL en cada llamada
+yt_dlp.YoutubeDL = FakeYoutubeDL
+
+from app import app  # noqa: E402,F401
@@ -0,0 +1,86 @@
+# Configuración de gunicorn para producción: gunicorn -c gunicorn.conf.py app:app
+#
+# Todos los valores se pueden ajustar con variables de entorno sin tocar este archivo.
+import glob
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+
+cpu_count = multiprocessing.cpu_count()
+
+bind = os.environ.get('GUNICORN_BIND', f"0.0.0.0:{os.environ.get('PORT', '8000')}")
+
+# Métricas de Prometheus agregadas entre workers: el directorio debe existir antes de importar
+# la app (preload) y vaciarse en cada arranque para no arrastrar valores de procesos anteriores.
+# El directorio propio se borra entero; en uno indicado por el operador solo los .db de métricas
+default_prometheus_dir = os.path.join(tempfile.gettempdir(), 'mediadownloader-metrics')
+prometheus_dir = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', default_prometheus_dir)
+if prometheus_dir == default_prometheus_dir:
+    shutil.rmtree(prometheus_dir, ignore_errors=True)
+else:
+    for stale in glob.glob(os.path.join(prometheus_dir, '*.db')):
+        os.remove(stale)
+os.makedirs(prometheus_dir, exist_ok=True)
+
+# 'gthread' (por defecto) o 'gevent'. Las peticiones pasan casi todo el tiempo esperando a
+# tikwm/yt-dlp, así que con workers sync una sola extracción lenta bloquea un proceso entero.
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+
+if worker_class == 'gevent':
+    # Hay que parchear antes de que preload_app importe la aplicación (requests, sqlite3, threading)
+    from gevent import monkey
+    monkey.patch_all()
+
+# Cada worker carga yt-dlp y su propio pool SQLite: se limita el número de procesos y la
+# concurrencia se consigue con hilos (o greenlets con gevent).
+#
+# Medido con bench/locustfile.py contra bench/stub_app.py (50 usuarios, 1 CPU, 3 min; línea base
+# en bench/baselines/load.json), p95 / p99 de las rutas ligeras (/playlists, /playlist/[id], /process):
+#   3 workers x 8 hilos (por defecto)   13-23 ms / 28-34 ms, sin errores
+#   3 workers x 1 hilo                  68-190 ms / 500-540 ms: esperan detrás de los logins (PBKDF2)
+#   1 worker  x 8 hilos                 13-21 ms / 670-1300 ms: un solo GIL para todo
+workers = int(os.environ.get('WEB_CONCURRENCY', min(cpu_count * 2 + 1, 9)))
+# Los hilos coinciden con DB_POOL_SIZE para que ninguno espere conexión en el caso normal
+threads = int(os.environ.get('GUNICORN_THREADS', os.environ.get('DB_POOL_SIZE', 8)))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 500))
+
+# Se importa la app una vez en el maestro: la plantilla renderizada, los recursos precomprimidos
+# y migraciones quedan compartidos entre workers. Todo lo que tiene estado por
+# proceso (pools SQLite, executors, cliente HTTP) se crea o se rehace tras el fork.
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+
+# Con gthread/gevent el timeout solo vigila que el worker siga vivo, no la duración de cada
+# petición; aun así se deja margen para extracciones síncronas largas de yt-dlp. En la prueba de
+# carga la petición más lenta (un login en cola) tardó 4,5 s y no hubo ningún WORKER TIMEOUT
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+# Al reciclar o reiniciar, las extracciones y subidas en curso tienen tiempo de terminar
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 60))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+# Reciclado periódico contra el crecimiento de memoria de yt-dlp; el jitter evita que todos
+# los workers se reinicien a la vez
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 100))
+
+# El latido de los workers en tmpfs evita bloqueos por disco lento en contenedores
+worker_tmp_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+forwarded_allow_ips = os.environ.get('FORWARDED_ALLOW_IPS', '127.0.0.1')
+accesslog = os.environ.get('GUNICORN_ACCESSLOG', '-')
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOGLEVEL', 'info')
+
+
+def post_fork(server, worker):
+    # Con preload todos los workers heredan el mismo estado de random; sin re-sembrar, los
+    # reintentos con backoff aleatorio de cada worker irían sincronizados
+    random.seed()
+    server.log.info('Worker %s listo (%s, %s hilos)', worker.pid, worker_class, threads)
+
+
+def child_exit(server, worker):
+    # Los gauges 'livesum' de un worker muerto dejan de contar
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,1147 @@
+let selectedPlatform = 'youtube';
+let selectedFormat = 'mp4';
+let currentMedia = null;
+
+// Auth functions
+function switchAuthTab(tab) {
+    document.querySelectorAll('.auth-tab').forEach(t => t.classList.remove('active'));
+    document.querySelectorAll('.auth-form').forEach(f => f.classList.remove('active'));
+
+    event.target.classList.add('active');
+    document.getElementById(tab + 'Form').classList.add('active');
+}
+
+async function handleLogin(e) {
+    e.preventDefault();
+    const formData = new FormData(e.target);
+
+    try {
+        const response = await fetch('/login', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify(Object.fromEntries(formData))
+        });
+
+        const data = await response.json();
+
+        if (data.success) {
+            showSuccess('¡Inicio de sesión exitoso!');
+            setTimeout(() => {
+                document.getElementById('authSection').style.display = 'none';
+                document.getElementById('mainContent').classList.add('active');
+                document.getElementById('userInfo').classList.add('active');
+                document.getElementById('userDisplay').textContent = data.arobase;
+                loadPlaylists();
+            }, 1000);
+        } else {
+            showError(data.error);
+        }
+    } catch (error) {
+        showError('Error de conexión');
+    }
+}
+
+async function handleRegister(e) {
+    e.preventDefault();
+    const formData = new FormData(e.target);
+    const data = Object.fromEntries(formData);
+
+    if (data.password !== data.confirm_password) {
+        showError('Las contraseñas no coinciden');
+        return false;
+    }
+
+    if (!data.arobase.startsWith('@')) {
+        showError('El nombre de arroba debe comenzar con @');
+        return false;
+    }
+
+    try {
+        const response = await fetch('/register', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify(data)
+        });
+
+        const result = await response.json();
+
+        if (result.success) {
+            showSuccess('¡Cuenta creada exitosamente! Ahora puedes iniciar sesión.');
+            setTimeout(() => {
+                switchAuthTab('login');
+            }, 2000);
+        } else {
+            showError(result.error);
+        }
+    } catch (error) {
+        showError('Error de conexión');
+    }
+
+    return false;
+}
+
+async function logout() {
+    try {
+        await fetch('/logout', { method: 'POST' });
+        location.reload();
+    } catch (error) {
+        console.error('Error al cerrar sesión');
+    }
+}
+
+function showError(msg) {
+    const errorDiv = document.getElementById('errorMsg');
+    if (errorDiv) {
+        errorDiv.textContent = msg;
+        errorDiv.style.display = 'block';
+        setTimeout(() => errorDiv.style.display = 'none', 5000);
+    }
+    console.error('Error:', msg);
+}
+
+function showSuccess(msg) {
+    const successDiv = document.getElementById('successMsg');
+    if (successDiv) {
+        successDiv.textContent = msg;
+        successDiv.style.display = 'block';
+        setTimeout(() => successDiv.style.display = 'none', 3000);
+    }
+    console.log('Success:', msg);
+}
+
+// Section switching
+function switchSection(section) {
+    document.querySelectorAll('.nav-btn').forEach(btn => btn.classList.remove('active'));
+    document.querySelectorAll('.section').forEach(s => s.classList.remove('active'));
+
+    event.target.classList.add('active');
+    document.getElementById(section + 'Section').classList.add('active');
+
+    if (section === 'playlists') {
+        loadPlaylists();
+    }
+}
+
+// Platform selection
+document.querySelectorAll('.platform-btn').forEach(btn => {
+    btn.addEventListener('click', function() {
+        document.querySelectorAll('.platform-btn').forEach(b => b.classList.remove('active'));
+        this.classList.add('active');
+        selectedPlatform = this.dataset.platform;
+
+        document.getElementById('photoBtn').style.display = 
+            selectedPlatform === 'tiktok' ? 'inline-block' : 'none';
+    });
+});
+
+// Format selection
+document.querySelectorAll('.format-btn').forEach(btn => {
+    btn.addEventListener('click', function() {
+        document.querySelectorAll('.format-btn').forEach(b => b.classList.remove('active'));
+        this.classList.add('active');
+        selectedFormat = this.dataset.format;
+    });
+});
+
+// URL functions
+async function pasteUrl() {
+    try {
+        const text = await navigator.clipboard.readText();
+        document.getElementById('urlInput').value = text;
+    } catch (error) {
+        showError('No se pudo pegar desde el portapapeles');
+    }
+}
+
+function clearUrl() {
+    document.getElementById('urlInput').value = '';
+    document.getElementById('previewSection').style.display = 'none';
+    currentMedia = null;
+}
+
+async function processMedia() {
+    const url = document.getElementById('urlInput').value;
+    if (!url) {
+        showError('Por favor ingresa una URL');
+        return;
+    }
+
+    document.getElementById('loading').style.display = 'block';
+    document.getElementById('loadingMessage').textContent = 'Procesando...';
+    document.getElementById('previewSection').style.display = 'none';
+
+    try {
+        const response = await fetch('/process', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({
+                url: url,
+                platform: selectedPlatform,
+                format: selectedFormat,
+                async: true,
+                download: document.getElementById('serverDownload').checked
+            })
+        });
+
+        let data = await response.json();
+
+        // La extracción se encola en el servidor y se sigue su progreso
+        if (data.success && data.job_id) {
+            data = await waitForJob(data);
+        } else if (data.success && data.result) {
+            data = data.result;
+        }
+
+        if (data.success) {
+            currentMedia = data;
+            displayPreview(data);
+        } else {
+            showError('Error: ' + data.error);
+        }
+    } catch (error) {
+        showError('Error de conexión: ' + error);
+    } finally {
+        document.getElementById('loading').style.display = 'none';
+    }
+}
+
+function showJobProgress(job) {
+    // Las descargas en el servidor informan del avance de yt-dlp y ffmpeg
+    if (job.message) {
+        document.getElementById('loadingMessage').textContent = `${job.message}... ${job.progress || 0}%`;
+    }
+}
+
+function jobOutcome(job) {
+    return job.result || { success: false, error: job.message || 'Error al procesar' };
+}
+
+function waitForJob(job) {
+    return new Promise(resolve => {
+        const finished = j => j.status === 'done' || j.status === 'error';
+
+        // Sin EventSource (o si se corta) se consulta el estado periódicamente
+        const poll = async () => {
+            try {
+                const response = await fetch(job.status_url);
+                const data = await response.json();
+                if (!data.success) return resolve(data);
+                if (finished(data.job)) return resolve(jobOutcome(data.job));
+                showJobProgress(data.job);
+            } catch (error) {}
+            setTimeout(poll, 1000);
+        };
+
+        if (!window.EventSource) return poll();
+
+        const source = new EventSource(job.stream_url);
+        source.onmessage = event => {
+            const current = JSON.parse(event.data);
+            if (finished(current)) {
+                source.close();
+                resolve(jobOutcome(current));
+            } else {
+                showJobProgress(current);
+            }
+        };
+        source.onerror = () => {
+            source.close();
+            poll();
+        };
+    });
+}
+
+function displayPreview(data) {
+    const previewSection = document.getElementById('previewSection');
+    const previewGrid = document.getElementById('previewGrid');
+    // Todas las tarjetas se montan de una vez: un solo parseo en lugar de re-parsear el grid con cada +=
+    const cards = [];
+
+    if (data.platform === 'tiktok') {
+        // Info card para TikTok
+        cards.push(`
+            <div class="preview-card">
+                <h3>📊 Información</h3>
+                <p class="info-text">👤 ${data.uploader || 'Desconocido'}</p>
+                <p class="info-text">👁️ ${formatNumber(data.view_count || 0)} vistas</p>
+                <p class="info-text">❤️ ${formatNumber(data.like_count || 0)} likes</p>
+                <p class="info-text">💬 ${formatNumber(data.comment_count || 0)} comentarios</p>
+                <p class="info-text">↗️ ${formatNumber(data.share_count || 0)} compartidos</p>
+            </div>
+        `);
+
+        if (data.video) {
+            cards.push(`
+                <div class="preview-card">
+                    <h3>🎥 Video</h3>
+                    ${data.thumbnail ? `<img src="${data.thumbnail}" alt="Thumbnail" loading="lazy">` : ''}
+                    <p class="info-text"><strong>${data.title || 'Sin título'}</strong></p>
+                    <p class="info-text">⏱️ Duración: ${data.duration || 'N/A'}</p>
+                    <p class="info-text">📺 Calidad: ${data.quality || 'N/A'}</p>
+                    <a href="${data.video}" class="download-link" download="${sanitizeFilename(data.title)}.mp4">Descargar Video</a>
+                </div>
+            `);
+        }
+
+        if (data.audio) {
+            cards.push(`
+                <div class="preview-card">
+                    <h3>🎵 Audio</h3>
+                    <audio controls preload="none" src="${data.audio}" style="width:100%;"></audio>
+                    <a href="${data.audio}" class="download-link" download="${sanitizeFilename(data.title)}.mp3">Descargar Audio</a>
+                </div>
+            `);
+        }
+
+        if (data.images && data.images.length > 0) {
+            data.images.forEach((img, idx) => {
+                cards.push(`
+                    <div class="preview-card">
+                        <h3>📷 Foto ${idx + 1}</h3>
+                        <img src="${img}" alt="Image ${idx + 1}" loading="lazy">
+                        <a href="${img}" class="download-link" download="${sanitizeFilename(data.title)}_${idx + 1}.jpg">Descargar</a>
+                    </div>
+                `);
+            });
+        }
+    } else {
+        // Info card para YouTube y otras plataformas
+        cards.push(`
+            <div class="preview-card">
+                <h3>📊 Información del Video</h3>
+                ${data.thumbnail ? `<img src="${data.thumbnail}" alt="Thumbnail" loading="lazy">` : ''}
+                <p class="info-text"><strong>${data.title || 'Sin título'}</strong></p>
+                <p class="info-text">👤 ${data.uploader || 'Desconocido'}</p>
+                <p class="info-text">👁️ ${formatNumber(data.view_count || 0)} vistas</p>
+                <p class="info-text">❤️ ${formatNumber(data.like_count || 0)} likes</p>
+                <p class="info-text">⏱️ Duración: ${data.duration || 'N/A'}</p>
+                <p class="info-text">📅 Subido: ${formatDate(data.upload_date)}</p>
+            </div>
+        `);
+
+        cards.push(`
+            <div class="preview-card">
+                <h3>📥 Descargar</h3>
+                <p class="info-text">Formato: ${data.format || 'N/A'}</p>
+                <p class="info-text">Calidad: ${data.quality || 'N/A'}</p>
+                <a href="${data.download_url}" class="download-link" download="${sanitizeFilename(data.title)}.${data.format.toLowerCase()}">
+                    Descargar ${data.format}
+                </a>
+            </div>
+        `);
+
+        if (data.description) {
+            cards.push(`
+                <div class="preview-card" style="grid-column: 1 / -1;">
+                    <h3>📝 Descripción</h3>
+                    <p class="info-text">${data.description}</p>
+                </div>
+            `);
+        }
+    }
+
+    previewGrid.innerHTML = cards.join('');
+    previewSection.style.display = 'block';
+}
+
+function formatNumber(num) {
+    if (num >= 1000000) {
+        return (num / 1000000).toFixed(1) + 'M';
+    } else if (num >= 1000) {
+        return (num / 1000).toFixed(1) + 'K';
+    }
+    return num.toString();
+}
+
+function formatDate(dateStr) {
+    if (!dateStr || dateStr === 'N/A') return 'N/A';
+    try {
+        const year = dateStr.substring(0, 4);
+        const month = dateStr.substring(4, 6);
+        const day = dateStr.substring(6, 8);
+        return `${day}/${month}/${year}`;
+    } catch {
+        return dateStr;
+    }
+}
+
+function formatTotalDuration(seconds) {
+    seconds = seconds || 0;
+    const h = Math.floor(seconds / 3600);
+    const m = Math.floor((seconds % 3600) / 60);
+    return h > 0 ? `${h} h ${m} min` : `${m} min`;
+}
+
+function sanitizeFilename(filename) {
+    return filename.replace(/[^a-z0-9]/gi, '_').substring(0, 50);
+}
+
+// Playlist functions
+async function loadPlaylists() {
+    try {
+        const response = await fetch('/playlists');
+
+        if (response.status === 401) {
+            showError('Sesión expirada. Por favor inicia sesión nuevamente.');
+            setTimeout(() => location.reload(), 2000);
+            return;
+        }
+
+        const data = await response.json();
+        console.log('Playlists cargadas:', data);
+
+        if (data.success) {
+            displayPlaylists(data.playlists);
+        } else {
+            console.error('Error al cargar playlists:', data.error);
+            if (data.redirect) {
+                showError('Sesión expirada. Recargando...');
+                setTimeout(() => location.reload(), 2000);
+            } else {
+                showError(data.error || 'Error al cargar playlists');
+            }
+        }
+    } catch (error) {
+        console.error('Error de conexión:', error);
+        showError('Error al cargar playlists: ' + error.message);
+    }
+}
+
+function displayPlaylists(playlists) {
+    const grid = document.getElementById('playlistsGrid');
+
+    console.log('Mostrando', playlists.length, 'playlists');
+
+    if (!playlists || playlists.length === 0) {
+        grid.innerHTML = `
+            <div style="grid-column: 1/-1; text-align: center; padding: 40px;">
+                <p style="color:#aaa; font-size: 18px; margin-bottom: 20px;">
+                    📂 No tienes playlists aún
+                </p>
+                <p style="color:#666; margin-bottom: 30px;">
+                    ¡Crea tu primera playlist y comienza a organizar tu música y videos!
+                </p>
+                <button class="create-playlist-btn" onclick="showCreatePlaylist()">
+                    ✨ Crear Mi Primera Playlist
+                </button>
+            </div>
+        `;
+        return;
+    }
+
+    grid.innerHTML = playlists.map(playlist => `
+        <div class="playlist-card">
+            <h3 class="playlist-title">${playlist.name}</h3>
+            <p class="info-text">${playlist.description || 'Sin descripción'}</p>
+            <p class="playlist-meta">📁 ${playlist.item_count || 0} elementos · ⏱️ ${formatTotalDuration(playlist.total_duration)}</p>
+            <p class="playlist-meta">📅 Creada: ${new Date(playlist.created_at).toLocaleDateString()}</p>
+            <span class="visibility-badge visibility-${playlist.visibility}">
+                ${playlist.visibility === 'public' ? '🌍 Pública' : 
+                  playlist.visibility === 'private' ? '🔒 Privada' : 
+                  '🔑 Código: ' + (playlist.access_code || 'N/A')}
+            </span>
+            <div style="margin-top: 15px;">
+                <button class="download-link" onclick="viewPlaylist(${playlist.id})">👁️ Ver Contenido</button>
+            </div>
+        </div>
+    `).join('');
+}
+
+function showCreatePlaylist() {
+    document.getElementById('createPlaylistModal').classList.add('active');
+}
+
+function closeModal(modalId) {
+    document.getElementById(modalId).classList.remove('active');
+}
+
+function toggleCodeField(select) {
+    const codeField = document.getElementById('codeField');
+    const codeInput = document.getElementById('generatedCode');
+
+    if (select.value === 'code') {
+        codeField.style.display = 'block';
+        codeInput.value = generateAccessCode();
+    } else {
+        codeField.style.display = 'none';
+    }
+}
+
+function generateAccessCode() {
+    return Math.random().toString(36).substring(2, 10).toUpperCase();
+}
+
+async function createPlaylist(e) {
+    e.preventDefault();
+    const formData = new FormData(e.target);
+    const data = Object.fromEntries(formData);
+
+    console.log('Datos del formulario:', data);
+
+    if (data.visibility === 'code') {
+        data.access_code = document.getElementById('generatedCode').value;
+    } else {
+        data.access_code = null;
+    }
+
+    console.log('Enviando datos:', data);
+
+    try {
+        const response = await fetch('/create_playlist', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify(data)
+        });
+
+        const result = await response.json();
+        console.log('Respuesta del servidor:', result);
+
+        if (result.success) {
+            showSuccess('¡Playlist creada exitosamente!');
+            closeModal('createPlaylistModal');
+            setTimeout(() => {
+                loadPlaylists();
+            }, 500);
+            e.target.reset();
+            document.getElementById('codeField').style.display = 'none';
+        } else {
+            showError(result.error || 'Error al crear playlist');
+        }
+    } catch (error) {
+        console.error('Error:', error);
+        showError('Error de conexión: ' + error.message);
+    }
+
+    return false;
+}
+
+async function showAddToPlaylist() {
+    if (!currentMedia) {
+        showError('Primero procesa un medio');
+        return;
+    }
+
+    try {
+        const response = await fetch('/playlists');
+        const data = await response.json();
+
+        if (data.success && data.playlists.length > 0) {
+            const playlistSelect = data.playlists.map(p => 
+                `<option value="${p.id}">${p.name}</option>`
+            ).join('');
+
+            const modalHTML = `
+                <div class="modal active" id="addToPlaylistModal">
+                    <div class="modal-content">
+                        <div class="modal-header">
+                            <h2>Añadir a Playlist</h2>
+                            <button class="close-modal" onclick="closeAddToPlaylist()">×</button>
+                        </div>
+                        <div class="form-group">
+                            <label>Selecciona una Playlist</label>
+                            <select class="form-input" id="selectPlaylist">
+                                ${playlistSelect}
+                            </select>
+                        </div>
+                        <button class="submit-btn" onclick="addMediaToPlaylist()">Añadir</button>
+                    </div>
+                </div>
+            `;
+
+            document.body.insertAdjacentHTML('beforeend', modalHTML);
+        } else {
+            showError('Primero crea una playlist');
+        }
+    } catch (error) {
+        showError('Error al cargar playlists');
+    }
+}
+
+function closeAddToPlaylist() {
+    const modal = document.getElementById('addToPlaylistModal');
+    if (modal) modal.remove();
+}
+
+async function addMediaToPlaylist() {
+    const playlistId = document.getElementById('selectPlaylist').value;
+
+    try {
+        const response = await fetch('/add_to_playlist', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({
+                playlist_id: playlistId,
+                media: currentMedia
+            })
+        });
+
+        const data = await response.json();
+
+        if (data.success) {
+            showSuccess('¡Media añadido a la playlist!');
+            closeAddToPlaylist();
+        } else {
+            showError(data.error);
+        }
+    } catch (error) {
+        showError('Error al añadir a playlist');
+    }
+}
+
+function viewPlaylist(playlistId) {
+    loadPlaylistContent(playlistId);
+}
+
+// Estado de la paginación del modal abierto (cursor de la siguiente página)
+let playlistPager = null;
+
+function fetchPlaylistPage(playlistId, cursor) {
+    const params = cursor ? `?cursor=${encodeURIComponent(cursor)}` : '';
+    return fetch(`/playlist/${playlistId}${params}`).then(res => res.json());
+}
+
+function fetchCodePlaylistPage(code, cursor) {
+    return fetch('/access_playlist', {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify({ access_code: code, cursor: cursor })
+    }).then(res => res.json());
+}
+
+async function loadPlaylistContent(playlistId) {
+    try {
+        const data = await fetchPlaylistPage(playlistId);
+
+        if (data.success) {
+            showPlaylistModal(data.playlist, data.items, data.next_cursor,
+                              cursor => fetchPlaylistPage(playlistId, cursor));
+        } else {
+            showError(data.error);
+        }
+    } catch (error) {
+        showError('Error al cargar contenido');
+    }
+}
+
+function accessParams(playlist) {
+    return playlist.visibility === 'code' && playlist.access_code ?
+        `code=${encodeURIComponent(playlist.access_code)}` : '';
+}
+
+function mediaSrc(playlist, item) {
+    // Los enlaces de los CDNs caducan: /media los sirve desde la caché del servidor y los renueva
+    if (!/^https?:/.test(item.url)) return item.url;
+    const params = accessParams(playlist);
+    return `/media/${item.id}${params ? '?' + params : ''}`;
+}
+
+function thumbSrc(playlist, item, width = 320) {
+    // Miniatura reducida (AVIF/WebP) en lugar de la portada o la imagen a tamaño completo
+    // v cambia con la imagen de origen: la respuesta se cachea como inmutable
+    const params = accessParams(playlist);
+    const version = item.thumb_version ? `&v=${item.thumb_version}` : '';
+    return `/thumb/${item.id}?w=${width}${version}${params ? '&' + params : ''}`;
+}
+
+function renderPlaylistItem(playlist, item, idx) {
+    const src = mediaSrc(playlist, item);
+    const isAudio = item.media_type === 'mp3' || item.media_type === 'audio';
+    const isVideo = item.media_type === 'mp4' || item.media_type === 'video';
+    const isImage = item.media_type === 'jpg' || item.media_type === 'png' || item.media_type === 'image';
+
+    // Audio y vídeo sin src: lo pone el IntersectionObserver cuando la tarjeta se ve,
+    // y con preload="none" ni siquiera entonces se descarga nada hasta darle a reproducir
+    let mediaPreview = '';
+    if (isImage || item.thumbnail) {
+        mediaPreview = `<img src="${thumbSrc(playlist, item)}" alt="${item.title}" loading="lazy" decoding="async">`;
+    } else if (isAudio) {
+        mediaPreview = `
+            <div class="card-audio">
+                <p style="font-size: 48px; margin: 0;">🎵</p>
+                <audio controls preload="none" data-src="${src}" style="width:100%; margin-top: 10px;"></audio>
+            </div>
+        `;
+    } else if (isVideo) {
+        // Los vídeos subidos no traen portada: /thumb extrae un fotograma (el que se precalienta al subir)
+        const poster = item.url.startsWith('/downloads/') ? ` poster="${thumbSrc(playlist, item)}"` : '';
+        mediaPreview = `<video controls preload="none"${poster} data-src="${src}"></video>`;
+    }
+
+    return `
+        <div class="preview-card playlist-item-card" id="item-${item.id}" data-index="${idx}">
+            <div style="display: flex; justify-content: space-between; align-items: start;">
+                <h3 contenteditable="true"
+                    id="title-${item.id}"
+                    onblur="renameItem(${item.id}, this.textContent)"
+                    style="flex: 1; cursor: text; border: 2px dashed transparent; padding: 5px; border-radius: 5px;"
+                    onfocus="this.style.borderColor='#00f2ff'"
+                    onblur="this.style.borderColor='transparent'">
+                    ${idx + 1}. ${item.title}
+                </h3>
+                <span style="font-size: 12px; color: #aaa; margin-left: 10px;">✏️</span>
+            </div>
+            <div class="card-media">${mediaPreview}</div>
+            <p class="info-text">📁 Tipo: ${item.media_type.toUpperCase()}</p>
+            <p class="info-text">⏱️ Duración: ${item.duration || 'N/A'}</p>
+            <p class="info-text">📅 Añadido: ${new Date(item.added_at).toLocaleDateString()}</p>
+            <div class="card-actions">
+                <a href="${src}" class="download-link" download="${item.title}.${item.media_type}" target="_blank" style="flex: 1; text-align: center;">
+                    📥 Descargar
+                </a>
+                <button class="icon-btn" onclick="removeFromPlaylist(${playlist.id}, ${item.id})" style="background: rgba(255,0,0,0.2); border-color: #f55; color: #f55;">
+                    🗑️
+                </button>
+            </div>
+        </div>
+    `;
+}
+
+// Lista virtual: solo las filas visibles (más PLAYLIST_OVERSCAN_ROWS por encima y por debajo)
+// están en el DOM. Las tarjetas tienen alto fijo (.playlist-item-card) para poder calcular qué filas se ven.
+const PLAYLIST_ROW_HEIGHT = 440;  // alto de .playlist-item-card + gap de .playlist-window
+const PLAYLIST_MIN_CARD_WIDTH = 250;
+const PLAYLIST_OVERSCAN_ROWS = 2;
+
+function showPlaylistModal(playlist, items, nextCursor, fetchPage) {
+    const itemsHTML = items.length > 0 ? `
+        <div class="playlist-viewport" id="playlistItemsGrid">
+            <div class="playlist-spacer" id="playlistItemsSpacer">
+                <div class="playlist-window" id="playlistItemsWindow"></div>
+            </div>
+        </div>
+    ` : '<p style="text-align:center;color:#aaa;">Esta playlist está vacía</p>';
+
+    const shareHTML = playlist.visibility === 'code' ? `
+        <div style="background: rgba(255,165,0,0.2); padding: 15px; border-radius: 10px; margin: 20px 0;">
+            <p style="color: #fa0; font-weight: 600;">🔑 Código de Acceso:</p>
+            <p style="font-size: 24px; font-weight: 700; letter-spacing: 3px;">${playlist.access_code}</p>
+            <button class="icon-btn" onclick="copyCode('${playlist.access_code}')">📋 Copiar</button>
+        </div>
+    ` : playlist.visibility === 'public' ? `
+        <div style="background: rgba(0,255,0,0.2); padding: 15px; border-radius: 10px; margin: 20px 0;">
+            <p style="color: #0f0; font-weight: 600;">🌍 Esta playlist es pública</p>
+            <p style="font-size: 14px; color: #aaa;">Cualquiera puede verla</p>
+        </div>
+    ` : `
+        <div style="background: rgba(255,0,0,0.2); padding: 15px; border-radius: 10px; margin: 20px 0;">
+            <p style="color: #f55; font-weight: 600;">🔒 Esta playlist es privada</p>
+            <p style="font-size: 14px; color: #aaa;">Solo tú puedes verla</p>
+        </div>
+    `;
+
+    const modalHTML = `
+        <div class="modal active" id="playlistContentModal">
+            <div class="modal-content" style="max-width: 900px;">
+                <div class="modal-header">
+                    <div>
+                        <h2>${playlist.name}</h2>
+                        <p style="color: #aaa;">${playlist.description || 'Sin descripción'}</p>
+                    </div>
+                    <button class="close-modal" onclick="closePlaylistModal()">×</button>
+                </div>
+                ${shareHTML}
+
+                <!-- Botón para subir archivos -->
+                <div style="margin-bottom: 20px;">
+                    <input type="file" id="fileUpload-${playlist.id}" accept="audio/*,video/*,image/*" style="display:none;" onchange="uploadFile(${playlist.id})">
+                    <button class="submit-btn" onclick="document.getElementById('fileUpload-${playlist.id}').click()">
+                        📤 Subir Archivo desde Mi Dispositivo
+                    </button>
+                </div>
+
+                ${itemsHTML}
+                <div style="margin-top: 20px;">
+                    <button class="submit-btn" onclick="downloadAllPlaylist(${playlist.id})">📥 Descargar Todas</button>
+                    <button class="logout-btn" style="width:100%; margin-top:10px;" onclick="deletePlaylist(${playlist.id})">🗑️ Eliminar Playlist</button>
+                </div>
+            </div>
+        </div>
+    `;
+
+    document.body.insertAdjacentHTML('beforeend', modalHTML);
+
+    const viewport = document.getElementById('playlistItemsGrid');
+    playlistPager = {
+        playlist: playlist, cursor: nextCursor, fetchPage: fetchPage, items: items, loading: false,
+        start: 0, end: 0, columns: 0, frame: null, observer: createMediaObserver(viewport)
+    };
+    if (!viewport) return;
+    viewport.addEventListener('scroll', schedulePlaylistRender, { passive: true });
+    renderPlaylistWindow();
+    // Si la primera página no llena la lista se pide la siguiente sin esperar al scroll
+    loadMorePlaylistItems();
+}
+
+function createMediaObserver(root) {
+    if (!root || !window.IntersectionObserver) return null;
+    const observer = new IntersectionObserver(entries => {
+        entries.forEach(entry => {
+            if (!entry.isIntersecting) return;
+            entry.target.src = entry.target.dataset.src;
+            observer.unobserve(entry.target);
+        });
+    }, { root: root, rootMargin: '200px 0px' });
+    return observer;
+}
+
+function schedulePlaylistRender() {
+    const pager = playlistPager;
+    if (!pager || pager.frame) return;
+    // Un solo render por frame aunque lleguen muchos eventos de scroll
+    pager.frame = requestAnimationFrame(() => {
+        pager.frame = null;
+        renderPlaylistWindow();
+        loadMorePlaylistItems();
+    });
+}
+
+function buildPlaylistCards(pager, start, end) {
+    // Todas las tarjetas nuevas en un único parseo y un único fragmento
+    const template = document.createElement('template');
+    template.innerHTML = pager.items.slice(start, end)
+        .map((item, i) => renderPlaylistItem(pager.playlist, item, start + i)).join('');
+    template.content.querySelectorAll('[data-src]').forEach(media => {
+        if (pager.observer) pager.observer.observe(media);
+        else media.src = media.dataset.src;
+    });
+    return template.content;
+}
+
+function renderPlaylistWindow() {
+    const pager = playlistPager;
+    const viewport = document.getElementById('playlistItemsGrid');
+    if (!pager || !viewport) return;
+
+    const columns = Math.max(1, Math.floor(viewport.clientWidth / PLAYLIST_MIN_CARD_WIDTH));
+    const rows = Math.ceil(pager.items.length / columns);
+    const firstRow = Math.max(0, Math.floor(viewport.scrollTop / PLAYLIST_ROW_HEIGHT) - PLAYLIST_OVERSCAN_ROWS);
+    const lastRow = Math.min(rows,
+        Math.ceil((viewport.scrollTop + viewport.clientHeight) / PLAYLIST_ROW_HEIGHT) + PLAYLIST_OVERSCAN_ROWS);
+    const start = firstRow * columns;
+    const end = Math.min(pager.items.length, lastRow * columns);
+
+    document.getElementById('playlistItemsSpacer').style.height = `${rows * PLAYLIST_ROW_HEIGHT}px`;
+    if (start === pager.start && end === pager.end && columns === pager.columns) return;
+
+    const windowEl = document.getElementById('playlistItemsWindow');
+    if (columns !== pager.columns) {
+        windowEl.replaceChildren();
+        windowEl.style.gridTemplateColumns = `repeat(${columns}, 1fr)`;
+    }
+    windowEl.style.transform = `translateY(${firstRow * PLAYLIST_ROW_HEIGHT}px)`;
+
+    // Las tarjetas que siguen en rango no se tocan (un vídeo en reproducción sigue sonando)
+    Array.from(windowEl.children).forEach(card => {
+        const index = Number(card.dataset.index);
+        if (index >= start && index < end) return;
+        if (pager.observer) card.querySelectorAll('[data-src]').forEach(media => pager.observer.unobserve(media));
+        card.remove();
+    });
+    const first = windowEl.firstElementChild ? Number(windowEl.firstElementChild.dataset.index) : end;
+    const last = windowEl.lastElementChild ? Number(windowEl.lastElementChild.dataset.index) + 1 : end;
+    windowEl.prepend(buildPlaylistCards(pager, start, Math.min(first, end)));
+    windowEl.append(buildPlaylistCards(pager, Math.max(last, start), end));
+
+    pager.start = start;
+    pager.end = end;
+    pager.columns = columns;
+}
+
+async function loadMorePlaylistItems() {
+    const pager = playlistPager;
+    const grid = document.getElementById('playlistItemsGrid');
+    if (!pager || !pager.cursor || pager.loading || !grid) return;
+    if (grid.scrollTop + grid.clientHeight < grid.scrollHeight - 2 * PLAYLIST_ROW_HEIGHT) return;
+
+    pager.loading = true;
+    try {
+        const data = await pager.fetchPage(pager.cursor);
+        if (pager !== playlistPager) return;
+
+        if (data.success) {
+            pager.items = pager.items.concat(data.items);
+            pager.cursor = data.next_cursor;
+            renderPlaylistWindow();
+        } else {
+            pager.cursor = null;
+            showError(data.error);
+        }
+    } catch (error) {
+        showError('Error al cargar más elementos');
+        return;
+    } finally {
+        pager.loading = false;
+    }
+    loadMorePlaylistItems();
+}
+
+window.addEventListener('resize', schedulePlaylistRender);
+
+async function renameItem(itemId, newTitle) {
+    if (!newTitle || newTitle.trim() === '') {
+        showError('El título no puede estar vacío');
+        return;
+    }
+
+    try {
+        const response = await fetch('/rename_item', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({ 
+                item_id: itemId, 
+                new_title: newTitle.trim() 
+            })
+        });
+
+        const data = await response.json();
+
+        if (data.success) {
+            // La lista virtual vuelve a pintar las tarjetas desde playlistPager.items
+            const item = playlistPager && playlistPager.items.find(i => i.id === itemId);
+            if (item) item.title = newTitle.trim();
+            showSuccess('✏️ Título actualizado');
+        } else {
+            showError(data.error);
+        }
+    } catch (error) {
+        showError('Error al renombrar');
+    }
+}
+
+async function uploadFile(playlistId) {
+    const fileInput = document.getElementById(`fileUpload-${playlistId}`);
+    const file = fileInput.files[0];
+
+    if (!file) return;
+
+    // La subida se guarda en localStorage para poder reanudarla tras un corte o una recarga
+    const resumeKey = `upload:${playlistId}:${file.name}:${file.size}:${file.lastModified}`;
+
+    try {
+        showSuccess('📤 Subiendo archivo...');
+
+        let upload = null;
+        const savedId = localStorage.getItem(resumeKey);
+        if (savedId) {
+            const response = await fetch(`/uploads/${savedId}`);
+            const data = await response.json();
+            if (data.success && data.size === file.size) upload = data;
+        }
+        if (!upload) {
+            const response = await fetch('/uploads', {
+                method: 'POST',
+                headers: {'Content-Type': 'application/json'},
+                body: JSON.stringify({ playlist_id: playlistId, filename: file.name, size: file.size })
+            });
+            upload = await response.json();
+            if (!upload.success) {
+                showError(upload.error);
+                return;
+            }
+            localStorage.setItem(resumeKey, upload.upload_id);
+        }
+
+        await sendUploadChunks(upload, file);
+
+        const response = await fetch(`/uploads/${upload.upload_id}/finalize`, { method: 'POST' });
+        const data = await response.json();
+
+        if (data.success) {
+            localStorage.removeItem(resumeKey);
+            showSuccess('✅ Archivo subido exitosamente');
+            closePlaylistModal();
+            setTimeout(() => loadPlaylistContent(playlistId), 500);
+        } else {
+            showError(data.error);
+        }
+    } catch (error) {
+        showError('Error al subir archivo. Vuelve a seleccionarlo para reanudar la subida.');
+    }
+}
+
+async function sendUploadChunks(upload, file) {
+    let offset = upload.received;
+    let failures = 0;
+
+    while (offset < file.size) {
+        const chunk = file.slice(offset, offset + upload.chunk_size);
+        try {
+            const response = await fetch(`/uploads/${upload.upload_id}?offset=${offset}`, {
+                method: 'PUT',
+                headers: {'Content-Type': 'application/octet-stream'},
+                body: chunk
+            });
+            const data = await response.json();
+            // 409: el servidor tiene otro offset (p. ej. una parte quedó a medias), se sigue desde ahí
+            if (!data.success && response.status !== 409) throw new Error(data.error);
+            offset = data.received;
+            failures = 0;
+            showSuccess(`📤 Subiendo archivo... ${Math.floor(offset * 100 / file.size)}%`);
+        } catch (error) {
+            if (++failures > 5) throw error;
+            await new Promise(resolve => setTimeout(resolve, 1000 * failures));
+            const status = await fetch(`/uploads/${upload.upload_id}`).then(res => res.json());
+            if (!status.success) throw new Error(status.error);
+            offset = status.received;
+        }
+    }
+}
+
+function closePlaylistModal() {
+    if (playlistPager) {
+        if (playlistPager.observer) playlistPager.observer.disconnect();
+        if (playlistPager.frame) cancelAnimationFrame(playlistPager.frame);
+    }
+    playlistPager = null;
+    const modal = document.getElementById('playlistContentModal');
+    if (modal) modal.remove();
+}
+
+function copyCode(code) {
+    navigator.clipboard.writeText(code);
+    showSuccess('¡Código copiado al portapapeles!');
+}
+
+async function removeFromPlaylist(playlistId, itemId) {
+    if (!confirm('¿Eliminar este elemento?')) return;
+
+    try {
+        const response = await fetch('/remove_from_playlist', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({ item_id: itemId })
+        });
+
+        const data = await response.json();
+
+        if (data.success) {
+            showSuccess('Elemento eliminado');
+            closePlaylistModal();
+            loadPlaylistContent(playlistId);
+        } else {
+            showError(data.error);
+        }
+    } catch (error) {
+        showError('Error al eliminar');
+    }
+}
+
+async function deletePlaylist(playlistId) {
+    if (!confirm('¿Eliminar esta playlist completa?')) return;
+
+    try {
+        const response = await fetch('/delete_playlist', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({ playlist_id: playlistId })
+        });
+
+        const data = await response.json();
+
+        if (data.success) {
+            showSuccess('Playlist eliminada');
+            closePlaylistModal();
+            loadPlaylists();
+        } else {
+            showError(data.error);
+        }
+    } catch (error) {
+        showError('Error al eliminar playlist');
+    }
+}
+
+function downloadAllPlaylist(playlistId) {
+    // El servidor arma un único zip con todos los items (y un manifest.json con los que fallen)
+    const playlist = playlistPager && playlistPager.playlist.id === playlistId ? playlistPager.playlist : null;
+    const params = playlist ? accessParams(playlist) : '';
+    showSuccess('Preparando el archivo zip de la playlist...');
+    window.location.href = `/playlist/${playlistId}/archive${params ? '?' + params : ''}`;
+}
+
+function showAccessByCode() {
+    const modalHTML = `
+        <div class="modal active" id="accessCodeModal">
+            <div class="modal-content">
+                <div class="modal-header">
+                    <h2>🔑 Acceder con Código</h2>
+                    <button class="close-modal" onclick="closeAccessCodeModal()">×</button>
+                </div>
+                <div class="form-group">
+                    <label>Introduce el Código de Acceso</label>
+                    <input type="text" class="form-input" id="accessCodeInput" placeholder="XXXXXXXX" style="text-transform: uppercase;">
+                </div>
+                <button class="submit-btn" onclick="accessPlaylistByCode()">Acceder</button>
+            </div>
+        </div>
+    `;
+
+    document.body.insertAdjacentHTML('beforeend', modalHTML);
+}
+
+function closeAccessCodeModal() {
+    const modal = document.getElementById('accessCodeModal');
+    if (modal) modal.remove();
+}
+
+async function accessPlaylistByCode() {
+    const code = document.getElementById('accessCodeInput').value.toUpperCase();
+
+    if (!code) {
+        showError('Introduce un código');
+        return;
+    }
+
+    try {
+        const response = await fetch('/access_playlist', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({ access_code: code })
+        });
+
+        const data = await response.json();
+
+        if (data.success) {
+            closeAccessCodeModal();
+            showPlaylistModal(data.playlist, data.items, data.next_cursor,
+                              cursor => fetchCodePlaylistPage(code, cursor));
+        } else {
+            showError(data.error);
+        }
+    } catch (error) {
+        showError('Error al acceder');
+    }
+}
+
+async function checkSession() {
+    try {
+        const response = await fetch('/check_session');
+        const data = await response.json();
+
+        console.log('Estado de sesión:', data);
+
+        if (data.logged_in) {
+            document.getElementById('authSection').style.display = 'none';
+            document.getElementById('mainContent').classList.add('active');
+            document.getElementById('userInfo').classList.add('active');
+            document.getElementById('userDisplay').textContent = data.arobase;
+            return true;
+        } else {
+            document.getElementById('authSection').style.display = 'block';
+            document.getElementById('mainContent').classList.remove('active');
+            return false;
+        }
+    } catch (error) {
+        console.error('Error al verificar sesión:', error);
+        return false;
+    }
+}
+
+window.addEventListener('DOMContentLoaded', async () => {
+    console.log('Página cargada, verificando sesión...');
+    const isLoggedIn = await checkSession();
+    if (isLoggedIn) {
+        console.log('Usuario con sesión activa');
+    } else {
+        console.log('No hay sesión activa');
+    }
+});